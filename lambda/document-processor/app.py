@@ -1,76 +1,157 @@
 import os
-import lancedb
+import math
+import logging
 import boto3
 import urllib.parse
-import hashlib
-from boto3.dynamodb.conditions import Key
-from langchain.embeddings import BedrockEmbeddings
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.document_loaders import PyPDFLoader as PDFLoader
-from langchain.vectorstores import LanceDB
-
-import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import json
 
+from embedding import AdaptiveRateLimiter, EmbeddingEngine
+from embedding_cache import (
+    EMBEDDING_CACHE_BUCKET,
+    EMBEDDING_CACHE_ENABLED,
+    EmbeddingCache,
+    LocalLRUCache,
+    S3CacheStore,
+)
+from vectorstore import invalidate_user_table, open_user_table, reopen_user_table, sql_literal
+from fulltext import FTS_ENABLED, open_fulltext_index, reopen_fulltext_index
+from fanout import (
+    StagingStore,
+    commit_staged,
+    enqueue_parts,
+    is_fanout_record,
+    fanout_job_id,
+    plan_parts,
+    should_fan_out,
+)
+from maintenance import list_user_tables, maintain_table, read_cursor, rotate_tables, write_cursor
+from telemetry import count, emit_invocation, record_trace, span, timed_iter
+from throughput import DEFERRED_STATUS_CODE, DeadlineExceeded, ThroughputController, deferred_response
+from transfer import download_and_hash
+from notifier import Notifier
+from registry import INGEST_LEASE_SECONDS, DocumentRegistry, IngestionInProgress
+
+logger = logging.getLogger(__name__)
+
 # Set up environment variables
 aws_region = os.environ.get('AWS_REGION', 'us-west-2')
-WEBSOCKET_ENDPOINT = os.environ.get('WEBSOCKET_ENDPOINT').replace('wss://', 'https://')
 WEBSOCKET_STATE_TABLE = os.environ.get('DYNAMODB_WEBSOCKET_STATE_TABLE')
 SQS_QUEUE_URL = os.environ.get('SQS_QUEUE_URL')
 DOCUMENT_REGISTRY_TABLE = os.environ.get('DYNAMODB_DOCUMENT_REGISTRY_TABLE')
 MD5_BY_S3_PATH_INDEX = os.environ.get('DYNAMODB_MD5_BY_S3_PATH_INDEX')
 LANCEDB_BUCKET = os.environ.get('LANCEDB_BUCKET')
 EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL')
-EMBEDDING_SIZE = int(os.environ.get('EMBEDDING_SIZE'))
-
-
-# Initialize AWS clients
-dynamodb = boto3.client('dynamodb')
-dynamodb_resource = boto3.resource('dynamodb')
-s3_client = boto3.client('s3', region_name=aws_region)
-api_client = boto3.client('apigatewaymanagementapi', endpoint_url=WEBSOCKET_ENDPOINT)
-sqs_client = boto3.client('sqs')
-
-# Initialize langchain objects
-embeddings = BedrockEmbeddings(region_name=aws_region, model_id=EMBEDDING_MODEL)
-splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+# stop starting table maintenance when less time than this is left in the invocation
+MAINTENANCE_MIN_REMAINING_MS = int(os.environ.get('MAINTENANCE_MIN_REMAINING_MS', '60000'))
+# 'partial' returns batchItemFailures (needs ReportBatchItemFailures on the event source mapping),
+# 'delete' deletes the successful messages with delete_message_batch
+SQS_BATCH_RESPONSE = os.environ.get('SQS_BATCH_RESPONSE', 'delete')
+# number of users whose records are processed in parallel within a batch, 1 keeps it serial
+PROCESSING_CONCURRENCY = int(os.environ.get('PROCESSING_CONCURRENCY', '1'))
+
+# shared across warm invocations so the learned Bedrock request rate is kept
+embedding_rate_limiter = AdaptiveRateLimiter()
+# shared across warm invocations so the observed processing costs are kept
+throughput = ThroughputController()
+
+
+# Clients, models and heavy modules (langchain, pypdf, lancedb, pyarrow) are created or
+# imported on first use, so a cold start only pays for what the first event needs;
+# lru_cache keeps them for the lifetime of the container.
+
+def get_embedding_size():
+    embedding_size = os.environ.get('EMBEDDING_SIZE')
+    if not embedding_size:
+        raise ValueError("EMBEDDING_SIZE is not set")
+    return int(embedding_size)
+
+@lru_cache(maxsize=None)
+def get_dynamodb_client():
+    return boto3.client('dynamodb')
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client('s3', region_name=aws_region)
+
+@lru_cache(maxsize=None)
+def get_api_client():
+    websocket_endpoint = os.environ.get('WEBSOCKET_ENDPOINT')
+    if not websocket_endpoint:
+        raise ValueError("WEBSOCKET_ENDPOINT is not set")
+    return boto3.client('apigatewaymanagementapi', endpoint_url=websocket_endpoint.replace('wss://', 'https://'))
+
+@lru_cache(maxsize=None)
+def get_sqs_client():
+    return boto3.client('sqs')
+
+@lru_cache(maxsize=None)
+def get_text_splitter():
+    from chunking import get_splitter
+    return get_splitter()
+
+@lru_cache(maxsize=None)
+def get_embedding_engine():
+    from langchain.embeddings import BedrockEmbeddings
+    embeddings = BedrockEmbeddings(region_name=aws_region, model_id=EMBEDDING_MODEL)
+    return EmbeddingEngine(embeddings, rate_limiter=embedding_rate_limiter)
+
+@lru_cache(maxsize=None)
+def get_embedding_cache():
+    """Chunk level embedding cache: /tmp LRU tier + S3 tier shared by all containers."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    return EmbeddingCache(
+        EMBEDDING_MODEL,
+        get_embedding_size(),
+        local=LocalLRUCache(),
+        persistent=S3CacheStore(get_s3_client(), EMBEDDING_CACHE_BUCKET or LANCEDB_BUCKET)
+    )
 
-def download_object(bucket_name, object_key, download_path):
+def download_object(bucket_name, object_key, download_path, owner='', size=None):
+    """Download an object and compute md5(owner + bytes) while writing it."""
     try:
-        s3_client.download_file(bucket_name, object_key, download_path)
-        print(f"File downloaded to {download_path}")
-    except boto3.exceptions.S3DownloadError as e:
-        print(f"Error downloading object: {e}")
+        with span('download'):
+            result = download_and_hash(
+                get_s3_client(), bucket_name, object_key, download_path, owner.encode('utf-8'), size
+            )
+        count('bytes', result.size)
+        logger.debug(f"File downloaded to {download_path}")
+        return result
+    except Exception as e:
+        logger.error(f"Error downloading object: {e}")
         raise
 
 def create_directory_from_object_key(object_key):
     local_dir_path = os.path.join('/tmp', os.path.dirname(object_key))
     os.makedirs(local_dir_path, exist_ok=True)
-    print(f"Directory created at: {local_dir_path}")
+    logger.debug(f"Directory created at: {local_dir_path}")
     return local_dir_path
     
-def send_message(type, message, connection_id, level):
+def post_to_connection(connection_id, data):
     data = {
         'source': "ingest-lambda",
-        'type': type,
-        'message': message,
         'connectionId': connection_id,
-        'level': level
+        **data
     }
     params = {
         'ConnectionId': connection_id,
         'Data': json.dumps(data).encode()
     }
+    return get_api_client().post_to_connection(**params)
 
-    response = api_client.post_to_connection(**params)
-    return response
+def notify(cognito_sub, message, level):
+    """Queue a message to the WebSocket of a user, returns immediately and never raises."""
+    notifier.notify(cognito_sub.replace('%3A', ':'), message, level)
 
 def get_connection_id_from_user(cognito_sub):
 
     cognito_sub = cognito_sub.replace('%3A', ':')
     
     # Fetch the item from DynamoDB table using GetItem
-    response = dynamodb.get_item(
+    response = get_dynamodb_client().get_item(
         TableName=WEBSOCKET_STATE_TABLE,
         Key={
             'userId': {
@@ -87,150 +168,110 @@ def get_connection_id_from_user(cognito_sub):
 
     return connection_id
 
+# registry lookups are memoized per invocation, and prefetched for the whole SQS batch
+registry = DocumentRegistry(DOCUMENT_REGISTRY_TABLE, MD5_BY_S3_PATH_INDEX)
+
+# WebSocket notifications are sent by a background thread, connection ids are cached per invocation
+notifier = Notifier(get_connection_id_from_user, post_to_connection)
+
 def get_cognito_sub_from_s3_key(s3_key):
     # expecting 'private/cognito_sub/file.pdf'
     cognito_sub = s3_key.split('/')[1]
     return cognito_sub
 
-def calculate_md5(file_path, username):
-    """Calculate the MD5 hash of a file and the owner cognito_sub"""
-    hash_md5 = hashlib.md5()
-    hash_md5.update(username.encode('utf-8'))
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-def store_file_info(md5_hash, cognito_sub, s3_path, table_name):
-    """Store the MD5 hash, cognito_sub, and full S3 path in DynamoDB."""
-    table = dynamodb_resource.Table(table_name)
-    
-    response = table.put_item(
-        Item={
-            'md5': md5_hash,
-            'user': cognito_sub,
-            's3_path': s3_path
-        }
-    )
-    return response
-
-def delete_file_info(md5_hash, s3_path, table_name):
-    """Delete the file info from DynamoDB based on the MD5 hash and cognito_sub."""
-    print("from delete_file_info using md5_hash")
-    print(md5_hash)
-
-    table = dynamodb_resource.Table(table_name)
-    
-    response = table.delete_item(
-        Key={
-            'md5': f"{md5_hash}",
-            's3_path': f"{s3_path}"
-        }
-    )
-    return response
-
-def is_file_processed(md5_hash, s3_path, table_name):
-    """Check if the MD5 hash and S3 path already exist in DynamoDB."""
-    table = dynamodb_resource.Table(table_name)
+def get_s3_path(s3_record):
+    """Full S3 path of the object of a record, as stored in the document registry."""
+    bucket_name = s3_record['s3']['bucket']['name']
+    object_key = urllib.parse.unquote_plus(s3_record['s3']['object']['key'])
+    return f"s3://{bucket_name}/{object_key}"
 
-    response = table.query(
-        KeyConditionExpression=Key('md5').eq(md5_hash)
-    )
-    
-    items = response.get('Items', [])
-
-    print(f"Items: {items}")
-
-    return len(items) > 0
-
-def get_md5_by_s3_path(s3_path, table_name, index):
-    """Get the MD5 hash by the S3 path using the GSI."""
-
-    table = dynamodb_resource.Table(table_name)
-    response = table.query(
-        IndexName=index,
-        KeyConditionExpression=Key('s3_path').eq(s3_path)
-    )
-
-    print(f"Response: {response}")
-    
-    items = response.get('Items', [])
-    if items:
-        print(f"first item {items[0]}")
-        return items[0]['md5']
-    else:
-        return None
+def remove_local_file(file_path):
+    """Free /tmp once a downloaded object is no longer needed."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+def count_ingest_stats(ingest_stats):
+    """Add the counters of an ingestion to the trace of the record."""
+    count('chunks', ingest_stats.chunks)
+    count('embedding_calls', ingest_stats.embedding.calls)
+    count('embedding_retries', ingest_stats.embedding.retries)
+    count('embedding_throttles', ingest_stats.embedding.throttles)
+    count('cache_hits', ingest_stats.cache.hits)
+    count('cache_misses', ingest_stats.cache.misses)
+    count('chunks_reused', ingest_stats.reused)
+
+def ingest_lease_seconds():
+    """Lease of an ingestion started now: until the invocation times out, so that the retry of its message,
+    visible again only after the timeout, finds the lease expired."""
+    remaining = throughput.remaining_ms()
+    return INGEST_LEASE_SECONDS if remaining is None else math.ceil(remaining / 1000)
 
 def single_lambda_handler_create(record):
-    print("single_lambda_handler_create :: record")
-    print(record)
+    logger.debug("single_lambda_handler_create :: record")
+    logger.debug(record)
 
     # Extract bucket name and object key from the record
     bucket_name = record['s3']['bucket']['name']
     object_key = record['s3']['object']['key']
     cognito_sub = get_cognito_sub_from_s3_key(object_key)
-    full_s3_path = f"s3://{bucket_name}/{object_key}"
+    full_s3_path = get_s3_path(record)
 
-    print(f"cognito_sub: {cognito_sub}")
+    logger.debug(f"cognito_sub: {cognito_sub}")
 
     object_key = urllib.parse.unquote_plus(object_key)
     local_dir_path = create_directory_from_object_key(object_key)
     local_file_path = os.path.join(local_dir_path, os.path.basename(object_key))
+    # object keys are private/<cognito_sub>/<file>
+    display_name = '/'.join(object_key.split('/')[2:])
 
-        # get connection id for user
+    logger.debug(f"Object key: {object_key}")
+    logger.debug(f"Local file path: {local_file_path}")
+    logger.debug(f"Local directory path: {local_dir_path}")
+
+    # fast path: the same object (ETag and size) was already ingested from this path,
+    # the registry is keyed on md5(user+bytes) so this skips the download and the hash
+    object_etag = record['s3']['object'].get('eTag')
+    object_size = record['s3']['object'].get('size')
     try:
-        connection_id = get_connection_id_from_user(cognito_sub)
-        print(f"Connection ID: {connection_id} for user {cognito_sub}")
+        if registry.is_object_processed(full_s3_path, object_etag, object_size):
+            logger.info(f"File {object_key} has already been processed for user {cognito_sub}, skipping download")
+            notify(cognito_sub, f"{object_key} has already been processed", "info")
+            return {
+                'statusCode': 200,
+                'body': 'File already processed',
+                'type': 'create',
+                'document': object_key
+            }
     except Exception as e:
-        print(f"Error getting connection ID for user {cognito_sub}: {e}, user {cognito_sub} is flying blind")
-        connection_id = None
-
-    print(f"Object key: {object_key}")
-    print(f"Local file path: {local_file_path}")
-    print(f"Local directory path: {local_dir_path}")
+        # not fatal, the md5 check below still catches duplicates
+        logger.warning(f"Error checking the registry for {object_key} by ETag: {e}")
 
     try:
-        download_object(bucket_name, object_key, local_file_path)
+        download = download_object(bucket_name, object_key, local_file_path, cognito_sub, object_size)
     except Exception as e:
-        print(f"Error downloading object: {e}")
-        if connection_id:
-            send_message("message", f"Error injesting object: {object_key}", connection_id, "error")
+        logger.error(f"Error downloading object: {e}")
+        notify(cognito_sub, f"Error injesting object: {object_key}", "error")
         return {
             'statusCode': 500,
             'body': 'Failed to download object',
             'type': 'create',
             'document': object_key
         }
-    md5_hash = calculate_md5(local_file_path, cognito_sub)
-    print(f"MD5 hash: {md5_hash}")
+    md5_hash = download.md5
+    logger.debug(f"MD5 hash: {md5_hash}")
     
     # send message to user <ingestion started>
-    try:
-        if connection_id:
-            send_message(
-                "message", 
-                f"Started ingesting {'/'.join(object_key.split('/')[2:])}", 
-                connection_id, 
-                "info"
-            )
-    except Exception as e:
-        # can't remember why this is needed :(
-        print(f"Error splitting object_key into just the file name: {e}")
-        if connection_id:
-            send_message(
-                "message", 
-                f"Started ingesting {object_key}", 
-                connection_id, 
-                "info"
-            )
+    notify(cognito_sub, f"Started ingesting {display_name}", "info")
 
     # check if file has been processed already 
     # collision if md5(user+file)
     try:
-        if is_file_processed(md5_hash, object_key, DOCUMENT_REGISTRY_TABLE):
-            print(f"File {object_key} has already been processed for user {cognito_sub}")
-            if connection_id:
-                send_message("message", f"{object_key} has already been processed", connection_id, "info")
+        if registry.is_file_processed(md5_hash):
+            logger.info(f"File {object_key} has already been processed for user {cognito_sub}")
+            remove_local_file(local_file_path)
+            notify(cognito_sub, f"{object_key} has already been processed", "info")
             return {
                 'statusCode': 200,
                 'body': 'File already processed',
@@ -238,11 +279,11 @@ def single_lambda_handler_create(record):
                 'document': object_key
             }
         else:
-            print(f"File {object_key} has not been processed yet")
+            logger.info(f"File {object_key} has not been processed yet")
     except Exception as e:
-        print(f"Error checking if file {object_key} has been processed: {e}")
-        if connection_id:
-            send_message("message", f"Error checking if file {object_key} has been processed", connection_id, "error")
+        logger.error(f"Error checking if file {object_key} has been processed: {e}")
+        remove_local_file(local_file_path)
+        notify(cognito_sub, f"Error checking if file {object_key} has been processed", "error")
         return {
             'statusCode': 500,
             'body': 'Failed to check if file has been processed',
@@ -250,145 +291,287 @@ def single_lambda_handler_create(record):
             'document': object_key
         }
 
-    # store file info in DynamoDB
+    # an earlier version of the object stored under the same path is updated in place
     try:
-        store_file_info(md5_hash, cognito_sub, f"s3://{bucket_name}/{object_key}", DOCUMENT_REGISTRY_TABLE)
+        previous_versions = [
+            item for item in registry.get_file_infos_by_s3_path(full_s3_path) if item['md5'] != md5_hash
+        ]
+    except Exception as e:
+        logger.warning(f"Error looking up previous versions of {object_key}: {e}")
+        previous_versions = []
+
+    # store file info in DynamoDB, conditionally: a concurrent delivery of the same object
+    # may have passed the check above too, only one of them ingests
+    resumed = None
+    lease_seconds = ingest_lease_seconds()
+    try:
+        stored = registry.store_file_info(
+            md5_hash, cognito_sub, full_s3_path, download.etag, download.size, lease_seconds
+        )
+        if not stored:
+            # an earlier delivery stopped before committing (timeout, error), this one takes over
+            resumed = registry.resume_ingestion(md5_hash, full_s3_path, lease_seconds)
+    except IngestionInProgress as e:
+        # not committed yet, the retry of the message finds it committed or takes it over
+        logger.info(f"File {object_key} is being processed by another delivery: {e}")
+        remove_local_file(local_file_path)
+        return {
+            'statusCode': 500,
+            'body': 'File is being processed by another delivery',
+            'type': 'create',
+            'document': object_key
+        }
     except Exception as e:
-        print(f"Error storing file info in DynamoDB: {e}")
-        if connection_id:
-            send_message("message", f"Failed to ingest {'/'.join(object_key.split('/')[2:])}", connection_id, "error")
+        logger.error(f"Error storing file info in DynamoDB: {e}")
+        remove_local_file(local_file_path)
+        notify(cognito_sub, f"Failed to ingest {display_name}", "error")
         return {
             'statusCode': 500,
             'body': 'Failed to store file info in DynamoDB',
             'type': 'create',
             'document': object_key
         }
-
-    # Initialize PDFLoader and load documents
-    loader = PDFLoader(local_file_path)
-    docs = loader.load()
-    docs = splitter.split_documents(docs)
+    if not stored and resumed is None:
+        logger.info(f"File {object_key} was committed by another delivery")
+        remove_local_file(local_file_path)
+        return {
+            'statusCode': 200,
+            'body': 'File already processed',
+            'type': 'create',
+            'document': object_key
+        }
 
     lance_table = cognito_sub.replace('%3A', ':')
-    print(f"attempting to store vectors in {lance_table}")
-
-    # Define the directory where embeddings will be stored
-    db_path = f"s3://{LANCEDB_BUCKET}/embeddings/{lance_table}"
-    db, table = None, None
-
-    schema = pa.schema(
-        [
-            pa.field("vector", pa.list_(pa.float32(), EMBEDDING_SIZE)),
-            pa.field("text", pa.string()),
-            pa.field("id", pa.string()),
-            pa.field("source", pa.string()),
-            pa.field("page", pa.string())
-        ]
-    )
+    logger.info(f"attempting to store vectors in {lance_table}")
 
-    # Connect to LanceDB and create or open table
-    try:
-        db = lancedb.connect(db_path)
-        table = db.create_table(lance_table, schema=schema)
-    except Exception as e:
-        print(f"Table already exists, opening it: {e}")
-        table = db.open_table(lance_table)
+    # Stream pages -> chunks -> embedding batches -> LanceDB appends
+    # langchain and pypdf are only needed from here on, not on the duplicate/delete paths
+    from pipeline import INGEST_BATCH_SIZE, count_pdf_pages, ingest_pdf, ingest_pdf_update
 
+    table = None
+    fulltext = None
     try:
-        LanceDB.from_documents(docs, embeddings, connection=table)
+        # the table handle is cached across warm invocations, and created on first ingest
+        table = open_user_table(LANCEDB_BUCKET, lance_table, get_embedding_size())
+        if FTS_ENABLED:
+            fulltext = open_fulltext_index(LANCEDB_BUCKET, lance_table, create=True)
+        # large documents are split into parts embedded by separate invocations
+        if SQS_QUEUE_URL:
+            page_count = count_pdf_pages(local_file_path)
+            if should_fan_out(page_count, download.size):
+                fanout_job = fanout_job_id(md5_hash, full_s3_path, int(resumed.get('attempts', 0)) if resumed else 0)
+                job = {
+                    'job': fanout_job,
+                    'bucket': bucket_name,
+                    'key': object_key,
+                    'etag': download.etag,
+                    'md5': md5_hash,
+                    's3_path': full_s3_path,
+                    'owner': cognito_sub,
+                    'previous': [item['md5'] for item in previous_versions]
+                }
+                ranges = plan_parts(page_count)
+                job['parts'] = len(ranges)
+                registry.start_fanout(md5_hash, full_s3_path, fanout_job, len(ranges))
+                enqueue_parts(get_sqs_client(), SQS_QUEUE_URL, job, ranges)
+                logger.info(f"Split {object_key} ({page_count} pages) into {len(ranges)} parts")
+                count('fanout_parts', len(ranges))
+                remove_local_file(local_file_path)
+                notify(cognito_sub, f"Ingesting {display_name} in {len(ranges)} parts", "info")
+                return {
+                    'statusCode': 200,
+                    'body': 'Document split into parts.',
+                    'document': object_key,
+                    'type': 'create',
+                    'fanout': {'job': fanout_job, 'parts': len(ranges)}
+                }
+        # only the chunks that changed since the previous version, or that an interrupted
+        # delivery did not write, are embedded and written
+        if resumed is not None:
+            logger.info(f"Resuming {object_key} from {resumed.get('chunks_committed', 0)} chunks")
+            count('chunks_resumed', int(resumed.get('chunks_committed', 0)))
+        ingest = ingest_pdf_update if previous_versions or resumed is not None else ingest_pdf
+
+        def checkpoint(chunks):
+            registry.checkpoint(md5_hash, full_s3_path, chunks)
+            # stop between batches rather than at the timeout, the retry resumes from here
+            throughput.check_deadline()
+
+        ingest_stats = ingest(
+            local_file_path, get_text_splitter(), table, get_embedding_engine(), get_embedding_cache(), INGEST_BATCH_SIZE,
+            progress=lambda fraction: notifier.progress(
+                lance_table, display_name, fraction, f"Ingesting {display_name}: {int(fraction * 100)}%"
+            ),
+            fulltext=fulltext,
+            checkpoint=checkpoint
+        )
+        logger.info(f"Ingestion stats: {ingest_stats.as_dict()}")
+        count_ingest_stats(ingest_stats)
+        remove_local_file(local_file_path)
+        registry.commit_file_info(md5_hash, full_s3_path, ingest_stats.reused + ingest_stats.chunks)
     except Exception as e:
-        print(f"Error with LanceDB: {e}")
-        if connection_id:
-            send_message("message", f"Failed to ingest {'/'.join(object_key.split('/')[2:])}", connection_id, "error")
-
+        stopped = isinstance(e, DeadlineExceeded)
+        if stopped:
+            logger.warning(f"Stopping the ingestion of {object_key} before the timeout: {e}")
+        else:
+            logger.error(f"Error with LanceDB: {e}")
+        remove_local_file(local_file_path)
+        # the rows written so far stay, the retry of the message resumes after them
+        invalidate_user_table(LANCEDB_BUCKET, lance_table)
         try:
-            delete_file_info(md5_hash, full_s3_path, DOCUMENT_REGISTRY_TABLE)
+            registry.release(md5_hash, full_s3_path)
         except Exception as e:
-            print(f"Error deleting file info from DynamoDB: {e}")
-            if connection_id:
-                send_message("message", f"Failed to ingest {'/'.join(object_key.split('/')[2:])}", connection_id, "error")
-            return {
-                'statusCode': 500,
-                'body': 'Failed to ingest file and deleting info from DynamoDB!',
-                'type': 'create',
-                'document': object_key
-            }
+            logger.error(f"Error releasing file info in DynamoDB: {e}")
 
-        try:
-            if connection_id:
-                send_message("message", f"Failed to ingest {'/'.join(object_key.split('/')[2:])}", connection_id, "error")
-        except Exception as e:
-            print(f"Error splitting object_key into just the file name: {e}")
-            if connection_id:
-                send_message(
-                    "message", 
-                    f"Failed to ingest {object_key}", 
-                    connection_id, 
-                    "error"
-                )
+        if stopped:
+            notify(cognito_sub, f"Paused ingesting {display_name}, it resumes shortly", "info")
+        else:
+            notify(cognito_sub, f"Failed to ingest {display_name}", "error")
         return {
             'statusCode': 500,
             'body': 'Some document failed to process',
             'document': object_key,
             'type': 'create',
-            'error': e
+            'error': str(e)
         }
-    try:
-        if connection_id:
-            send_message(
-                "message", 
-                f"Finished ingesting {'/'.join(object_key.split('/')[2:])}", 
-                connection_id, 
-                "success"
-            )
-    except Exception as e:
-        print(f"Error splitting object_key into just the file name: {e}")
-        if connection_id:
-            send_message(
-                "message", 
-                f"Finished ingesting {object_key}", 
-                connection_id, 
-                "success"
-            )
+    if previous_versions:
+        # the rows of the previous version are gone from LanceDB, so are its registry rows
+        for item in previous_versions:
+            try:
+                registry.delete_file_info(item['md5'], full_s3_path)
+            except Exception as e:
+                logger.error(f"Error deleting file info of the previous version of {object_key}: {e}")
+        logger.info(
+            f"Updated {object_key}: {ingest_stats.reused} chunks reused, "
+            f"{ingest_stats.chunks} embedded, {ingest_stats.removed} removed"
+        )
+        notify(
+            cognito_sub,
+            f"Finished updating {display_name}, {ingest_stats.reused} of "
+            f"{ingest_stats.reused + ingest_stats.chunks} chunks unchanged",
+            "success"
+        )
+    else:
+        notify(cognito_sub, f"Finished ingesting {display_name}", "success")
     return {
         'statusCode': 200,
         'body': 'Documents processed and embeddings stored successfully.',
         'document': object_key,
-        'type': 'create'
+        'type': 'create',
+        'update': bool(previous_versions),
+        'ingest': ingest_stats.as_dict()
     }
 
+def single_lambda_handler_fanout_part(record):
+    """Embed the page range of one part of a fan-out job, and commit the job when it is the last part.
+
+    Parts stage their rows on S3 instead of writing to the user table; the
+    registry row of the document counts the parts done, and the part that
+    completes the count writes the staged rows, one part at a time. A part whose
+    job is gone (document deleted or overwritten, job already committed) is
+    dropped.
+    """
+    from pipeline import embed_pdf_pages
+
+    job = record['fanout']
+    object_key = job['key']
+    cognito_sub = job['owner']
+    part = job['part']
+    display_name = '/'.join(object_key.split('/')[2:])
+    lance_table = cognito_sub.replace('%3A', ':')
+    local_file_path = os.path.join(create_directory_from_object_key(object_key), os.path.basename(object_key))
+    response = {'type': 'fanout', 'document': object_key, 'job': job['job'], 'part': part}
+
+    try:
+        download = download_object(job['bucket'], object_key, local_file_path, cognito_sub)
+    except Exception as e:
+        logger.error(f"Error downloading part {part} of {object_key}: {e}")
+        return dict(response, statusCode=500, body='Failed to download object')
+    if download.md5 != job['md5']:
+        # overwritten since the job started, the new version has its own job
+        remove_local_file(local_file_path)
+        logger.info(f"Dropping part {part} of {object_key}, the object changed")
+        return dict(response, statusCode=200, body='Superseded')
+
+    staging = StagingStore(get_s3_client(), LANCEDB_BUCKET)
+    try:
+        table = open_user_table(LANCEDB_BUCKET, lance_table, get_embedding_size())
+        rows, ingest_stats = embed_pdf_pages(
+            local_file_path, job['first_page'], job['last_page'], get_text_splitter(), table.schema,
+            get_embedding_engine(), get_embedding_cache(),
+            # a part stopped before the timeout is embedded again by its retry
+            on_batch=lambda batch: throughput.check_deadline()
+        )
+        remove_local_file(local_file_path)
+        with span('staging_write'):
+            staging.put(job['job'], part, rows)
+        count_ingest_stats(ingest_stats)
+        progress = registry.complete_fanout_part(job['md5'], job['s3_path'], job['job'], part)
+    except Exception as e:
+        logger.error(f"Error processing part {part} of {object_key}: {e}")
+        remove_local_file(local_file_path)
+        return dict(response, statusCode=500, body='Failed to process part', error=str(e))
+
+    if progress is None:
+        logger.info(f"Dropping part {part} of {object_key}, its job is gone")
+        return dict(response, statusCode=200, body='Superseded')
+    done, parts = progress
+    if done < parts:
+        notifier.progress(
+            lance_table, display_name, done / parts, f"Ingesting {display_name}: {done} of {parts} parts"
+        )
+        return dict(response, statusCode=200, body='Part staged.')
+
+    fulltext = None
+    try:
+        if FTS_ENABLED:
+            fulltext = open_fulltext_index(LANCEDB_BUCKET, lance_table, create=True)
+        # parts are read as they are written, only one is held in memory
+        staged = timed_iter((staging.get(job['job'], index) for index in range(parts)), 'staging_read')
+        chunks, added, removed = commit_staged(table, staged, local_file_path, fulltext)
+        registry.finish_fanout(job['md5'], job['s3_path'], job['job'], chunks)
+    except Exception as e:
+        # the message is retried, the count is complete so the retry commits again
+        logger.error(f"Error committing {object_key}: {e}")
+        invalidate_user_table(LANCEDB_BUCKET, lance_table)
+        return dict(response, statusCode=500, body='Failed to commit parts', error=str(e))
+
+    try:
+        for md5_hash in job.get('previous', []):
+            registry.delete_file_info(md5_hash, job['s3_path'])
+        staging.delete(job['job'], parts)
+    except Exception as e:
+        # rows are committed; a redelivery commits nothing new, and the staging prefix expires
+        logger.error(f"Error cleaning up the job of {object_key}: {e}")
+    logger.info(f"Committed {object_key} from {parts} parts: {added} rows added, {removed} removed")
+    count('chunks_committed', added)
+    notify(cognito_sub, f"Finished ingesting {display_name}", "success")
+    return dict(response, statusCode=200, body='Documents processed and embeddings stored successfully.',
+                added=added, removed=removed)
+
 def single_lambda_handler_delete(record):
-    print(record)
+    logger.debug(record)
 
     # Extract bucket name and object key from the record
     bucket_name = record['s3']['bucket']['name']
     object_key = urllib.parse.unquote_plus(record['s3']['object']['key']).replace('%3A', ':')
     cognito_sub = get_cognito_sub_from_s3_key(object_key)
-    s3_full_path = f"s3://{bucket_name}/{object_key}"
+    s3_full_path = get_s3_path(record)
     filename = os.path.basename(object_key)
 
-    print(f"s3_full_path {s3_full_path}")
-
-    try:
-        connection_id = get_connection_id_from_user(cognito_sub)
-        print(f"Connection ID: {connection_id} for user {cognito_sub}")
-    except Exception as e:
-        print(f"Error getting connection ID for user {cognito_sub}: {e}, user is flying blind")
-        connection_id = None
+    logger.debug(f"s3_full_path {s3_full_path}")
 
     lance_table = cognito_sub.replace('%3A', ':')
 
-    md5_hash = get_md5_by_s3_path(
-        s3_full_path, DOCUMENT_REGISTRY_TABLE, MD5_BY_S3_PATH_INDEX
-    )
+    # a failed or resumed update can leave the rows of several versions under the path
+    md5_hashes = [item['md5'] for item in registry.get_file_infos_by_s3_path(s3_full_path)]
 
-    print("HERE IS THE MD5 *************************************************")
-    print(f"retrieved md5 {md5_hash}")
+    logger.debug("HERE IS THE MD5 *************************************************")
+    logger.debug(f"retrieved md5 {md5_hashes}")
 
-    if md5_hash is None:
-        print(f"File {s3_full_path} has already been deleted from vector db")
-        if connection_id:
-            send_message("message", f"File {filename} successfuly deleted from vector db", connection_id, "info")
+    if not md5_hashes:
+        logger.info(f"File {s3_full_path} has already been deleted from vector db")
+        notify(cognito_sub, f"File {filename} successfuly deleted from vector db", "info")
         return {
             'statusCode': 200,
             'body': 'File has already been delete from vector db',
@@ -396,47 +579,47 @@ def single_lambda_handler_delete(record):
             'document': object_key
         }
 
-    print(f"attempting to delete vectors from {lance_table} for user {cognito_sub}")
-
-    # Define the directory where embeddings will be stored
-    db_path = f"s3://{LANCEDB_BUCKET}/embeddings/{lance_table}"
+    logger.info(f"attempting to delete vectors from {lance_table} for user {cognito_sub}")
 
     source_name = f"/tmp/{object_key}"
-    # Connect to LanceDB and create or open table
-    try:
-        db = lancedb.connect(db_path)
-        table = db.open_table(lance_table)
-    except Exception as e:
-        print(f"Error opening LanceDB Table: {e}")
-        send_message("message", f"Failed to delete {filename}", connection_id, "error")
-
     try:
-        table.delete("source = '{}'".format(source_name))
+        table = open_user_table(LANCEDB_BUCKET, lance_table)
+        if table is None:
+            logger.info(f"LanceDB table {lance_table} does not exist, nothing to delete")
+        else:
+            with span('lancedb_delete'):
+                table.delete(f"source = {sql_literal(source_name)}")
+                # with FTS_ENABLED turned off the index is left alone, a forced maintenance run syncs it again
+                fulltext = open_fulltext_index(LANCEDB_BUCKET, lance_table) if FTS_ENABLED else None
+                if fulltext is not None:
+                    fulltext.delete(f"source = {sql_literal(source_name)}")
     except Exception as e:
-        print(f"Error deleting the source ON VECTOR DATABASE: {source_name}", e)
-        send_message("message", f"Failed to delete {filename}", connection_id, "error")
+        logger.error(f"Error deleting the source ON VECTOR DATABASE: {source_name}: {e}")
+        invalidate_user_table(LANCEDB_BUCKET, lance_table)
+        notify(cognito_sub, f"Failed to delete {filename}", "error")
         return {
             'statusCode': 500,
             'body': 'Failed to delete the documents',
             'document': source_name,
             'type': 'delete',
-            'error': e
+            'error': str(e)
         }
 
     try:
-        print(f"attempting to delete from DDB : {md5_hash} {s3_full_path}")
-        delete_file_info(md5_hash, s3_full_path,  DOCUMENT_REGISTRY_TABLE)
-        send_message("message", f"Finished deleting {filename}", connection_id, "success")
-        print(f"Finished deleting {object_key} with hash {md5_hash}")
+        for md5_hash in md5_hashes:
+            logger.debug(f"attempting to delete from DDB : {md5_hash} {s3_full_path}")
+            registry.delete_file_info(md5_hash, s3_full_path)
+        notify(cognito_sub, f"Finished deleting {filename}", "success")
+        logger.info(f"Finished deleting {object_key} with hash {', '.join(md5_hashes)}")
     except Exception as e:
-        print(f"Error deleting file info from DynamoDB: {e}")
-        send_message("message", f"Failed to delete {filename}", connection_id, "error")
+        logger.error(f"Error deleting file info from DynamoDB: {e}")
+        notify(cognito_sub, f"Failed to delete {filename}", "error")
         return {
             'statusCode': 500,
             'body': 'Failed to delete the documents',
             'document': source_name,
             'type': 'delete',
-            'error': e
+            'error': str(e)
         }
 
     return {
@@ -448,6 +631,303 @@ def single_lambda_handler_delete(record):
         'type': 'delete'
     }
 
+def bulk_lambda_handler_delete(records):
+    """Delete many documents of the same user at once.
+
+    Issues a single `source IN (...)` delete on the user's LanceDB table and
+    removes the registry rows with batch_write_item, instead of one LanceDB
+    commit and one delete_item per document. Returns one response per record,
+    shaped like the ones of single_lambda_handler_delete.
+    """
+    documents = []
+    for record in records:
+        bucket_name = record['s3']['bucket']['name']
+        object_key = urllib.parse.unquote_plus(record['s3']['object']['key']).replace('%3A', ':')
+        documents.append({
+            'bucket': bucket_name,
+            'object_key': object_key,
+            's3_full_path': get_s3_path(record),
+            'filename': os.path.basename(object_key),
+            'source_name': f"/tmp/{object_key}"
+        })
+
+    cognito_sub = get_cognito_sub_from_s3_key(documents[0]['object_key'])
+    lance_table = cognito_sub.replace('%3A', ':')
+    logger.info(f"bulk deleting {len(documents)} documents from {lance_table}")
+
+    responses = [None] * len(documents)
+    pending = []
+    for index, document in enumerate(documents):
+        try:
+            md5_hashes = [item['md5'] for item in registry.get_file_infos_by_s3_path(document['s3_full_path'])]
+        except Exception as e:
+            logger.error(f"Error getting md5 for {document['s3_full_path']}: {e}")
+            responses[index] = {
+                'statusCode': 500,
+                'body': 'Failed to delete the documents',
+                'document': document['source_name'],
+                'type': 'delete',
+                'error': str(e)
+            }
+            continue
+        if not md5_hashes:
+            logger.info(f"File {document['s3_full_path']} has already been deleted from vector db")
+            responses[index] = {
+                'statusCode': 200,
+                'body': 'File has already been delete from vector db',
+                'type': 'delete',
+                'document': document['object_key']
+            }
+            continue
+        document['md5_hashes'] = md5_hashes
+        pending.append(index)
+
+    if pending:
+        sources = ', '.join(sql_literal(documents[index]['source_name']) for index in pending)
+        try:
+            table = open_user_table(LANCEDB_BUCKET, lance_table)
+            if table is None:
+                logger.info(f"LanceDB table {lance_table} does not exist, nothing to delete")
+            else:
+                with span('lancedb_delete'):
+                    table.delete(f"source IN ({sources})")
+                    fulltext = open_fulltext_index(LANCEDB_BUCKET, lance_table) if FTS_ENABLED else None
+                    if fulltext is not None:
+                        fulltext.delete(f"source IN ({sources})")
+        except Exception as e:
+            logger.error(f"Error bulk deleting sources ON VECTOR DATABASE for {lance_table}: {e}")
+            invalidate_user_table(LANCEDB_BUCKET, lance_table)
+            for index in pending:
+                responses[index] = {
+                    'statusCode': 500,
+                    'body': 'Failed to delete the documents',
+                    'document': documents[index]['source_name'],
+                    'type': 'delete',
+                    'error': str(e)
+                }
+            pending = []
+
+    failed_keys = set(registry.delete_file_infos([
+        (md5_hash, documents[index]['s3_full_path']) for index in pending for md5_hash in documents[index]['md5_hashes']
+    ]))
+
+    for index in pending:
+        document = documents[index]
+        if any((md5_hash, document['s3_full_path']) in failed_keys for md5_hash in document['md5_hashes']):
+            responses[index] = {
+                'statusCode': 500,
+                'body': 'Failed to delete the documents',
+                'document': document['source_name'],
+                'type': 'delete',
+                'error': 'Failed to delete file info from DynamoDB'
+            }
+        else:
+            responses[index] = {
+                'statusCode': 200,
+                'body': 'Documents deleted successfully.',
+                'document': document['source_name'],
+                'object_key': document['object_key'],
+                'bucket': document['bucket'],
+                'type': 'delete'
+            }
+
+    for document, response in zip(documents, responses):
+        if response['statusCode'] == 200:
+            notify(cognito_sub, f"Finished deleting {document['filename']}", "success")
+        else:
+            notify(cognito_sub, f"Failed to delete {document['filename']}", "error")
+
+    return responses
+
+def process_s3_record(s3_record):
+    """Dispatch a single S3 event record, returns None for unhandled event types."""
+    event_name = s3_record['eventName']
+    s3_bucket = s3_record['s3']['bucket']['name']
+    s3_object_key = s3_record['s3']['object']['key']
+
+    logger.debug("RECEIVING S3 OBJECT KEY")
+    logger.debug(s3_object_key)
+
+    if event_name.startswith("ObjectCreated"):
+        logger.info(f"Object created in bucket {s3_bucket}: {s3_object_key}")
+        operation, handler = 'create', single_lambda_handler_create
+    elif is_fanout_record(s3_record):
+        operation, handler = 'fanout_part', single_lambda_handler_fanout_part
+    elif event_name.startswith("ObjectRemoved"):
+        logger.info(f"Object deleted from bucket {s3_bucket}: {s3_object_key}")
+        operation, handler = 'delete', single_lambda_handler_delete
+    else:
+        return None
+
+    with record_trace(operation, s3_object_key) as trace:
+        response = handler(s3_record)
+        trace.status = response['statusCode']
+    # the costs of the record tune which records the next ones can take on
+    throughput.observe(trace)
+    return response
+
+def get_user_table_key(s3_record):
+    """Key of the LanceDB table an S3 record writes to, i.e. its owner's cognito_sub."""
+    object_key = urllib.parse.unquote_plus(s3_record['s3']['object']['key'])
+    try:
+        return get_cognito_sub_from_s3_key(object_key).replace('%3A', ':')
+    except IndexError:
+        return object_key
+
+def is_known_object(s3_record):
+    """True when the object of a create record was already ingested, from the registry rows
+    prefetched for the batch."""
+    if not s3_record['eventName'].startswith("ObjectCreated"):
+        return False
+    s3_object = s3_record['s3']['object']
+    try:
+        return registry.is_object_processed(get_s3_path(s3_record), s3_object.get('eTag'), s3_object.get('size'))
+    except Exception:
+        return False
+
+def is_delete_record(s3_record):
+    return s3_record['eventName'].startswith("ObjectRemoved")
+
+def run_user_records(s3_records):
+    """Process the records of one user in order.
+
+    Consecutive deletes of the same user are handled together by
+    bulk_lambda_handler_delete; a create in between splits them, so a delete
+    never overtakes a create. Once a record does not fit in the time left,
+    it and the records after it are not started, to keep their order.
+    """
+    responses = []
+    index = 0
+    while index < len(s3_records):
+        if not throughput.admit(s3_records[index], is_known_object(s3_records[index])):
+            throughput.defer(len(s3_records) - index - 1)
+            responses.extend(deferred_response(s3_record) for s3_record in s3_records[index:])
+            break
+        end = index
+        while (
+            end < len(s3_records) and is_delete_record(s3_records[end])
+            and get_user_table_key(s3_records[end]) == get_user_table_key(s3_records[index])
+        ):
+            end += 1
+        if end - index > 1:
+            with record_trace('bulk_delete', get_user_table_key(s3_records[index])) as trace:
+                trace.count('documents', end - index)
+                bulk_responses = bulk_lambda_handler_delete(s3_records[index:end])
+                trace.status = max(response['statusCode'] for response in bulk_responses)
+            responses.extend(bulk_responses)
+            index = end
+        else:
+            responses.append(process_s3_record(s3_records[index]))
+            index += 1
+    return responses
+
+def run_s3_records(s3_records, concurrency=PROCESSING_CONCURRENCY):
+    """Process S3 records and return their responses in the same order.
+
+    Records are grouped per user, i.e. per LanceDB table. Records of the same
+    user are processed one after another, in the order they were received,
+    while users run in parallel on up to `concurrency` worker threads. Like in the serial loop, an unexpected exception fails the
+    whole invocation.
+    """
+    groups = {}
+    for index, s3_record in enumerate(s3_records):
+        groups.setdefault(get_user_table_key(s3_record), []).append(index)
+
+    results = [None] * len(s3_records)
+
+    def run_group(indexes):
+        responses = run_user_records([s3_records[index] for index in indexes])
+        for index, response in zip(indexes, responses):
+            results[index] = response
+
+    if concurrency <= 1 or len(groups) <= 1:
+        for indexes in groups.values():
+            run_group(indexes)
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(groups))) as executor:
+            list(executor.map(run_group, groups.values()))
+
+    return results
+
+def delete_messages(successes):
+    """Delete processed messages from the queue, 10 receipt handles per request."""
+    for start in range(0, len(successes), 10):
+        entries = [
+            {'Id': str(index), 'ReceiptHandle': success['receipt_handle']}
+            for index, success in enumerate(successes[start:start + 10])
+        ]
+        logger.info(f"Deleting {len(entries)} messages from the queue")
+        try:
+            response = get_sqs_client().delete_message_batch(QueueUrl=SQS_QUEUE_URL, Entries=entries)
+        except Exception as e:
+            logger.error(f"Error deleting messages from queue: {e}")
+            continue
+        for failed in response.get('Failed', []):
+            logger.error(f"Error deleting message from queue: {failed}")
+
+def maintenance_handler(event, context):
+    '''
+    compacts fragments, cleans up old versions and builds the IVF-PQ index
+    of the per-user LanceDB tables, each step only when the table needs it.
+
+    triggered by the EventBridge schedule for every table, or manually with
+    {"maintenance": {"tables": ["<cognito_sub>"], "force": true}}
+
+    scheduled runs start after the last table the previous run got to,
+    so tables late in the listing are reached even when runs stop early
+    '''
+    options = event.get('maintenance') or {}
+    scheduled = not options.get('tables')
+    if scheduled:
+        s3_client = get_s3_client()
+        tables = rotate_tables(list_user_tables(s3_client, LANCEDB_BUCKET), read_cursor(s3_client, LANCEDB_BUCKET))
+    else:
+        tables = options['tables']
+    force = options.get('force', False)
+
+    reports = {}
+    failures = {}
+    skipped = []
+    last_table = None
+    for lance_table in tables:
+        if context and context.get_remaining_time_in_millis() < MAINTENANCE_MIN_REMAINING_MS:
+            skipped.append(lance_table)
+            continue
+        last_table = lance_table
+        try:
+            table = open_user_table(LANCEDB_BUCKET, lance_table)
+            if table is None:
+                continue
+            reports[lance_table] = maintain_table(
+                table,
+                get_embedding_size(),
+                reopen=lambda name=lance_table: reopen_user_table(LANCEDB_BUCKET, name),
+                force=force,
+                # creates and backfills the index of tables ingested before it existed
+                fulltext=open_fulltext_index(LANCEDB_BUCKET, lance_table, create=True) if FTS_ENABLED else None,
+                reopen_fulltext=lambda name=lance_table: reopen_fulltext_index(LANCEDB_BUCKET, name)
+            )
+            logger.info(f"Maintenance report for {lance_table}: {reports[lance_table]}")
+        except Exception as e:
+            logger.error(f"Error maintaining LanceDB table {lance_table}: {e}")
+            invalidate_user_table(LANCEDB_BUCKET, lance_table)
+            failures[lance_table] = str(e)
+
+    if skipped:
+        logger.warning(f"Ran out of time, tables left for the next run: {skipped}")
+    if scheduled and last_table is not None:
+        try:
+            write_cursor(get_s3_client(), LANCEDB_BUCKET, last_table)
+        except Exception as e:
+            logger.error(f"Error saving the maintenance cursor: {e}")
+
+    return {
+        'statusCode': 500 if failures else 200,
+        'tables': reports,
+        'failures': failures,
+        'skipped': skipped
+    }
+
 def lambda_handler(event, context):
     '''
     processing all messages from the batch from the queue
@@ -461,119 +941,140 @@ def lambda_handler(event, context):
 
     unhandled s3 events should always be zero, becuase we are filtering for 
     create or delete events. As of now, we'll ignore unhandled events.
+
+    with SQS_BATCH_RESPONSE=partial the failed messages are returned as
+    batchItemFailures and lambda deletes the rest, otherwise the successful
+    messages are deleted here in batches of 10.
+
+    records that would not finish before the timeout are not started, their
+    messages fail like failed ones and are received again.
     '''
 
+    # scheduled maintenance shares the function, and its reserved concurrency,
+    # so it never runs concurrently with ingestion
+    if 'maintenance' in event or event.get('source') == 'aws.events':
+        return maintenance_handler(event, context)
+
+    notifier.start_invocation()
+    registry.start_invocation()
+
     successes = []
     failures = []
     unhandled = []
 
-    print(event)
-    print(os.environ)
+    logger.debug(event)
+    logger.debug({k: v for k, v in os.environ.items() if 'SECRET' not in k and 'TOKEN' not in k})
 
+    messages = []
+    tasks = []
+    overdue = []
     for record in event['Records']:
         message_id = record['messageId']
         receipt_handle = record['receiptHandle']
         body = record['body']
 
-        local_successes = []
-        local_failures = []
-        local_unhandled = []
-        
         # Print out the message details
-        print(f"Message ID: {message_id}")
-        print(f"Receipt Handle: {receipt_handle}")
-        print(f"Body: {body}")
-        
+        logger.debug(f"Message ID: {message_id}")
+        logger.debug(f"Receipt Handle: {receipt_handle}")
+        logger.debug("Body: %s", body)
+
         # Parse the S3 event from the body
         s3_event = json.loads(body)
-        
+        messages.append((record, s3_event))
+
         for s3_record in s3_event['Records']:
-            
-            event_name = s3_record['eventName']
-            s3_bucket = s3_record['s3']['bucket']['name']
-            s3_object_key = s3_record['s3']['object']['key']
-
-            print("RECEIVING S3 OBJECT KEY")
-            print(s3_object_key)
-            
-            if event_name.startswith("ObjectCreated"):
-                print(f"Object created in bucket {s3_bucket}: {s3_object_key}")
-                # Process object creation event
-                response = single_lambda_handler_create(s3_record)
-                if response['statusCode'] == 200:
-                    local_successes.append({
-                        "s3_record": s3_record,
-                        "response": response
-                    })
-                elif response['statusCode'] == 500:
-                    local_failures.append({
-                        "s3_record": s3_record,
-                        "response": response
-                    })
-                else:
-                    local_unhandled.append({
-                        "s3_record": s3_record,
-                        "response": response
-                    })
-
-            elif event_name.startswith("ObjectRemoved"):
-                print(f"Object deleted from bucket {s3_bucket}: {s3_object_key}")
-                # Process object deletion event
-                response = single_lambda_handler_delete(s3_record)
-                if response['statusCode'] == 200:
-                    local_successes.append({
-                        "s3_record": s3_record,
-                        "response": response
-                    })
-                elif response['statusCode'] == 500:
-                    local_failures.append({
-                        "s3_record": s3_record,
-                        "response": response
-                    })
-                else:
-                    local_unhandled.append({
-                        "s3_record": s3_record,
-                        "response": response
-                    })
-                
-            else:
+            tasks.append(s3_record)
+        if int(record.get('attributes', {}).get('ApproximateReceiveCount', '1')) >= throughput.max_receives:
+            overdue.extend(s3_event['Records'])
+
+    throughput.start_invocation(context, len(tasks), overdue)
+
+    # one parallel round of GSI queries instead of one query per record on the critical path
+    registry.prefetch_s3_paths(
+        get_s3_path(s3_record) for s3_record in tasks
+        if s3_record.get('eventName', '').startswith(('ObjectCreated', 'ObjectRemoved'))
+    )
+
+    results = run_s3_records(tasks, PROCESSING_CONCURRENCY)
+    # the container is frozen once the handler returns, send the queued notifications first
+    notifier.flush()
+
+    task_index = 0
+    for record, s3_event in messages:
+        message_id = record['messageId']
+        receipt_handle = record['receiptHandle']
+        body = record['body']
+
+        local_successes = []
+        local_failures = []
+        local_deferred = []
+        local_unhandled = []
+
+        for s3_record in s3_event['Records']:
+            response = results[task_index]
+            task_index += 1
+
+            if response is None:
                 local_unhandled.append(s3_record)
-    
-        print(local_successes)
-        print(local_failures)
-        print(local_unhandled)
-        
-        if len(local_failures) == 0:
-            successes.append({
-                "message_id": message_id,
-                "receipt_handle": receipt_handle,
-                "body": body,
-                "s3_event": s3_event,
-                "local_successes": local_successes,
-                "local_failures": local_failures,
-                "local_unhandled": local_unhandled
-            })
-    
-    # Delete the successful message from the queue
-    print(successes)
-    for success in successes:
-        print("GLOBAL SUCCESS")
-        print(success)
-        print(f"Deleting message with receipt handle {success['receipt_handle']}")
-        try:
-            sqs_client.delete_message(
-                QueueUrl=SQS_QUEUE_URL,
-                ReceiptHandle=success['receipt_handle']
-            )
-        except Exception as e:
-            print(f"Error deleting message from queue: {e}")
+            elif response['statusCode'] == 200:
+                local_successes.append({
+                    "s3_record": s3_record,
+                    "response": response
+                })
+            elif response['statusCode'] == 500:
+                local_failures.append({
+                    "s3_record": s3_record,
+                    "response": response
+                })
+            elif response['statusCode'] == DEFERRED_STATUS_CODE:
+                local_deferred.append({
+                    "s3_record": s3_record,
+                    "response": response
+                })
+            else:
+                local_unhandled.append({
+                    "s3_record": s3_record,
+                    "response": response
+                })
+
+        logger.debug(local_successes)
+        logger.debug(local_failures)
+        logger.debug(local_unhandled)
+
+        message_status = {
+            "message_id": message_id,
+            "receipt_handle": receipt_handle,
+            "body": body,
+            "s3_event": s3_event,
+            "local_successes": local_successes,
+            "local_failures": local_failures,
+            "local_deferred": local_deferred,
+            "local_unhandled": local_unhandled
+        }
+        if len(local_failures) == 0 and len(local_deferred) == 0:
+            successes.append(message_status)
+        else:
+            failures.append(message_status)
+
+    logger.debug(successes)
 
     status = {
         'success': successes,
         'failures': failures,
-        'unhandled': unhandled
+        'unhandled': unhandled,
+        # backpressure metrics, to tune the batch size and concurrency of the event source mapping
+        'throughput': emit_invocation(throughput.summary(embedding_rate_limiter.rate))
     }
 
-    print(status)
+    if SQS_BATCH_RESPONSE == 'partial':
+        # Lambda deletes every message that is not reported as failed
+        status['batchItemFailures'] = [
+            {'itemIdentifier': failure['message_id']} for failure in failures
+        ]
+    else:
+        # Delete the successful messages from the queue
+        delete_messages(successes)
+
+    logger.debug(status)
 
-    return status
\ No newline at end of file
+    return status
@@ -0,0 +1,97 @@
+"""Compare the chunking strategies on a local corpus.
+
+Reports, per strategy, the chunks produced, the Bedrock calls needed to embed
+them, chunk sizes in characters and estimated tokens, and splitting
+throughput. The corpus is a directory of .pdf and .txt files; without one,
+synthetic PDFs are generated. Example:
+
+    python benchmarks/bench_chunking.py --corpus ~/docs --strategies character token
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain.schema import Document  # noqa: E402
+
+from chunking import DEFAULT_CHUNK_SETTINGS, estimate_tokens, get_splitter  # noqa: E402
+from pipeline import iter_pdf_pages  # noqa: E402
+from fakes import write_synthetic_pdf  # noqa: E402
+
+
+def load_corpus(directory):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*'), recursive=True)):
+        if path.lower().endswith('.pdf'):
+            pages.extend(iter_pdf_pages(path))
+        elif path.lower().endswith('.txt'):
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages.append(Document(page_content=f.read(), metadata={'source': path, 'page': 0}))
+    return pages
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def run_strategy(strategy, pages, batch_size, chunk_size=None, chunk_overlap=None):
+    splitter = get_splitter(strategy, chunk_size, chunk_overlap)
+    start = time.monotonic()
+    chunks = []
+    for page in pages:
+        chunks.extend(splitter.split_documents([page]))
+    elapsed = time.monotonic() - start
+
+    chars = [len(chunk.page_content) for chunk in chunks]
+    tokens = [estimate_tokens(chunk.page_content) for chunk in chunks]
+    input_chars = sum(len(page.page_content) for page in pages)
+    return {
+        'chunk_size': splitter._chunk_size,
+        'chunk_overlap': splitter._chunk_overlap,
+        'chunks': len(chunks),
+        'embedding_calls': math.ceil(len(chunks) / batch_size),
+        'embedded_chars_ratio': round(sum(chars) / input_chars, 3) if input_chars else None,
+        'chars_p50': percentile(chars, 0.5),
+        'chars_max': max(chars, default=0),
+        'tokens_p50': percentile(tokens, 0.5),
+        'tokens_max': max(tokens, default=0),
+        'mib_per_second': round(input_chars / 2**20 / elapsed, 2) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='directory with .pdf/.txt files')
+    parser.add_argument('--synthetic-pages', type=int, default=200)
+    parser.add_argument('--strategies', nargs='+', default=list(DEFAULT_CHUNK_SETTINGS))
+    parser.add_argument('--embedding-batch-size', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = args.corpus
+        if not corpus:
+            write_synthetic_pdf(os.path.join(workdir, 'synthetic.pdf'), args.synthetic_pages)
+            corpus = workdir
+        pages = load_corpus(corpus)
+
+        results = {
+            'pages': len(pages),
+            'input_chars': sum(len(page.page_content) for page in pages),
+            'strategies': {
+                strategy: run_strategy(strategy, pages, args.embedding_batch_size)
+                for strategy in args.strategies
+            }
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare serial embedding with the concurrent, rate-limited EmbeddingEngine.
+
+Runs entirely offline against FakeEmbedder, e.g.
+
+    python benchmarks/bench_embedding.py --chunks 400 --latency 0.08 --quota-rps 40
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from embedding import AdaptiveRateLimiter, EmbeddingEngine, EmbeddingStats  # noqa: E402
+from fakes import FakeEmbedder  # noqa: E402
+
+
+def run_serial(embedder, texts):
+    start = time.monotonic()
+    for text in texts:
+        while True:
+            try:
+                embedder.embed_documents([text])
+                break
+            except Exception:
+                time.sleep(0.2)
+    return time.monotonic() - start
+
+
+def run_engine(embedder, texts, concurrency, max_rps):
+    limiter = AdaptiveRateLimiter(max_rate=max_rps)
+    engine = EmbeddingEngine(embedder, concurrency=concurrency, rate_limiter=limiter)
+    stats = EmbeddingStats()
+    start = time.monotonic()
+    engine.embed(texts, stats)
+    result = stats.as_dict()
+    result['wall'] = round(time.monotonic() - start, 3)
+    result['final_rate'] = round(limiter.rate, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--quota-rps', type=float, default=None)
+    parser.add_argument('--max-rps', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    texts = [f"chunk {i} " * 50 for i in range(args.chunks)]
+    results = {'chunks': args.chunks, 'latency': args.latency, 'quota_rps': args.quota_rps}
+
+    embedder = FakeEmbedder(size=16, latency=args.latency, quota_rps=args.quota_rps)
+    results['serial_wall'] = round(run_serial(embedder, texts), 3)
+
+    results['engine'] = {}
+    for concurrency in args.concurrency:
+        embedder = FakeEmbedder(size=16, latency=args.latency, quota_rps=args.quota_rps)
+        results['engine'][concurrency] = run_engine(embedder, texts, concurrency, args.max_rps)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Vector-only versus BM25 versus hybrid (reciprocal rank fusion) retrieval.
+
+Indexes a corpus in a user table and its full-text index, in a temporary
+LanceDB directory, runs every query with `retrieval.search` (vector only),
+`FullTextIndex.search` (BM25 only) and `retrieval.hybrid_search`, and
+reports hit rate@k, MRR and p50 latency per query kind.
+
+The corpus is one of:
+    --corpus DIR --queries FILE.jsonl   PDF and text files split like the processor does, and
+                                        queries {"query": ..., "expected": ...}: a chunk is
+                                        relevant when its text contains `expected`
+    (default)                           synthetic chunks with invoice numbers and part codes,
+                                        queried by code ("keyword") and by words ("semantic")
+
+Vectors come from a bag-of-words embedder, or from Bedrock with --bedrock
+(EMBEDDING_MODEL and AWS credentials). Example:
+
+    python benchmarks/bench_hybrid.py --chunks 5000 --queries 200 --k 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+
+from fakes import WORDS, BagOfWordsEmbedder  # noqa: E402
+from fulltext import FullTextIndex, get_fts_schema  # noqa: E402
+from retrieval import hybrid_search, search  # noqa: E402
+from vectorstore import get_schema  # noqa: E402
+
+TOPICS = [
+    "engine pump valve pressure coolant filter gasket seal".split(),
+    "invoice payment credit tax amount due remittance bank".split(),
+    "warranty claim defect return repair period coverage terms".split(),
+    "delivery shipment carrier tracking pallet freight customs dock".split(),
+    "safety hazard protective equipment training incident report".split(),
+]
+
+
+def synthetic_corpus(chunks, seed):
+    """Chunks about a topic, each citing an invoice number and a part code."""
+    rng = random.Random(seed)
+    texts = []
+    codes = []
+    for index in range(chunks):
+        topic = TOPICS[index % len(TOPICS)]
+        invoice = f"INV-{2020 + index % 5}-{rng.randrange(100000):05d}"
+        part = f"PN-{chr(65 + rng.randrange(26))}{rng.randrange(10000):04d}"
+        words = [rng.choice(topic if rng.random() < 0.6 else WORDS) for _ in range(60)]
+        words.insert(rng.randrange(len(words)), f"invoice {invoice}")
+        words.insert(rng.randrange(len(words)), f"part {part}")
+        texts.append(' '.join(words))
+        codes.append((invoice, part))
+    return texts, codes
+
+
+def synthetic_queries(texts, codes, count, seed):
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(count):
+        index = rng.randrange(len(texts))
+        invoice, part = codes[index]
+        if rng.random() < 0.5:
+            code = invoice if rng.random() < 0.5 else part
+            queries.append({'kind': 'keyword', 'query': f"details of {code}", 'expected': code})
+        else:
+            words = [word for word in texts[index].split() if not any(c.isdigit() for c in word)]
+            sample = ' '.join(rng.sample(words, min(12, len(words))))
+            queries.append({'kind': 'semantic', 'query': sample, 'expected': None, 'index': index})
+    return queries
+
+
+def load_corpus(directory):
+    from chunking import get_splitter
+    from pipeline import iter_chunks, iter_pdf_pages
+    splitter = get_splitter()
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.lower().endswith('.pdf'):
+            texts.extend(doc.page_content for doc in iter_chunks(iter_pdf_pages(path), splitter))
+        elif name.lower().endswith(('.txt', '.md')):
+            with open(path, encoding='utf-8') as f:
+                texts.extend(splitter.split_text(f.read()))
+    return texts
+
+
+def relevant_ids(query, texts):
+    if query.get('expected') is None:
+        return {f"chunk-{query['index']}"}
+    return {f"chunk-{index}" for index, text in enumerate(texts) if query['expected'] in text}
+
+
+def build_tables(db, texts, embedder, batch_size=64):
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embedder.embed_documents(texts[start:start + batch_size]))
+    table = db.create_table('bench', schema=get_schema(len(vectors[0])))
+    ids = [f"chunk-{index}" for index in range(len(texts))]
+    table.add([
+        {'vector': vector, 'text': text, 'id': row_id, 'source': 'corpus', 'page': '0'}
+        for vector, text, row_id in zip(vectors, texts, ids)
+    ])
+    fulltext = FullTextIndex(db.create_table('bench__fts', schema=get_fts_schema()))
+    fulltext.add(ids, ['corpus'] * len(ids), texts)
+    return table, fulltext
+
+
+def evaluate(queries, texts, retrieve, k):
+    by_kind = {}
+    for query in queries:
+        expected = relevant_ids(query, texts)
+        start = time.monotonic()
+        found = retrieve(query)[:k]
+        elapsed = (time.monotonic() - start) * 1000
+        rank = next((position for position, row_id in enumerate(found, start=1) if row_id in expected), None)
+        stats = by_kind.setdefault(query.get('kind', 'query'), {'hits': 0, 'rr': 0.0, 'timings': []})
+        stats['hits'] += rank is not None
+        stats['rr'] += 1 / rank if rank else 0.0
+        stats['timings'].append(elapsed)
+    results = {}
+    for kind, stats in sorted(by_kind.items()):
+        count = len(stats['timings'])
+        stats['timings'].sort()
+        results[kind] = {
+            'queries': count,
+            'hit_rate': round(stats['hits'] / count, 3),
+            'mrr': round(stats['rr'] / count, 3),
+            'latency_ms_p50': round(stats['timings'][count // 2], 2)
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=None, help='directory of PDF / text files')
+    parser.add_argument('--queries-file', dest='queries_file', default=None, help='JSON lines queries of --corpus')
+    parser.add_argument('--chunks', type=int, default=2000, help='synthetic corpus size')
+    parser.add_argument('--queries', type=int, default=100, help='synthetic queries')
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--candidates', type=int, default=20, help='rows of each search fused by hybrid search')
+    parser.add_argument('--dims', type=int, default=256, help='bag-of-words embedding size')
+    parser.add_argument('--bedrock', action='store_true', help='embed with Bedrock instead')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.corpus:
+        texts = load_corpus(args.corpus)
+        with open(args.queries_file) as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    else:
+        texts, codes = synthetic_corpus(args.chunks, args.seed)
+        queries = synthetic_queries(texts, codes, args.queries, args.seed)
+
+    if args.bedrock:
+        from langchain.embeddings import BedrockEmbeddings
+        embedder = BedrockEmbeddings(
+            region_name=os.environ.get('AWS_REGION', 'us-west-2'), model_id=os.environ.get('EMBEDDING_MODEL')
+        )
+    else:
+        embedder = BagOfWordsEmbedder(args.dims)
+
+    import lancedb
+    table, fulltext = build_tables(lancedb.connect(tempfile.mkdtemp()), texts, embedder)
+    query_vectors = {id(query): embedder.embed_query(query['query']) for query in queries}
+
+    results = {
+        'vector': evaluate(
+            queries, texts,
+            lambda query: [row['id'] for row in search(table, query_vectors[id(query)], args.k)], args.k
+        ),
+        'bm25': evaluate(
+            queries, texts, lambda query: [row_id for row_id, _ in fulltext.search(query['query'], args.k)], args.k
+        ),
+        'hybrid': evaluate(
+            queries, texts,
+            lambda query: [
+                row['id'] for row in hybrid_search(
+                    table, fulltext, query['query'], query_vectors[id(query)], args.k, candidates=args.candidates
+                )
+            ],
+            args.k
+        ),
+    }
+    print(json.dumps({
+        'corpus': args.corpus or 'synthetic',
+        'chunks': len(texts),
+        'postings': fulltext.table.count_rows(),
+        'k': args.k,
+        'candidates': args.candidates,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
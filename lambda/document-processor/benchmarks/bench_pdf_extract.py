@@ -0,0 +1,82 @@
+"""Serial versus multi-process PDF text extraction.
+
+Extracts synthetic PDFs of growing page counts serially and with
+`pipeline.iter_pdf_pages_parallel`, checks that both yield the same pages in
+the same order, and reports the smallest page count from which every
+parallel setting is faster than serial. Run it with the memory size of the
+function, e.g. on a 10240 MB Lambda or a 6 vCPU machine. Example:
+
+    python benchmarks/bench_pdf_extract.py --pages 8 32 64 256 1000 --processes 2 4 6
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.monotonic()
+        result = fn()
+        elapsed = time.monotonic() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def signature(pages):
+    return [(page.metadata['page'], page.page_content) for page in pages]
+
+
+def main():
+    # imported here rather than at the top: the extraction processes import this script
+    # again as their main module, and would otherwise load langchain too
+    from pipeline import PDF_PAGES_PER_TASK, iter_pdf_pages, iter_pdf_pages_parallel
+    from fakes import write_synthetic_pdf
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, nargs='+', default=[8, 16, 32, 64, 128, 256, 512, 1000])
+    parser.add_argument('--processes', type=int, nargs='+', default=[2, 4, 6])
+    parser.add_argument('--lines-per-page', type=int, default=60)
+    parser.add_argument('--pages-per-task', type=int, default=PDF_PAGES_PER_TASK)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for pages in args.pages:
+            path = write_synthetic_pdf(
+                os.path.join(workdir, f"synthetic-{pages}.pdf"), pages, lines_per_page=args.lines_per_page
+            )
+            serial_wall, serial_pages = timed(lambda: signature(iter_pdf_pages(path)), args.repeat)
+            row = {'pages': pages, 'serial': round(serial_wall, 3), 'parallel': {}}
+            for processes in args.processes:
+                wall, parallel_pages = timed(
+                    lambda: signature(iter_pdf_pages_parallel(path, pages, processes, args.pages_per_task)),
+                    args.repeat
+                )
+                if parallel_pages != serial_pages:
+                    raise AssertionError(f"{processes} processes changed the pages of a {pages} page PDF")
+                row['parallel'][processes] = {'wall': round(wall, 3), 'speedup': round(serial_wall / wall, 2)}
+            results.append(row)
+
+    crossover = next(
+        (row['pages'] for row in results if all(p['speedup'] > 1 for p in row['parallel'].values())),
+        None
+    )
+    print(json.dumps({
+        'cpu_count': os.cpu_count(),
+        'lines_per_page': args.lines_per_page,
+        'pages_per_task': args.pages_per_task,
+        'crossover_pages': crossover,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Peak memory and throughput of the streaming ingestion pipeline.
+
+Generates synthetic multi-hundred-page PDFs and ingests them twice: the way
+the handler used to (load every page, split everything, embed everything, one
+write) and through `pipeline.ingest_pdf`. Example:
+
+    python benchmarks/bench_pipeline.py --pages 200 500 --batch-size 64 --table lancedb
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain.document_loaders import PyPDFLoader  # noqa: E402
+from langchain.text_splitter import CharacterTextSplitter  # noqa: E402
+
+from embedding import AdaptiveRateLimiter, EmbeddingEngine  # noqa: E402
+from pipeline import build_rows, ingest_pdf  # noqa: E402
+from fakes import CountingTable, FakeEmbedder, write_synthetic_pdf  # noqa: E402
+
+EMBEDDING_SIZE = 1024
+
+
+def make_table(kind, workdir, name):
+    if kind == 'memory':
+        return CountingTable()
+    import lancedb
+    import pyarrow as pa
+    schema = pa.schema([
+        pa.field("vector", pa.list_(pa.float32(), EMBEDDING_SIZE)),
+        pa.field("text", pa.string()),
+        pa.field("id", pa.string()),
+        pa.field("source", pa.string()),
+        pa.field("page", pa.string())
+    ])
+    return lancedb.connect(os.path.join(workdir, name)).create_table(name, schema=schema)
+
+
+def run_legacy(path, splitter, table, engine):
+    docs = splitter.split_documents(PyPDFLoader(path).load())
+    vectors = engine.embed([doc.page_content for doc in docs])
+    table.add(build_rows(docs, vectors))
+    return len(docs)
+
+
+def run_streaming(path, splitter, table, engine, batch_size):
+    return ingest_pdf(path, splitter, table, engine, None, batch_size).chunks
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.monotonic()
+    chunks = fn()
+    wall = time.monotonic() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'chunks': chunks,
+        'wall': round(wall, 3),
+        'chunks_per_second': round(chunks / wall, 1) if wall else None,
+        'peak_mib': round(peak / 2**20, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, nargs='+', default=[100, 300, 600])
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--chunk-overlap', type=int, default=200)
+    parser.add_argument('--table', choices=['memory', 'lancedb'], default='memory')
+    args = parser.parse_args()
+
+    splitter = CharacterTextSplitter(
+        separator='\n', chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for pages in args.pages:
+            path = write_synthetic_pdf(os.path.join(workdir, f"synthetic-{pages}.pdf"), pages)
+            engine = EmbeddingEngine(
+                FakeEmbedder(size=EMBEDDING_SIZE, latency=0, jitter=0),
+                rate_limiter=AdaptiveRateLimiter(max_rate=100000)
+            )
+            legacy_table = make_table(args.table, workdir, f"legacy{pages}")
+            streaming_table = make_table(args.table, workdir, f"streaming{pages}")
+            results.append({
+                'pages': pages,
+                'file_mib': round(os.path.getsize(path) / 2**20, 2),
+                'legacy': measure(lambda: run_legacy(path, splitter, legacy_table, engine)),
+                'streaming': measure(lambda: run_streaming(path, splitter, streaming_table, engine, args.batch_size)),
+            })
+
+    print(json.dumps({'batch_size': args.batch_size, 'table': args.table, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
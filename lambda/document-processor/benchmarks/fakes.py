@@ -0,0 +1,454 @@
+"""Local stand-ins used by the document processor benchmarks."""
+import hashlib
+import re
+import random
+import struct
+import threading
+import time
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+
+class FakeThrottlingError(Exception):
+    """Mimics the botocore ClientError raised by Bedrock when throttled."""
+
+    def __init__(self, message="An error occurred (ThrottlingException): Too many requests"):
+        super().__init__(message)
+        self.response = {'Error': {'Code': 'ThrottlingException', 'Message': message}}
+
+
+def fake_vector(text, size):
+    """Deterministic pseudo-embedding of `text` with values in [-1, 1]."""
+    values = []
+    counter = 0
+    while len(values) < size:
+        digest = hashlib.sha256(f"{counter}:{text}".encode('utf-8')).digest()
+        values.extend(struct.unpack('>8i', digest))
+        counter += 1
+    return [v / 2**31 for v in values[:size]]
+
+
+class FakeEmbedder:
+    """Deterministic embedder that simulates Bedrock latency and throttling.
+
+    `quota_rps` models the account level request quota: requests above it
+    raise `FakeThrottlingError`, like InvokeModel does. `failure_rate` is
+    the fraction of requests failing with a non retryable error, which
+    fails the ingestion of the document midway.
+    """
+
+    def __init__(self, size=1024, latency=0.05, jitter=0.01, quota_rps=None, failure_rate=0.0):
+        self.size = size
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_rps = quota_rps
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.throttles = 0
+        self.failures = 0
+        self._tokens = quota_rps or 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        with self._lock:
+            self.calls += 1
+            if self.failure_rate and random.random() < self.failure_rate:
+                self.failures += 1
+                raise RuntimeError("Fake embedding failure")
+            if not self.quota_rps:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.quota_rps, self._tokens + (now - self._last) * self.quota_rps)
+            self._last = now
+            if self._tokens < 1:
+                self.throttles += 1
+                raise FakeThrottlingError()
+            self._tokens -= 1
+
+    def embed_documents(self, texts):
+        self._admit()
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        return [fake_vector(text, self.size) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class BagOfWordsEmbedder:
+    """Embeds a text as the normalized sum of a fixed random vector per word.
+
+    Texts sharing words get close vectors, a rough stand-in for semantic
+    embeddings, where a single rare token (an invoice number) weighs little.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._words = {}
+
+    def _word(self, word):
+        if word not in self._words:
+            self._words[word] = fake_vector(word, self.size)
+        return self._words[word]
+
+    def embed_query(self, text):
+        total = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            for index, value in enumerate(self._word(word)):
+                total[index] += value
+        norm = sum(value * value for value in total) ** 0.5 or 1.0
+        return [value / norm for value in total]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+WORDS = (
+    "invoice contract warranty manual section clause payment service component "
+    "assembly torque voltage maintenance schedule liability delivery customer "
+    "supplier inspection procedure replacement quantity revision appendix"
+).split()
+
+
+def synthetic_page_text(page_number, lines=40, words_per_line=12, seed=0):
+    rng = random.Random(seed * 100003 + page_number)
+    return [
+        ' '.join(rng.choice(WORDS) for _ in range(words_per_line)) + f" {page_number}-{line}"
+        for line in range(lines)
+    ]
+
+
+def write_synthetic_pdf(path, pages, lines_per_page=40, seed=0):
+    """Write a text-only PDF with `pages` pages without third party libraries."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for page_number in range(pages):
+        lines = synthetic_page_text(page_number, lines_per_page, seed=seed)
+        stream = ["BT /F1 10 Tf 12 TL 40 800 Td"]
+        for line in lines:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            stream.append(f"({escaped}) Tj T*")
+        stream.append("ET")
+        content = '\n'.join(stream).encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = ' '.join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return path
+
+
+class CountingTable:
+    """Sink with LanceDB's `add` signature that only counts what it receives."""
+
+    def __init__(self):
+        self.rows = 0
+        self.commits = 0
+
+    def add(self, rows):
+        self.rows += len(rows)
+        self.commits += 1
+
+    def delete(self, where):
+        pass
+
+
+class FakeClientError(ClientError):
+    """botocore ClientError with the given error code, as the handler code catches ClientError."""
+
+    def __init__(self, code, message='', operation_name='Fake'):
+        super().__init__({'Error': {'Code': code, 'Message': message}}, operation_name)
+
+
+class FakeStreamingBody:
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def read(self, amt=None):
+        end = len(self._data) if amt is None else self._offset + amt
+        chunk = self._data[self._offset:end]
+        self._offset += len(chunk)
+        return chunk
+
+
+class FakeS3Client:
+    """In-memory S3 with the calls made by the document processor."""
+
+    class exceptions:
+        class NoSuchKey(FakeClientError):
+            def __init__(self, message=''):
+                super().__init__('NoSuchKey', message, 'GetObject')
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(data):
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        with self._lock:
+            self.requests += 1
+            self.objects[(Bucket, Key)] = data
+        return {'ETag': self.etag(data)}
+
+    def _get(self, Bucket, Key):
+        with self._lock:
+            self.requests += 1
+            if (Bucket, Key) not in self.objects:
+                raise self.exceptions.NoSuchKey(f"{Bucket}/{Key}")
+            return self.objects[(Bucket, Key)]
+
+    def head_object(self, Bucket, Key, **kwargs):
+        data = self._get(Bucket, Key)
+        return {'ContentLength': len(data), 'ETag': self.etag(data)}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        data = self._get(Bucket, Key)
+        etag = self.etag(data)
+        if IfMatch and IfMatch != etag:
+            raise FakeClientError('PreconditionFailed')
+        if Range:
+            start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+            data = data[start:end + 1]
+        return {'Body': FakeStreamingBody(data), 'ContentLength': len(data), 'ETag': etag}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self.requests += 1
+            self.objects.pop((Bucket, Key), None)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        with self._lock:
+            self.requests += 1
+            for entry in Delete['Objects']:
+                self.objects.pop((Bucket, entry['Key']), None)
+        return {'Deleted': Delete['Objects']}
+
+
+class FakeDynamoTable:
+    """In-memory DynamoDB table for put/delete/query with Key conditions."""
+
+    def __init__(self, hash_key, range_key=None, indexes=None):
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _key(self, item):
+        return (item[self.hash_key], item.get(self.range_key) if self.range_key else None)
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        with self._lock:
+            self.requests += 1
+            key = self._key(Item)
+            if ConditionExpression and 'attribute_not_exists' in ConditionExpression and key in self.items:
+                raise FakeClientError('ConditionalCheckFailedException')
+            self.items[key] = dict(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        with self._lock:
+            self.requests += 1
+            self.items.pop(self._key(Key), None)
+        return {}
+
+    @staticmethod
+    def _check(item, condition, values, names=None):
+        """`attribute_exists(a)`, `attribute_not_exists(a)`, `a = :v`, `a <> :v` and `a < :v`, joined by AND.
+
+        As in DynamoDB, a comparison on a missing attribute is false.
+        """
+        names = names or {}
+        for clause in re.split(r'\s+AND\s+', condition or ''):
+            clause = clause.strip()
+            if not clause:
+                continue
+            match = re.fullmatch(r"(attribute_exists|attribute_not_exists)\(([#\w]+)\)", clause)
+            if match:
+                exists = item is not None and names.get(match.group(2), match.group(2)) in item
+                if exists != (match.group(1) == 'attribute_exists'):
+                    return False
+                continue
+            name, operator, placeholder = re.fullmatch(r"([#\w]+)\s*(<>|=|<)\s*(:\w+)", clause).groups()
+            name = names.get(name, name)
+            if item is None or name not in item:
+                return False
+            value, expected = item[name], values[placeholder]
+            if not {'=': value == expected, '<>': value != expected, '<': value < expected}[operator]:
+                return False
+        return True
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ReturnValues=None, **kwargs):
+        """SET a = :v, ADD a :v (numbers and sets) and REMOVE a clauses."""
+        values = ExpressionAttributeValues or {}
+        names = ExpressionAttributeNames or {}
+        with self._lock:
+            self.requests += 1
+            key = self._key(Key)
+            item = self.items.get(key)
+            if not self._check(item, ConditionExpression, values, names):
+                raise FakeClientError('ConditionalCheckFailedException')
+            item = dict(item) if item is not None else dict(Key)
+            for action, body in re.findall(r"(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s|$)", UpdateExpression):
+                for clause in [clause.strip() for clause in body.split(',')]:
+                    if action == 'REMOVE':
+                        item.pop(names.get(clause, clause), None)
+                    elif action == 'SET':
+                        name, placeholder = [part.strip() for part in clause.split('=')]
+                        item[names.get(name, name)] = values[placeholder]
+                    else:
+                        name, placeholder = clause.split()
+                        name = names.get(name, name)
+                        value = values[placeholder]
+                        if isinstance(value, set):
+                            item[name] = set(item.get(name, set())) | value
+                        else:
+                            item[name] = item.get(name, 0) + value
+            self.items[key] = item
+        return {'Attributes': dict(item)} if ReturnValues == 'ALL_NEW' else {}
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            self.requests += 1
+            item = self.items.get(self._key(Key))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, **kwargs):
+        expression = KeyConditionExpression.get_expression()
+        name, value = expression['values'][0].name, expression['values'][1]
+        with self._lock:
+            self.requests += 1
+            items = [dict(item) for item in self.items.values() if item.get(name) == value]
+        return {'Items': items[:Limit] if Limit else items}
+
+
+class FakeDynamoDB:
+    """Both the low level client (get_item with typed attributes) and the resource of DynamoDB."""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def get_item(self, TableName, Key, **kwargs):
+        plain_key = {name: list(value.values())[0] for name, value in Key.items()}
+        item = self.tables[TableName].get_item(plain_key).get('Item')
+        if item is None:
+            return {}
+        return {'Item': {name: {'S': str(value)} for name, value in item.items()}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for name, requests in RequestItems.items():
+            keys = [
+                self.tables[name]._key(request['DeleteRequest']['Key'] if 'DeleteRequest' in request
+                                       else request['PutRequest']['Item'])
+                for request in requests
+            ]
+            if len(set(keys)) < len(keys):
+                raise FakeClientError('ValidationException', 'Provided list of item keys contains duplicates')
+            for request in requests:
+                if 'DeleteRequest' in request:
+                    self.tables[name].delete_item(request['DeleteRequest']['Key'])
+                else:
+                    self.tables[name].put_item(request['PutRequest']['Item'])
+        return {'UnprocessedItems': {}}
+
+
+class FakeSQSClient:
+    """In-memory SQS queue: messages sent by the handler (e.g. fan-out parts) wait
+    until `receive_event` hands them out as the event of a Lambda invocation."""
+
+    def __init__(self):
+        self.deleted = []
+        self.messages = deque()
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.deleted.extend(entry['Id'] for entry in Entries)
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        message_id = f"queued-{self.sent}-{hashlib.md5(MessageBody.encode('utf-8')).hexdigest()}"
+        with self._lock:
+            self.sent += 1
+            self.messages.append({'messageId': message_id, 'receiptHandle': message_id, 'body': MessageBody})
+        return {'MessageId': message_id}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        successful = [
+            {'Id': entry['Id'], 'MessageId': self.send_message(QueueUrl, entry['MessageBody'])['MessageId']}
+            for entry in Entries
+        ]
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_event(self, batch_size=10):
+        """SQS event of up to `batch_size` queued messages, None when the queue is empty."""
+        with self._lock:
+            records = [self.messages.popleft() for _ in range(min(batch_size, len(self.messages)))]
+        return {'Records': records} if records else None
+
+    def requeue(self, event, failures):
+        """Put the messages reported in `batchItemFailures` back, as SQS does after the visibility timeout."""
+        failed = {failure['itemIdentifier'] for failure in failures}
+        with self._lock:
+            self.messages.extend(record for record in event['Records'] if record['messageId'] in failed)
+
+
+class FakeApiGatewayClient:
+    """Records WebSocket posts; `gone` connection ids raise GoneException."""
+
+    def __init__(self, gone=()):
+        self.gone = set(gone)
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        if ConnectionId in self.gone:
+            raise FakeClientError('GoneException')
+        with self._lock:
+            self.messages.append((ConnectionId, Data))
+        return {}
+
+
+class FakeLambdaContext:
+    """Lambda context whose remaining time counts down from `timeout_ms` at creation."""
+
+    def __init__(self, timeout_ms=300000, clock=time.monotonic):
+        self._clock = clock
+        self._deadline = clock() + timeout_ms / 1000
+        self.function_name = 'document-processor'
+        self.aws_request_id = 'harness'
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - self._clock()) * 1000))
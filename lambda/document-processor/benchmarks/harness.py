@@ -0,0 +1,370 @@
+"""Offline load test of the document processor Lambda handler.
+
+Imports `app` with the AWS clients replaced by in-memory fakes (S3,
+DynamoDB, SQS, API Gateway), `BedrockEmbeddings` replaced by FakeEmbedder,
+and LanceDB on a local directory. Then it drives synthetic SQS batches
+through `app.lambda_handler` in phases:
+
+    create     upload every document
+    duplicate  deliver the same events again (registry fast path)
+    update     overwrite every document with one more page (incremental re-ingest)
+    delete     remove every document
+
+Failed messages, and the messages the handler sends to the queue itself
+(the parts of documents split by the fan-out, see --fanout-min-pages),
+are delivered after the batches of the phase, failed ones again up to
+the redrive limit. --embed-failure-rate fails ingestions midway, and a
+short --timeout-ms makes the handler defer records and stop ingestions
+before the deadline.
+
+For each phase it reports throughput, p50/p99 per-record latency, Bedrock
+calls and the median of every span of the record traces, plus the peak RSS
+of the run, as JSON. Example:
+
+    python benchmarks/harness.py --documents 20 --pages 5 50 --users 4 \\
+        --embed-latency 0.05 --output results.json
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import urllib.parse
+from unittest import mock
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fakes import (  # noqa: E402
+    FakeApiGatewayClient,
+    FakeDynamoDB,
+    FakeDynamoTable,
+    FakeEmbedder,
+    FakeLambdaContext,
+    FakeS3Client,
+    FakeSQSClient,
+    write_synthetic_pdf,
+)
+
+EMBEDDING_SIZE = 256
+DOCUMENT_BUCKET = 'harness-documents'
+LANCEDB_BUCKET = 'harness-lancedb'
+REGISTRY_TABLE = 'harness-registry'
+REGISTRY_INDEX = 's3_path_index'
+WEBSOCKET_TABLE = 'harness-websocket'
+# maxReceiveCount of the dead letter queue in the CDK stack
+MAX_RECEIVE_COUNT = 5
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+
+class FakeAWS:
+    """Hands out the fakes in place of boto3 clients and resources."""
+
+    def __init__(self):
+        self.s3 = FakeS3Client()
+        self.dynamodb = FakeDynamoDB({
+            REGISTRY_TABLE: FakeDynamoTable('md5', 's3_path', {REGISTRY_INDEX: 's3_path'}),
+            WEBSOCKET_TABLE: FakeDynamoTable('userId'),
+        })
+        self.sqs = FakeSQSClient()
+        self.api = FakeApiGatewayClient()
+
+    def client(self, service, *args, **kwargs):
+        return {
+            's3': self.s3,
+            'dynamodb': self.dynamodb,
+            'sqs': self.sqs,
+            'apigatewaymanagementapi': self.api,
+        }[service]
+
+    def resource(self, service, *args, **kwargs):
+        return self.dynamodb
+
+    def session(self, *args, **kwargs):
+        return self
+
+
+def configure_environment(args, workdir):
+    os.environ.update({
+        'AWS_REGION': 'us-west-2',
+        'AWS_DEFAULT_REGION': 'us-west-2',
+        'WEBSOCKET_ENDPOINT': 'wss://harness.example.com/prod',
+        'DYNAMODB_WEBSOCKET_STATE_TABLE': WEBSOCKET_TABLE,
+        'DYNAMODB_DOCUMENT_REGISTRY_TABLE': REGISTRY_TABLE,
+        'DYNAMODB_MD5_BY_S3_PATH_INDEX': REGISTRY_INDEX,
+        'SQS_QUEUE_URL': 'https://sqs.us-west-2.amazonaws.com/000000000000/harness',
+        'SQS_BATCH_RESPONSE': 'partial',
+        'LANCEDB_BUCKET': LANCEDB_BUCKET,
+        'EMBEDDING_MODEL': 'amazon.titan-embed-text-v1',
+        'EMBEDDING_SIZE': str(EMBEDDING_SIZE),
+        'EMBEDDING_CACHE_ENABLED': 'true' if args.cache else 'false',
+        'EMBEDDING_CACHE_DIR': os.path.join(workdir, 'embedding-cache'),
+        'PROCESSING_CONCURRENCY': str(args.processing_concurrency),
+        'FANOUT_MIN_PAGES': str(args.fanout_min_pages),
+        'FANOUT_PAGES_PER_PART': str(args.fanout_pages_per_part),
+        'LOG_LEVEL': 'WARNING',
+    })
+
+
+def load_app(aws, embedder, args, workdir):
+    """Import app.py with boto3 and Bedrock patched, and point its table cache at local LanceDB."""
+    patches = [
+        mock.patch('boto3.client', aws.client),
+        mock.patch('boto3.resource', aws.resource),
+        mock.patch('boto3.session.Session', aws.session),
+        mock.patch('langchain.embeddings.BedrockEmbeddings', lambda *a, **kw: embedder),
+    ]
+    for patch in patches:
+        patch.start()
+
+    import app
+    import vectorstore
+
+    import lancedb
+    root = os.path.join(workdir, 'lancedb')
+
+    def connect(db_path):
+        return lancedb.connect(os.path.join(root, db_path[len('s3://'):]))
+
+    vectorstore.table_cache = vectorstore.TableCache(connect=connect)
+    return app
+
+
+class RecordTimer:
+    """Collects per-record latencies and the trace lines emitted by the handler."""
+
+    def __init__(self, app):
+        import telemetry
+        self.latencies = []
+        self.traces = []
+        process_s3_record = app.process_s3_record
+
+        def timed_process_s3_record(s3_record):
+            start = time.monotonic()
+            try:
+                return process_s3_record(s3_record)
+            finally:
+                self.latencies.append((time.monotonic() - start) * 1000)
+
+        def collect(trace, status_code=None, metrics_format=None):
+            line = trace.as_dict(status_code)
+            self.traces.append(line)
+            return line
+
+        app.process_s3_record = timed_process_s3_record
+        telemetry.RecordTrace.emit = collect
+        # invocation metrics are read from the handler's response instead of stdout
+        app.emit_invocation = lambda metrics, **kwargs: metrics
+
+    def reset(self):
+        self.latencies = []
+        self.traces = []
+
+
+def s3_event_record(event_name, key, data=None):
+    # keys are URL encoded in S3 event notifications
+    s3_object = {'key': urllib.parse.quote_plus(key, safe='/')}
+    if data is not None:
+        s3_object.update({'size': len(data), 'eTag': FakeS3Client.etag(data)})
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': event_name,
+        's3': {'bucket': {'name': DOCUMENT_BUCKET}, 'object': s3_object}
+    }
+
+
+def sqs_batches(s3_records, batch_size):
+    batches = []
+    for start in range(0, len(s3_records), batch_size):
+        batches.append({'Records': [
+            {
+                'messageId': f"message-{start + index}",
+                'receiptHandle': f"receipt-{start + index}",
+                'body': json.dumps({'Records': [s3_record]})
+            }
+            for index, s3_record in enumerate(s3_records[start:start + batch_size])
+        ]})
+    return batches
+
+
+def upload_documents(aws, documents, workdir, extra_pages=0):
+    records = []
+    for key, pages, seed in documents:
+        path = write_synthetic_pdf(os.path.join(workdir, 'upload.pdf'), pages + extra_pages, seed=seed)
+        with open(path, 'rb') as f:
+            data = f.read()
+        aws.s3.put_object(Bucket=DOCUMENT_BUCKET, Key=key, Body=data)
+        records.append(s3_event_record('ObjectCreated:Put', key, data))
+    return records
+
+
+def run_phase(name, app, aws, embedder, timer, s3_records, batch_size, timeout_ms=300000):
+    timer.reset()
+    calls_before, throttles_before, failures_before = embedder.calls, embedder.throttles, embedder.failures
+    failures = 0
+    start = time.monotonic()
+    receives = {}
+    invocations = []
+
+    def deliver(event):
+        """Run an invocation, failed messages go back to the queue until the redrive limit."""
+        failed = 0
+        for record in event['Records']:
+            receives[record['messageId']] = receives.get(record['messageId'], 0) + 1
+            record['attributes'] = {'ApproximateReceiveCount': str(receives[record['messageId']])}
+        status = app.lambda_handler(event, FakeLambdaContext(timeout_ms))
+        invocations.append(status['throughput'])
+        retried = []
+        for failure in status.get('batchItemFailures', []):
+            if receives[failure['itemIdentifier']] < MAX_RECEIVE_COUNT:
+                retried.append(failure)
+            else:
+                failed += 1
+        aws.sqs.requeue(event, retried)
+        return failed
+
+    for event in sqs_batches(s3_records, batch_size):
+        failures += deliver(event)
+    # then redeliveries and the messages sent by the handler itself (fan-out parts)
+    queued = 0
+    while True:
+        event = aws.sqs.receive_event(batch_size)
+        if event is None:
+            break
+        queued += len(event['Records'])
+        failures += deliver(event)
+    wall = time.monotonic() - start
+
+    pages = sum(trace.get('pages', 0) for trace in timer.traces)
+    spans = {}
+    for trace in timer.traces:
+        for span_name, value in trace['spans_ms'].items():
+            spans.setdefault(span_name, []).append(value)
+    return {
+        'phase': name,
+        'records': len(s3_records),
+        'queued_messages': queued,
+        'failed_messages': failures,
+        'wall': round(wall, 3),
+        'records_per_second': round(len(s3_records) / wall, 2) if wall else None,
+        'pages_per_second': round(pages / wall, 1) if wall else None,
+        'latency_ms': {
+            'p50': percentile(timer.latencies, 0.5),
+            'p99': percentile(timer.latencies, 0.99),
+            'max': round(max(timer.latencies), 1) if timer.latencies else None
+        },
+        'span_p50_ms': {span_name: percentile(values, 0.5) for span_name, values in sorted(spans.items())},
+        'bedrock_calls': embedder.calls - calls_before,
+        'bedrock_throttles': embedder.throttles - throttles_before,
+        'bedrock_failures': embedder.failures - failures_before,
+        'chunks': sum(trace.get('chunks', 0) for trace in timer.traces),
+        'chunks_reused': sum(trace.get('chunks_reused', 0) for trace in timer.traces),
+        'invocations': len(invocations),
+        'records_deferred': sum(invocation['records_deferred'] for invocation in invocations),
+        'deadline_stops': sum(invocation['deadline_stops'] for invocation in invocations),
+        'time_used_max': max((invocation['time_used'] or 0 for invocation in invocations), default=None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--pages', type=int, nargs='+', default=[5, 50],
+                        help='page counts, cycled over the documents')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=5, help='SQS messages per invocation')
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--embed-jitter', type=float, default=0.01)
+    parser.add_argument('--quota-rps', type=float, default=None, help='Bedrock quota, throttles above it')
+    parser.add_argument('--embed-failure-rate', type=float, default=0.0,
+                        help='fraction of Bedrock calls failing, to exercise resumed ingestion')
+    parser.add_argument('--timeout-ms', type=int, default=300000, help='timeout of the function')
+    parser.add_argument('--cache', action=argparse.BooleanOptionalAction, default=False,
+                        help='embedding cache (in memory S3 tier)')
+    parser.add_argument('--processing-concurrency', type=int, default=1)
+    parser.add_argument('--fanout-min-pages', type=int, default=300,
+                        help='documents from this many pages are split into parts')
+    parser.add_argument('--fanout-pages-per-part', type=int, default=100)
+    parser.add_argument('--phases', nargs='+', default=['create', 'duplicate', 'update', 'delete'],
+                        choices=['create', 'duplicate', 'update', 'delete'])
+    parser.add_argument('--label', default=None, help='free text stored with the results')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, workdir)
+        aws = FakeAWS()
+        embedder = FakeEmbedder(
+            size=EMBEDDING_SIZE, latency=args.embed_latency, jitter=args.embed_jitter, quota_rps=args.quota_rps,
+            failure_rate=args.embed_failure_rate
+        )
+        app = load_app(aws, embedder, args, workdir)
+        timer = RecordTimer(app)
+
+        users = [f"us-west-2:{index:08d}-0000-0000-0000-000000000000" for index in range(args.users)]
+        for index, user in enumerate(users):
+            aws.dynamodb.Table(WEBSOCKET_TABLE).put_item(Item={'userId': user, 'ConnectionId': f"connection-{index}"})
+        documents = [
+            (
+                f"private/{users[index % len(users)]}/document-{index}.pdf",
+                args.pages[index % len(args.pages)],
+                index
+            )
+            for index in range(args.documents)
+        ]
+
+        phases = []
+        created = []
+        for phase in args.phases:
+            if phase == 'create':
+                created = upload_documents(aws, documents, workdir)
+                records = created
+            elif phase == 'duplicate':
+                records = created
+            elif phase == 'update':
+                records = upload_documents(aws, documents, workdir, extra_pages=1)
+            else:
+                records = [s3_event_record('ObjectRemoved:Delete', key) for key, _, _ in documents]
+            phases.append(run_phase(phase, app, aws, embedder, timer, records, args.batch_size, args.timeout_ms))
+
+    results = {
+        'label': args.label,
+        'timestamp': int(time.time()),
+        'config': {
+            'documents': args.documents,
+            'pages': args.pages,
+            'users': args.users,
+            'batch_size': args.batch_size,
+            'embed_latency': args.embed_latency,
+            'quota_rps': args.quota_rps,
+            'timeout_ms': args.timeout_ms,
+            'embed_failure_rate': args.embed_failure_rate,
+            'cache': args.cache,
+            'processing_concurrency': args.processing_concurrency,
+            'fanout_min_pages': args.fanout_min_pages,
+            'fanout_pages_per_part': args.fanout_pages_per_part,
+        },
+        'phases': phases,
+        'bedrock_calls': embedder.calls,
+        'notifications': len(aws.api.messages),
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_rss_children_mib': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Import-time profile of the handler module, with a cold-start budget.
+
+Imports `app` in a fresh interpreter with `python -X importtime`, the way
+the Lambda runtime does on a cold start, and reports the cumulative import
+time of every top-level package plus the total. Exits non-zero when the
+total is over `--budget-ms`, or when a module that should only load on the
+create path (langchain, pypdf, lancedb, pyarrow) is imported eagerly. The
+Docker build runs it, so a regression fails the image build. Example:
+
+    python benchmarks/import_profile.py --budget-ms 1500 --output import-profile.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# loaded on first use by the create path, see the getters in app.py and vectorstore.connect_lancedb
+LAZY_MODULES = ['langchain', 'pypdf', 'lancedb', 'pyarrow', 'numpy', 'pandas']
+
+# configuration the module reads at import, placeholders are enough as no client is built
+DUMMY_ENVIRONMENT = {
+    'AWS_REGION': 'us-west-2',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'DYNAMODB_WEBSOCKET_STATE_TABLE': 'import-profile',
+    'DYNAMODB_DOCUMENT_REGISTRY_TABLE': 'import-profile',
+    'DYNAMODB_MD5_BY_S3_PATH_INDEX': 's3_path_index',
+    'LANCEDB_BUCKET': 'import-profile',
+    'EMBEDDING_MODEL': 'amazon.titan-embed-text-v1',
+}
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` lines into (cumulative_us, depth, module) rows."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((int(cumulative), depth, name.strip()))
+    return rows
+
+
+def profile(module, python=sys.executable, cwd=FUNCTION_DIR):
+    env = dict(os.environ)
+    for key, value in DUMMY_ENVIRONMENT.items():
+        env.setdefault(key, value)
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-4000:]}")
+    return parse_importtime(result.stderr)
+
+
+def summarize(rows, module, top):
+    # importtime prints children before their parent, reversed the rows are in import order
+    packages = {}
+    ancestors = []
+    for cumulative, depth, name in reversed(rows):
+        package = name.split('.')[0]
+        del ancestors[depth - 1:]
+        # the outermost import of a package carries the time of its submodules
+        if package not in ancestors:
+            packages[package] = packages.get(package, 0) + cumulative
+        ancestors.append(package)
+    total = next((cumulative for cumulative, _, name in rows if name == module), sum(packages.values()))
+    imported = {name.split('.')[0] for _, _, name in rows}
+    return {
+        'module': module,
+        'total_ms': round(total / 1000, 1),
+        'modules_imported': len(rows),
+        'packages_ms': {
+            package: round(us / 1000, 1)
+            for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        },
+        'eager_lazy_modules': sorted(imported & set(LAZY_MODULES)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=None, help='fail above this total import time')
+    parser.add_argument('--repeat', type=int, default=3, help='the fastest run is kept')
+    parser.add_argument('--top', type=int, default=15, help='packages listed')
+    parser.add_argument('--python', default=sys.executable)
+    parser.add_argument('--function-dir', default=FUNCTION_DIR, help='directory of the handler module')
+    parser.add_argument('--output', default=None, help='write the JSON profile to this file')
+    args = parser.parse_args()
+
+    runs = [summarize(profile(args.module, args.python, args.function_dir), args.module, args.top) for _ in range(args.repeat)]
+    summary = min(runs, key=lambda run: run['total_ms'])
+    summary['budget_ms'] = args.budget_ms
+    summary['within_budget'] = args.budget_ms is None or summary['total_ms'] <= args.budget_ms
+
+    output = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if summary['eager_lazy_modules']:
+        sys.exit(f"{args.module} imports {', '.join(summary['eager_lazy_modules'])} at cold start")
+    if not summary['within_budget']:
+        sys.exit(f"{args.module} imports in {summary['total_ms']} ms, over the {args.budget_ms} ms budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import re
+import math
+from collections import deque
+
+from langchain.text_splitter import (
+    CharacterTextSplitter,
+    RecursiveCharacterTextSplitter,
+    TextSplitter,
+)
+
+# character | recursive | sentence | token
+CHUNK_STRATEGY = os.environ.get('CHUNK_STRATEGY', 'character')
+# in characters, or in (estimated) tokens for the token strategy
+CHUNK_SIZE = os.environ.get('CHUNK_SIZE')
+CHUNK_OVERLAP = os.environ.get('CHUNK_OVERLAP')
+
+DEFAULT_CHUNK_SETTINGS = {
+    # the original splitter, kept as default so existing deployments chunk the same way
+    'character': (1000, 200),
+    'recursive': (1000, 100),
+    'sentence': (1000, 100),
+    # Titan embedding models accept up to 8k tokens, retrieval works better with small chunks
+    'token': (256, 32),
+}
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of a text for subword tokenizers.
+
+    The tokenizer of the Bedrock embedding models is not public, so words
+    are counted as one token per 4 characters (at least one) and every
+    punctuation mark as one token, which errs on the side of overcounting.
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in TOKEN_PATTERN.findall(text))
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+
+class SentenceTextSplitter(TextSplitter):
+    """Pack whole sentences into chunks, overlapping by whole sentences.
+
+    Sentences longer than a chunk are split on words. With
+    `length_function=estimate_tokens` chunk size and overlap become token
+    budgets.
+    """
+
+    def _pieces(self, text):
+        for sentence in split_sentences(text):
+            length = self._length_function(sentence)
+            if length <= self._chunk_size:
+                yield sentence, length
+            else:
+                for word in sentence.split():
+                    yield word, self._length_function(word)
+
+    def split_text(self, text):
+        # same packing as TextSplitter._merge_splits, but every piece is measured
+        # once, which matters when the length function is a tokenizer
+        separator_length = self._length_function(' ')
+        chunks = []
+        current = deque()
+        total = 0
+        for piece, length in self._pieces(text):
+            if current and total + separator_length + length > self._chunk_size:
+                chunks.append(' '.join(p for p, _ in current))
+                while current and (
+                    total > self._chunk_overlap
+                    or total + separator_length + length > self._chunk_size
+                ):
+                    _, first_length = current.popleft()
+                    total -= first_length + (separator_length if current else 0)
+            total += length + (separator_length if current else 0)
+            current.append((piece, length))
+        if current:
+            chunks.append(' '.join(p for p, _ in current))
+        return chunks
+
+
+def get_splitter(strategy=CHUNK_STRATEGY, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Build the text splitter of a chunking strategy.
+
+    Unset sizes fall back to the defaults of the strategy.
+    """
+    if strategy not in DEFAULT_CHUNK_SETTINGS:
+        raise ValueError(f"Unknown chunking strategy {strategy}, expected one of {list(DEFAULT_CHUNK_SETTINGS)}")
+    default_size, default_overlap = DEFAULT_CHUNK_SETTINGS[strategy]
+    chunk_size = int(chunk_size) if chunk_size else default_size
+    chunk_overlap = int(chunk_overlap) if chunk_overlap is not None and chunk_overlap != '' else default_overlap
+
+    if strategy == 'character':
+        return CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if strategy == 'recursive':
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+    if strategy == 'sentence':
+        return SentenceTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return SentenceTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=estimate_tokens
+    )
@@ -0,0 +1,211 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Tuning knobs for the embedding stage
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', '8'))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '1'))
+EMBEDDING_MAX_RPS = float(os.environ.get('EMBEDDING_MAX_RPS', '20'))
+EMBEDDING_MIN_RPS = float(os.environ.get('EMBEDDING_MIN_RPS', '1'))
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', '6'))
+
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+}
+
+TRANSIENT_ERROR_CODES = {
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+    'ModelTimeoutException',
+    'InternalServerException',
+}
+
+
+def _error_code(error):
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+def _error_chain(error):
+    while error is not None:
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def is_throttling_error(error):
+    """Check if an exception (or its cause) is a Bedrock throttling error.
+
+    langchain's BedrockEmbeddings re-raises client errors as ValueError, so
+    besides the botocore error code we also look at the message text.
+    """
+    for e in _error_chain(error):
+        if _error_code(e) in THROTTLING_ERROR_CODES:
+            return True
+        message = str(e)
+        if 'Throttling' in message or 'Too many requests' in message or 'Rate exceeded' in message:
+            return True
+    return False
+
+
+def is_retryable_error(error):
+    """Check if an exception is worth retrying (throttling or transient service error)."""
+    if is_throttling_error(error):
+        return True
+    for e in _error_chain(error):
+        if _error_code(e) in TRANSIENT_ERROR_CODES:
+            return True
+        if any(code in str(e) for code in TRANSIENT_ERROR_CODES):
+            return True
+    return False
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate adapts to throttling (AIMD).
+
+    Successful requests grow the rate by about `increase_step` requests per
+    second every second, every throttled request cuts it by `decrease_factor`.
+    The limiter is thread safe and meant to be shared by all workers of a
+    container so that what was learned about the quota survives warm
+    invocations.
+    """
+
+    def __init__(self, max_rate=EMBEDDING_MAX_RPS, min_rate=EMBEDDING_MIN_RPS,
+                 initial_rate=None, burst=None, increase_step=0.5, decrease_factor=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = initial_rate or max_rate
+        self.burst = burst or max(1.0, max_rate / 4)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.throttle_count = 0
+        self._tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a request token is available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttle_count += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = min(self._tokens, 0)
+
+
+class EmbeddingStats:
+    """Counters collected while embedding the chunks of one document."""
+
+    def __init__(self):
+        self.texts = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, calls=0, retries=0, throttles=0):
+        with self._lock:
+            self.calls += calls
+            self.retries += retries
+            self.throttles += throttles
+
+    def as_dict(self):
+        return {
+            'texts': self.texts,
+            'calls': self.calls,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'elapsed': round(self.elapsed, 3)
+        }
+
+
+class EmbeddingEngine:
+    """Embed chunks concurrently over a bounded thread pool.
+
+    `embedder` is anything implementing langchain's `embed_documents(texts)`,
+    e.g. `BedrockEmbeddings` in the function or a fake in the benchmarks.
+    Requests go through a shared `AdaptiveRateLimiter` and are retried with
+    exponential backoff and full jitter on throttling and transient errors.
+    """
+
+    def __init__(self, embedder, concurrency=EMBEDDING_CONCURRENCY, batch_size=EMBEDDING_BATCH_SIZE,
+                 rate_limiter=None, max_retries=EMBEDDING_MAX_RETRIES, base_delay=0.2, max_delay=10.0,
+                 sleep=time.sleep):
+        self.embedder = embedder
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _embed_batch(self, batch, stats):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                vectors = self.embedder.embed_documents(batch)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                stats.add(calls=1, throttles=int(throttled))
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                if throttled:
+                    self.rate_limiter.on_throttle()
+                stats.add(retries=1)
+                self._sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            stats.add(calls=1)
+            self.rate_limiter.on_success()
+            return vectors
+
+    def embed(self, texts, stats=None):
+        """Embed `texts` and return the vectors in the same order."""
+        stats = stats if stats is not None else EmbeddingStats()
+        texts = list(texts)
+        stats.texts += len(texts)
+        if not texts:
+            return []
+
+        start = time.monotonic()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        workers = min(self.concurrency, len(batches))
+        if workers == 1:
+            results = [self._embed_batch(batch, stats) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda batch: self._embed_batch(batch, stats), batches))
+        stats.elapsed += time.monotonic() - start
+
+        return [vector for batch_vectors in results for vector in batch_vectors]
@@ -0,0 +1,274 @@
+import os
+import logging
+import struct
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR', '/tmp/embedding-cache')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '20000'))
+EMBEDDING_CACHE_BUCKET = os.environ.get('EMBEDDING_CACHE_BUCKET')
+EMBEDDING_CACHE_PREFIX = os.environ.get('EMBEDDING_CACHE_PREFIX', 'embedding-cache/')
+EMBEDDING_CACHE_CONCURRENCY = int(os.environ.get('EMBEDDING_CACHE_CONCURRENCY', '16'))
+
+
+def normalize_text(text):
+    """Normalize a chunk so that whitespace-only and unicode-form edits hit the cache."""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def chunk_cache_key(model_id, embedding_size, text):
+    """Content address of a chunk embedding: hash(model id, embedding size, normalized text)."""
+    payload = f"{model_id}\0{embedding_size}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def encode_vector(vector):
+    return struct.pack(f'<{len(vector)}f', *vector)
+
+
+def decode_vector(data):
+    return list(struct.unpack(f'<{len(data) // 4}f', data))
+
+
+class CacheStore:
+    """Interface of a persistent embedding cache tier.
+
+    Keys are hex digests from `chunk_cache_key`, values are vectors.
+    """
+
+    def get_many(self, keys):
+        """Return a dict with the vectors found for `keys`; missing keys are omitted."""
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """Store a dict of key -> vector."""
+        raise NotImplementedError
+
+
+class LocalLRUCache(CacheStore):
+    """Bounded cache tier in /tmp that survives warm invocations of a container.
+
+    Vectors are stored one file per key. The recency index lives in memory
+    and is rebuilt from the file mtimes when the module is loaded in a fresh
+    container that reuses an existing /tmp.
+    """
+
+    def __init__(self, directory=EMBEDDING_CACHE_DIR, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return decode_vector(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, vector):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_vector(vector))
+        os.replace(tmp_path, path)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.bin'):
+                    path = os.path.join(root, name)
+                    entries.append((os.path.getmtime(path), name[:-len('.bin')]))
+        for _, key in sorted(entries):
+            self._index[key] = True
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            with self._lock:
+                if key not in self._index:
+                    continue
+                self._index.move_to_end(key)
+            vector = self._read(key)
+            if vector is None:
+                with self._lock:
+                    self._index.pop(key, None)
+                continue
+            found[key] = vector
+        return found
+
+    def put_many(self, items):
+        for key, vector in items.items():
+            self._write(key, vector)
+            with self._lock:
+                self._index[key] = True
+                self._index.move_to_end(key)
+                evicted = []
+                while len(self._index) > self.max_entries:
+                    evicted.append(self._index.popitem(last=False)[0])
+            for old_key in evicted:
+                self._remove(old_key)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def is_missing_object_error(error):
+    """True when a GetObject failed because the object does not exist.
+
+    Without s3:ListBucket on the bucket S3 answers AccessDenied (403)
+    instead of NoSuchKey (404) for a missing key, both count as a miss.
+    """
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in ('NoSuchKey', 'NotFound', '404', 'AccessDenied', '403') or status in (403, 404)
+
+
+class S3CacheStore(CacheStore):
+    """Persistent cache tier storing one object per key under an S3 prefix."""
+
+    def __init__(self, s3_client, bucket, prefix=EMBEDDING_CACHE_PREFIX, concurrency=EMBEDDING_CACHE_CONCURRENCY):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.concurrency = concurrency
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key[:2]}/{key}.bin"
+
+    def _get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if is_missing_object_error(e):
+                return key, None
+            raise
+        return key, decode_vector(response['Body'].read())
+
+    def _put(self, item):
+        key, vector = item
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=encode_vector(vector))
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(keys))) as executor:
+            results = executor.map(self._get, keys)
+        return {key: vector for key, vector in results if vector is not None}
+
+    def put_many(self, items):
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as executor:
+            list(executor.map(self._put, items.items()))
+
+
+class CacheStats:
+    """Hit/miss counters of one ingestion."""
+
+    def __init__(self):
+        self.local_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @property
+    def hits(self):
+        return self.local_hits + self.persistent_hits
+
+    def as_dict(self):
+        return {
+            'local_hits': self.local_hits,
+            'persistent_hits': self.persistent_hits,
+            'misses': self.misses
+        }
+
+
+class EmbeddingCache:
+    """Two tier, content addressed cache of chunk embeddings.
+
+    Lookups go to the local LRU tier first, then to the persistent tier;
+    persistent hits are promoted to the local tier.
+    """
+
+    def __init__(self, model_id, embedding_size, local=None, persistent=None):
+        self.model_id = model_id
+        self.embedding_size = embedding_size
+        self.local = local
+        self.persistent = persistent
+
+    def key(self, text):
+        return chunk_cache_key(self.model_id, self.embedding_size, text)
+
+    def get_many(self, keys, stats):
+        keys = list(keys)
+        found = self.local.get_many(keys) if self.local is not None else {}
+        stats.local_hits += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.persistent is not None:
+            try:
+                remote = self.persistent.get_many(missing)
+            except Exception as e:
+                logger.error(f"Error reading persistent embedding cache: {e}")
+                remote = {}
+            stats.persistent_hits += len(remote)
+            if remote and self.local is not None:
+                self.local.put_many(remote)
+            found.update(remote)
+
+        stats.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        if self.local is not None:
+            self.local.put_many(items)
+        if self.persistent is not None:
+            try:
+                self.persistent.put_many(items)
+            except Exception as e:
+                logger.error(f"Error writing persistent embedding cache: {e}")
+
+
+def embed_with_cache(engine, cache, texts, embedding_stats=None, cache_stats=None):
+    """Embed `texts` through `engine`, only calling it for chunks missing from `cache`.
+
+    Identical chunks within `texts` are embedded once.
+    """
+    cache_stats = cache_stats if cache_stats is not None else CacheStats()
+    texts = list(texts)
+    if cache is None:
+        return engine.embed(texts, embedding_stats), cache_stats
+
+    keys = [cache.key(text) for text in texts]
+    unique_keys = list(OrderedDict.fromkeys(keys))
+    found = cache.get_many(unique_keys, cache_stats)
+
+    missing = [key for key in unique_keys if key not in found]
+    if missing:
+        text_by_key = dict(zip(keys, texts))
+        vectors = engine.embed([text_by_key[key] for key in missing], embedding_stats)
+        computed = dict(zip(missing, vectors))
+        cache.put_many(computed)
+        found.update(computed)
+
+    return [found[key] for key in keys], cache_stats
@@ -0,0 +1,156 @@
+import os
+import io
+import json
+import hashlib
+import urllib.parse
+
+from telemetry import span
+from vectorstore import sql_literal
+
+# Documents from this many pages, or bytes, are split into parts processed by separate invocations
+FANOUT_MIN_PAGES = int(os.environ.get('FANOUT_MIN_PAGES', '300'))
+FANOUT_MIN_BYTES = int(os.environ.get('FANOUT_MIN_BYTES', str(100 * 1024 * 1024)))
+FANOUT_PAGES_PER_PART = int(os.environ.get('FANOUT_PAGES_PER_PART', '100'))
+# Rows embedded by the parts wait here, in the LanceDB bucket, until the job commits
+FANOUT_STAGING_PREFIX = os.environ.get('FANOUT_STAGING_PREFIX', 'staging/')
+
+FANOUT_EVENT_SOURCE = 'document-processor'
+FANOUT_EVENT_NAME = 'FanoutPart'
+
+
+def should_fan_out(page_count, size, min_pages=FANOUT_MIN_PAGES, min_bytes=FANOUT_MIN_BYTES,
+                   pages_per_part=FANOUT_PAGES_PER_PART):
+    """Fan out documents above a page or byte threshold, when they make more than one part."""
+    if page_count <= pages_per_part:
+        return False
+    return page_count >= min_pages or (size or 0) >= min_bytes
+
+
+def fanout_job_id(md5_hash, s3_path, attempt=0):
+    """Id of the fan-out job of one object and delivery attempt, also its staging prefix.
+
+    The same bytes uploaded to two paths get jobs of their own, and a job
+    that takes over a stale one never reads or counts the stale job's parts.
+    """
+    return hashlib.sha256(f"{md5_hash}\0{s3_path}\0{attempt}".encode('utf-8')).hexdigest()[:32]
+
+
+def plan_parts(page_count, pages_per_part=FANOUT_PAGES_PER_PART):
+    """Page ranges [first, last) of the parts of a document."""
+    return [(first, min(first + pages_per_part, page_count)) for first in range(0, page_count, pages_per_part)]
+
+
+def part_record(job, part, first_page, last_page):
+    """Work item of a part, shaped like an S3 event record so it is grouped and reported like one.
+
+    `job` holds bucket, key, md5, s3_path, etag, parts and the md5s of the
+    previous versions of the document.
+    """
+    return {
+        'eventSource': FANOUT_EVENT_SOURCE,
+        'eventName': FANOUT_EVENT_NAME,
+        's3': {
+            'bucket': {'name': job['bucket']},
+            'object': {'key': urllib.parse.quote_plus(job['key'], safe='/'), 'eTag': job.get('etag')}
+        },
+        'fanout': dict(job, part=part, first_page=first_page, last_page=last_page)
+    }
+
+
+def is_fanout_record(record):
+    return record.get('eventName') == FANOUT_EVENT_NAME
+
+
+def enqueue_parts(sqs_client, queue_url, job, ranges):
+    """Send one message per part to the processing queue, 10 per request."""
+    records = [part_record(job, part, first, last) for part, (first, last) in enumerate(ranges)]
+    for start in range(0, len(records), 10):
+        entries = [
+            {'Id': str(index), 'MessageBody': json.dumps({'Records': [record]})}
+            for index, record in enumerate(records[start:start + 10])
+        ]
+        response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        if response.get('Failed'):
+            raise RuntimeError(f"Failed to enqueue parts of {job['key']}: {response['Failed']}")
+    return len(records)
+
+
+class StagingStore:
+    """Rows embedded by the parts of a fan-out job, one Arrow IPC object per part.
+
+    Parts run in separate invocations, and LanceDB tables take one writer at
+    a time, so parts never write to the user table: they stage their rows on
+    S3 and the last part to finish writes them, one part at a time.
+    """
+
+    def __init__(self, s3_client, bucket, prefix=FANOUT_STAGING_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, job_id, part):
+        return f"{self.prefix}{job_id}/part-{part:05d}.arrow"
+
+    def put(self, job_id, part, rows):
+        import pyarrow as pa
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, rows.schema) as writer:
+            writer.write_table(rows)
+        # a redelivered part overwrites its own object, so staging is idempotent
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key(job_id, part), Body=sink.getvalue())
+
+    def get(self, job_id, part):
+        import pyarrow as pa
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key(job_id, part))
+        return pa.ipc.open_stream(response['Body'].read()).read_all()
+
+    def delete(self, job_id, parts):
+        keys = [{'Key': self.key(job_id, part)} for part in range(parts)]
+        for start in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys[start:start + 1000]})
+
+
+def commit_staged(table, staged, source, fulltext=None):
+    """Write the staged rows of a document to the user table, replacing the rows of its previous version.
+
+    `staged` yields the rows of the parts in document order, and is read one
+    part at a time, so only one part is held in memory. Rows get their ids
+    over the whole document, as `ingest_pdf` would give them. Rows already
+    stored under the same id (the same chunk) are kept as they are, the
+    others are appended with one commit per part, and the stored rows of the
+    source missing from the new version are deleted in a last commit.
+    Safe to repeat: a second run appends nothing and deletes nothing.
+    Returns (rows of the document, rows added, rows removed).
+    """
+    import pyarrow as pa
+    from pipeline import chunk_ids, delete_rows
+    stored = set(
+        table.to_lance().to_table(columns=['id'], filter=f"source = {sql_literal(source)}").column('id').to_pylist()
+    )
+    occurrences = {}
+    new_ids = set()
+    total = 0
+    added = 0
+    for rows in staged:
+        total += rows.num_rows
+        ids = [row_id for _, row_id in chunk_ids(rows.column('text').to_pylist(), source, occurrences)]
+        rows = rows.set_column(rows.schema.get_field_index('id'), rows.schema.field('id'), pa.array(ids, pa.string()))
+        new_ids.update(ids)
+        rows = rows.filter(pa.array([row_id not in stored for row_id in ids], pa.bool_()))
+        if not rows.num_rows:
+            continue
+        with span('lancedb_write'):
+            table.add(rows)
+        added_ids = rows.column('id').to_pylist()
+        if fulltext is not None:
+            try:
+                with span('fts_write'):
+                    fulltext.add(added_ids, rows.column('source').to_pylist(), rows.column('text').to_pylist())
+            except Exception:
+                # rows without postings would be skipped as already stored by a retried commit
+                delete_rows(table, added_ids, fulltext)
+                raise
+        added += len(added_ids)
+    removed = sorted(stored - new_ids)
+    delete_rows(table, removed, fulltext)
+    return total, added, len(removed)
@@ -0,0 +1,193 @@
+import os
+import re
+import math
+from collections import Counter
+
+import vectorstore
+from vectorstore import get_db_path, sql_literal
+
+# Maintain a BM25 index of the chunk texts next to every user table, off until inference searches it
+FTS_ENABLED = os.environ.get('FTS_ENABLED', 'false').lower() == 'true'
+FTS_TABLE_SUFFIX = '__fts'
+FTS_BM25_K1 = float(os.environ.get('FTS_BM25_K1', '1.2'))
+FTS_BM25_B = float(os.environ.get('FTS_BM25_B', '0.75'))
+
+# posting of the chunk itself, its tf is the length of the chunk in terms
+DOC_TERM = ''
+MAX_TERM_LENGTH = 64
+
+# words, and codes like INV-2023-0042, AB12.5 or 4711/B kept together
+_TOKEN = re.compile(r"[^\W_]+(?:[-_./:#][^\W_]+)*")
+_SEPARATOR = re.compile(r"[-_./:#]")
+
+_schema = None
+
+
+def tokenize(text):
+    """Lowercased terms of a text. Codes are indexed whole and by their parts."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if len(token) > MAX_TERM_LENGTH:
+            continue
+        terms.append(token)
+        if _SEPARATOR.search(token):
+            terms.extend(part for part in _SEPARATOR.split(token) if part)
+    return terms
+
+
+def get_fts_schema():
+    global _schema
+    if _schema is None:
+        import pyarrow as pa
+        _schema = pa.schema(
+            [
+                pa.field("term", pa.string()),
+                pa.field("id", pa.string()),
+                pa.field("source", pa.string()),
+                pa.field("tf", pa.int32()),
+                pa.field("length", pa.int32())
+            ],
+            metadata={'fts_version': '1'}
+        )
+    return _schema
+
+
+def fts_table_name(lance_table):
+    return f"{lance_table}{FTS_TABLE_SUFFIX}"
+
+
+def build_postings(row_ids, sources, texts):
+    """Posting rows (term, id, source, tf, length) of chunks, plus one DOC_TERM row per chunk."""
+    postings = []
+    for row_id, source, text in zip(row_ids, sources, texts):
+        terms = Counter(tokenize(text or ''))
+        length = sum(terms.values())
+        postings.append({'term': DOC_TERM, 'id': row_id, 'source': source, 'tf': length, 'length': length})
+        for term, tf in terms.items():
+            postings.append({'term': term, 'id': row_id, 'source': source, 'tf': tf, 'length': length})
+    return postings
+
+
+def _sql_list(values):
+    return ', '.join(sql_literal(value) for value in values)
+
+
+def _and(where, condition):
+    return f"({where}) AND {condition}" if where else condition
+
+
+def open_fulltext_index(bucket, lance_table, create=False, cache=None):
+    """FullTextIndex of a user table, created when `create` is set, else None when it does not exist."""
+    cache = cache or vectorstore.table_cache
+    table = cache.get(get_db_path(bucket, lance_table), fts_table_name(lance_table), get_fts_schema() if create else None)
+    return FullTextIndex(table) if table is not None else None
+
+
+def reopen_fulltext_index(bucket, lance_table, cache=None):
+    """Drop the cached handle of the full-text index of a user table and open its latest version."""
+    cache = cache or vectorstore.table_cache
+    cache.invalidate(get_db_path(bucket, lance_table), fts_table_name(lance_table))
+    return open_fulltext_index(bucket, lance_table, cache=cache)
+
+
+class FullTextIndex:
+    """BM25 inverted index of the `text` column of a user table.
+
+    LanceDB's own full-text index is a local tantivy directory, which does
+    not work on S3, so the postings are kept in a sidecar LanceDB table
+    (`<table>__fts`) of the same database, one row per (term, chunk). Every
+    write to the user table is mirrored by the same predicate on `id` or
+    `source`, which both tables share.
+    """
+
+    def __init__(self, table, k1=FTS_BM25_K1, b=FTS_BM25_B):
+        self.table = table
+        self.k1 = k1
+        self.b = b
+
+    def add(self, row_ids, sources, texts):
+        postings = build_postings(row_ids, sources, texts)
+        if postings:
+            self.table.add(postings)
+        return len(postings)
+
+    def add_documents(self, docs):
+        """Index langchain documents written to the user table (with `id` and `source` metadata)."""
+        return self.add(
+            [doc.metadata['id'] for doc in docs],
+            [doc.metadata.get('source') for doc in docs],
+            [doc.page_content for doc in docs]
+        )
+
+    def delete(self, where):
+        """Delete the postings of the chunks matched by a predicate on `id` and/or `source`."""
+        self.table.delete(where)
+
+    def delete_ids(self, row_ids):
+        if row_ids:
+            self.delete(f"id IN ({_sql_list(row_ids)})")
+
+    def _read(self, columns, where):
+        return self.table.to_lance().to_table(columns=columns, filter=where)
+
+    def document_count(self):
+        return self._read(['id'], "term = ''").num_rows
+
+    def search(self, query, k=10, where=None):
+        """Top-k (id, score) of the chunks matching the terms of `query`, by BM25.
+
+        `where` filters on `source` or `id`. Chunk count and average length
+        come from the DOC_TERM rows matched by the same filter.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        documents = self._read(['length'], _and(where, "term = ''"))
+        count = documents.num_rows
+        if count == 0:
+            return []
+        average_length = sum(documents.column('length').to_pylist()) / count
+
+        postings = self._read(
+            ['term', 'id', 'tf', 'length'], _and(where, f"term IN ({_sql_list(terms)})")
+        ).to_pydict()
+        frequencies = Counter(postings['term'])
+        scores = {}
+        for term, row_id, tf, length in zip(postings['term'], postings['id'], postings['tf'], postings['length']):
+            df = frequencies[term]
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+            scores[row_id] = scores.get(row_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def sync(self, table, batch_size=1000):
+        """Bring the index in line with the rows of the user table.
+
+        Only ids are compared, so memory is bounded by the row count rather
+        than the text. Postings of rows gone from the table, or indexed more
+        than once, are deleted and the rows not indexed are added, in
+        batches. The index is never emptied first: a sync that stops keeps
+        what it indexed so far and the next one picks up from there.
+        Returns the number of chunks added and removed.
+        """
+        indexed = Counter(self._read(['id'], "term = ''").column('id').to_pylist())
+        dataset = table.to_lance()
+        row_ids = set(dataset.to_table(columns=['id']).column('id').to_pylist())
+        stale = [row_id for row_id, count in indexed.items() if count > 1 or row_id not in row_ids]
+        for start in range(0, len(stale), batch_size):
+            self.delete_ids(stale[start:start + batch_size])
+        missing = row_ids.difference(row_id for row_id, count in indexed.items() if count == 1)
+        added = 0
+        if missing:
+            for batch in dataset.to_batches(columns=['id', 'source', 'text']):
+                rows = batch.to_pydict()
+                keep = [index for index, row_id in enumerate(rows['id']) if row_id in missing]
+                for start in range(0, len(keep), batch_size):
+                    chunk = keep[start:start + batch_size]
+                    self.add(
+                        [rows['id'][index] for index in chunk],
+                        [rows['source'][index] for index in chunk],
+                        [rows['text'][index] for index in chunk]
+                    )
+                added += len(keep)
+        return {'chunks_added': added, 'chunks_removed': len(stale)}
@@ -0,0 +1,203 @@
+import os
+import json
+import logging
+import math
+import time
+from datetime import timedelta
+
+from embedding_cache import is_missing_object_error
+from retrieval import search
+
+logger = logging.getLogger(__name__)
+
+# Compact a table once it has more fragments than this
+MAINTENANCE_FRAGMENT_THRESHOLD = int(os.environ.get('MAINTENANCE_FRAGMENT_THRESHOLD', '16'))
+# Versions older than this are removed by cleanup
+MAINTENANCE_VERSION_RETENTION_HOURS = float(os.environ.get('MAINTENANCE_VERSION_RETENTION_HOURS', '1'))
+# IVF-PQ needs enough rows to train its centroids, smaller tables are scanned
+MAINTENANCE_INDEX_MIN_ROWS = int(os.environ.get('MAINTENANCE_INDEX_MIN_ROWS', '5000'))
+MAINTENANCE_TARGET_ROWS_PER_FRAGMENT = int(os.environ.get('MAINTENANCE_TARGET_ROWS_PER_FRAGMENT', '1048576'))
+# Last table maintained by a scheduled run, in the LanceDB bucket, the next run starts after it
+MAINTENANCE_CURSOR_KEY = os.environ.get('MAINTENANCE_CURSOR_KEY', 'maintenance/cursor.json')
+
+
+def list_user_tables(s3_client, bucket, prefix='embeddings/'):
+    """List the user tables stored as embeddings/<cognito_sub>/ in the LanceDB bucket."""
+    tables = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            tables.append(common_prefix['Prefix'][len(prefix):].rstrip('/'))
+    return tables
+
+
+def read_cursor(s3_client, bucket, key=MAINTENANCE_CURSOR_KEY):
+    """Last table maintained by the previous scheduled run, None when there is none."""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        if not is_missing_object_error(e):
+            logger.warning(f"Error reading the maintenance cursor, starting from the first table: {e}")
+        return None
+    return json.loads(response['Body'].read()).get('table')
+
+
+def write_cursor(s3_client, bucket, table, key=MAINTENANCE_CURSOR_KEY):
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps({'table': table}).encode('utf-8'))
+
+
+def rotate_tables(tables, cursor):
+    """Tables in listing order, starting after `cursor`, so runs that stop early still reach every table."""
+    tables = sorted(tables)
+    if cursor is None:
+        return tables
+    start = next((index for index, name in enumerate(tables) if name > cursor), 0)
+    return tables[start:] + tables[:start]
+
+
+def count_fragments(dataset):
+    return len(dataset.get_fragments())
+
+
+def has_vector_index(dataset, column='vector'):
+    try:
+        indices = dataset.list_indices()
+    except Exception:
+        return False
+    return any(column in index.get('fields', []) for index in indices)
+
+
+def index_parameters(rows, embedding_size):
+    """IVF partitions ~ sqrt(rows), PQ sub-vectors of 16 dimensions (or the largest divisor below)."""
+    num_partitions = max(1, min(256, int(math.sqrt(rows))))
+    num_sub_vectors = max(1, embedding_size // 16)
+    while embedding_size % num_sub_vectors:
+        num_sub_vectors -= 1
+    return num_partitions, num_sub_vectors
+
+
+def sample_query_vector(dataset):
+    if dataset.count_rows() == 0:
+        return None
+    return dataset.take([0], columns=['vector']).column('vector')[0].as_py()
+
+
+def measure_query_latency(table, vector, k=4, runs=3):
+    """Median latency in ms of a top-k vector search on the table."""
+    if vector is None:
+        return None
+    timings = []
+    for _ in range(runs):
+        start = time.monotonic()
+        search(table, vector, k)
+        timings.append((time.monotonic() - start) * 1000)
+    return round(sorted(timings)[len(timings) // 2], 1)
+
+
+def compact_and_clean_up(dataset, force, fragment_threshold, retention_hours):
+    """Compact the fragments of a dataset when there are too many, then remove old versions."""
+    compacted = force or count_fragments(dataset) > fragment_threshold
+    if compacted:
+        metrics = dataset.optimize.compact_files(
+            target_rows_per_fragment=MAINTENANCE_TARGET_ROWS_PER_FRAGMENT
+        )
+        logger.info(f"Compaction metrics: {metrics}")
+        stats = dataset.cleanup_old_versions(older_than=timedelta(hours=retention_hours))
+        logger.info(f"Cleanup stats: {stats}")
+    return compacted
+
+
+def maintain_fulltext(fulltext, table, reopen=None, force=False,
+                      fragment_threshold=MAINTENANCE_FRAGMENT_THRESHOLD,
+                      retention_hours=MAINTENANCE_VERSION_RETENTION_HOURS):
+    """Sync the full-text index of a table when it is out of sync, and compact it.
+
+    Tables ingested before the index existed, or whose index missed a
+    write, have a different number of indexed chunks than rows.
+    """
+    reopen = reopen or (lambda: fulltext)
+    rows = table.to_lance().count_rows()
+    indexed = fulltext.document_count()
+    report = {'chunks_indexed': indexed, 'synced': False}
+    if force or indexed != rows:
+        logger.info(f"Syncing the full-text index: {indexed} chunks indexed, {rows} rows")
+        report.update(fulltext.sync(table))
+        report['synced'] = True
+        fulltext = reopen()
+        report['chunks_indexed'] = fulltext.document_count()
+    # every ingested batch appends a fragment to the postings too
+    report['compacted'] = compact_and_clean_up(
+        fulltext.table.to_lance(), force or report['synced'], fragment_threshold, retention_hours
+    )
+    return report
+
+
+def maintain_table(table, embedding_size, reopen=None, force=False,
+                   fragment_threshold=MAINTENANCE_FRAGMENT_THRESHOLD,
+                   index_min_rows=MAINTENANCE_INDEX_MIN_ROWS,
+                   retention_hours=MAINTENANCE_VERSION_RETENTION_HOURS,
+                   fulltext=None, reopen_fulltext=None):
+    """Compact fragments, clean up old versions and (re)build the IVF-PQ index of a table.
+
+    Every step is skipped when the table does not need it, unless `force` is
+    set. `reopen` returns a fresh handle of the table after a commit, as table
+    objects keep reading the version they were opened at. Returns a report
+    with fragment counts, and query latency before and after for the tables
+    that are compacted or indexed (None for the others).
+
+    The full-text index of the table, when given, is brought in sync and
+    compacted too (see `maintain_fulltext`).
+    """
+    reopen = reopen or (lambda: table)
+    dataset = table.to_lance()
+    rows = dataset.count_rows()
+    fragments = count_fragments(dataset)
+    compact = force or fragments > fragment_threshold
+    # compaction rewrites the fragments, so a previous index no longer covers them
+    index = rows >= index_min_rows and (compact or not has_vector_index(dataset))
+    # only tables about to change are probed
+    vector = sample_query_vector(dataset) if compact or index else None
+    report = {
+        'rows': rows,
+        'fragments_before': fragments,
+        'latency_ms_before': measure_query_latency(table, vector),
+        'compacted': False,
+        'cleaned_up': False,
+        'indexed': False
+    }
+
+    if compact:
+        metrics = dataset.optimize.compact_files(
+            target_rows_per_fragment=MAINTENANCE_TARGET_ROWS_PER_FRAGMENT
+        )
+        logger.info(f"Compaction metrics: {metrics}")
+        report['compacted'] = True
+        table = reopen()
+        dataset = table.to_lance()
+
+    # compaction and deletes leave old versions behind
+    if report['compacted'] or force:
+        stats = dataset.cleanup_old_versions(older_than=timedelta(hours=retention_hours))
+        logger.info(f"Cleanup stats: {stats}")
+        report['cleaned_up'] = True
+
+    if index:
+        num_partitions, num_sub_vectors = index_parameters(rows, embedding_size)
+        logger.info(f"Building IVF-PQ index: {num_partitions} partitions, {num_sub_vectors} sub vectors")
+        table.create_index(
+            metric='L2',
+            num_partitions=num_partitions,
+            num_sub_vectors=num_sub_vectors,
+            replace=True
+        )
+        report['indexed'] = True
+        table = reopen()
+        dataset = table.to_lance()
+
+    report['fragments_after'] = count_fragments(dataset)
+    report['latency_ms_after'] = measure_query_latency(table, vector)
+    if fulltext is not None:
+        report['fulltext'] = maintain_fulltext(
+            fulltext, table, reopen_fulltext, force, fragment_threshold, retention_hours
+        )
+    return report
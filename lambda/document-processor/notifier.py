@@ -0,0 +1,159 @@
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import count as counter
+
+logger = logging.getLogger(__name__)
+
+# Progress is only reported when it moved by at least this fraction
+NOTIFY_PROGRESS_STEP = float(os.environ.get('NOTIFY_PROGRESS_STEP', '0.1'))
+# How long an invocation waits for its pending notifications before returning
+NOTIFY_FLUSH_TIMEOUT_SECONDS = float(os.environ.get('NOTIFY_FLUSH_TIMEOUT_SECONDS', '2'))
+
+
+def is_gone_error(error):
+    """True for the GoneException of a WebSocket connection that was closed."""
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code', '')
+    return code == 'GoneException' or type(error).__name__ == 'GoneException'
+
+
+class Notifier:
+    """Send WebSocket notifications to users off the ingestion path.
+
+    `notify` and `progress` only enqueue; a background thread looks up the
+    connection id of the user (cached for the invocation), and posts the
+    messages in order. Pending progress updates of a document are coalesced
+    into the latest one. Connections that answer GoneException are marked
+    dead and skipped. Errors are logged, never raised.
+
+    `lookup(user)` returns the connection id of a user or raises, and
+    `send(connection_id, data)` posts a payload.
+    """
+
+    def __init__(self, lookup, send, progress_step=NOTIFY_PROGRESS_STEP, clock=time.monotonic):
+        self._lookup = lookup
+        self._send = send
+        self.progress_step = progress_step
+        self._clock = clock
+        self._connections = {}
+        self._dead = set()
+        self._pending = OrderedDict()
+        self._reported_progress = {}
+        self._sequence = counter()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start_invocation(self):
+        """Forget cached connection ids, users may have reconnected since the previous invocation."""
+        with self._condition:
+            self._connections.clear()
+            self._reported_progress.clear()
+
+    def notify(self, user, message, level='info'):
+        self._enqueue(('message', next(self._sequence)), user, {
+            'type': 'message',
+            'message': message,
+            'level': level
+        })
+
+    def progress(self, user, document, fraction, message=None):
+        """Report the progress of a document, from 0 to 1, in steps of `progress_step`."""
+        percent = int(max(0.0, min(1.0, fraction)) * 100)
+        with self._condition:
+            last = self._reported_progress.get((user, document))
+            if last is not None and percent < 100 and percent - last < self.progress_step * 100:
+                return
+            self._reported_progress[(user, document)] = percent
+        # replaces a pending update of the same document, keeping its place in the queue
+        self._enqueue(('progress', user, document), user, {
+            'type': 'progress',
+            'document': document,
+            'percent': percent,
+            'message': message or f"{document}: {percent}%",
+            'level': 'info'
+        })
+
+    def _enqueue(self, key, user, data):
+        try:
+            with self._condition:
+                self._pending[key] = (user, data)
+                self._ensure_thread()
+                self._condition.notify_all()
+        except Exception as e:
+            logger.warning(f"Error queueing notification for {user}: {e}")
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+            self._thread.start()
+
+    def _connection_id(self, user):
+        with self._condition:
+            if user in self._connections:
+                return self._connections[user]
+        try:
+            connection_id = self._lookup(user)
+        except Exception as e:
+            logger.info(f"No WebSocket connection for user {user}: {e}")
+            connection_id = None
+        with self._condition:
+            self._connections[user] = connection_id
+        return connection_id
+
+    def _deliver(self, user, data):
+        connection_id = self._connection_id(user)
+        if connection_id is None or connection_id in self._dead:
+            self.dropped += 1
+            return
+        try:
+            self._send(connection_id, data)
+            self.sent += 1
+        except Exception as e:
+            self.failed += 1
+            if is_gone_error(e):
+                logger.info(f"WebSocket connection {connection_id} of user {user} is gone")
+                with self._condition:
+                    self._dead.add(connection_id)
+                    self._connections[user] = None
+            else:
+                logger.warning(f"Error notifying user {user}: {e}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                _, (user, data) = self._pending.popitem(last=False)
+                self._in_flight += 1
+            try:
+                self._deliver(user, data)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def flush(self, timeout=NOTIFY_FLUSH_TIMEOUT_SECONDS):
+        """Wait for the queued notifications, at most `timeout` seconds.
+
+        Whatever is still queued afterwards is dropped: a frozen container
+        would otherwise deliver it at a later invocation.
+        """
+        deadline = self._clock() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if self._pending:
+                logger.warning(f"Dropping {len(self._pending)} notifications not sent in {timeout}s")
+                self.dropped += len(self._pending)
+                self._pending.clear()
+            return not self._in_flight
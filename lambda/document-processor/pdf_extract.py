@@ -0,0 +1,18 @@
+from pypdf import PdfReader
+
+
+def extract_pages_worker(file_path, page_numbers, conn):
+    """Send (page_number, text) of the given pages in order, then None.
+
+    Runs in the PDF extraction processes. It lives apart from pipeline.py so
+    that the forkserver they are forked from only preloads pypdf.
+    """
+    try:
+        reader = PdfReader(file_path)
+        for page_number in page_numbers:
+            conn.send((page_number, reader.pages[page_number].extract_text()))
+        conn.send(None)
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
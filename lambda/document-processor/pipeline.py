@@ -0,0 +1,395 @@
+import os
+import uuid
+import hashlib
+import multiprocessing
+from itertools import islice, tee
+from multiprocessing.connection import wait
+
+from langchain.schema import Document
+from pypdf import PdfReader
+
+from embedding import EmbeddingStats
+from embedding_cache import CacheStats, embed_with_cache
+from telemetry import count, span, timed_iter
+from vectorstore import sql_literal
+
+# Number of chunks embedded and appended to LanceDB at a time; bounds peak memory
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '128'))
+# Memory of the function, Lambda allocates 1 vCPU per 1769 MB of it, up to 6; 0 outside Lambda
+LAMBDA_MEMORY_MB = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '0'))
+# Processes extracting PDF text, one per vCPU by default: below 3538 MB PDFs are parsed serially
+PDF_EXTRACT_PROCESSES = int(os.environ.get('PDF_EXTRACT_PROCESSES', str(min(6, max(1, LAMBDA_MEMORY_MB // 1769)))))
+# PDFs with fewer pages are extracted serially, forking costs more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', '64'))
+# Pages handed to a process at a time; blocks are dealt round robin to balance heavy pages
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', '8'))
+# Longest wait for the next page from the extraction processes before they are killed
+PDF_PAGE_TIMEOUT_SECONDS = float(os.environ.get('PDF_PAGE_TIMEOUT_SECONDS', '60'))
+# Extraction processes are forked from a forkserver that only loaded pypdf, never from the
+# handler process, whose notifier and embedding threads may hold locks at fork time
+_extract_context = multiprocessing.get_context('forkserver')
+_extract_context.set_forkserver_preload(['pdf_extract'])
+
+
+def count_pdf_pages(file_path):
+    return len(PdfReader(file_path).pages)
+
+
+def iter_pdf_pages(file_path, first_page=0, last_page=None):
+    """Yield one Document per PDF page, with the same metadata as PyPDFLoader.
+
+    PyPDFLoader.load (and its lazy_load) extracts the text of every page
+    before returning the first one; here a page is only parsed when consumed.
+    Only the pages from `first_page` up to `last_page` (excluded) are read.
+    """
+    reader = PdfReader(file_path)
+    last_page = len(reader.pages) if last_page is None else min(last_page, len(reader.pages))
+    for page_number in range(first_page, last_page):
+        page = reader.pages[page_number]
+        count('pages')
+        yield Document(
+            page_content=page.extract_text(),
+            metadata={'source': file_path, 'page': page_number}
+        )
+
+
+def assign_page_blocks(page_count, processes, pages_per_task=PDF_PAGES_PER_TASK):
+    """Deal blocks of consecutive pages round robin, each process gets its pages in ascending order."""
+    assignments = [[] for _ in range(processes)]
+    for block, start in enumerate(range(0, page_count, pages_per_task)):
+        assignments[block % processes].extend(range(start, min(start + pages_per_task, page_count)))
+    return [pages for pages in assignments if pages]
+
+
+def iter_pdf_pages_parallel(file_path, page_count, processes, pages_per_task=PDF_PAGES_PER_TASK,
+                            page_timeout=PDF_PAGE_TIMEOUT_SECONDS):
+    """Extract the pages of a PDF in `processes` processes and yield them in page order.
+
+    Lambda has no /dev/shm, so multiprocessing.Pool and Queue fail there;
+    every process reports through its own Pipe instead. Pages that arrive
+    ahead of the next one to yield are buffered as text. When no process
+    sends anything for `page_timeout` seconds, they are killed and the
+    extraction fails.
+    """
+    from pdf_extract import extract_pages_worker
+
+    workers = {}
+    for page_numbers in assign_page_blocks(page_count, processes, pages_per_task):
+        parent_conn, child_conn = _extract_context.Pipe(duplex=False)
+        process = _extract_context.Process(
+            target=extract_pages_worker, args=(file_path, page_numbers, child_conn), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        workers[parent_conn] = process
+
+    pending = {}
+    next_page = 0
+    open_conns = list(workers)
+    try:
+        while next_page < page_count:
+            if next_page not in pending:
+                if not open_conns:
+                    raise RuntimeError(f"PDF extraction of {file_path} ended before page {next_page}")
+                ready = wait(open_conns, timeout=page_timeout)
+                if not ready:
+                    raise RuntimeError(f"PDF extraction of {file_path} sent no page for {page_timeout}s")
+                for conn in ready:
+                    try:
+                        message = conn.recv()
+                    except EOFError:
+                        message = ('error', 'extraction process exited')
+                    if message is None:
+                        open_conns.remove(conn)
+                    elif message[0] == 'error':
+                        raise RuntimeError(f"PDF extraction of {file_path} failed: {message[1]}")
+                    else:
+                        pending[message[0]] = message[1]
+                continue
+            count('pages')
+            yield Document(
+                page_content=pending.pop(next_page),
+                metadata={'source': file_path, 'page': next_page}
+            )
+            next_page += 1
+    finally:
+        for conn, process in workers.items():
+            conn.close()
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+
+def extract_pdf_pages(file_path, processes=PDF_EXTRACT_PROCESSES, min_pages=PDF_PARALLEL_MIN_PAGES,
+                      pages_per_task=PDF_PAGES_PER_TASK):
+    """Yield the pages of a PDF, extracted in parallel for large files and serially otherwise."""
+    if processes > 1:
+        page_count = count_pdf_pages(file_path)
+        if page_count >= min_pages:
+            yield from iter_pdf_pages_parallel(file_path, page_count, processes, pages_per_task)
+            return
+    yield from iter_pdf_pages(file_path)
+
+
+def iter_chunks(pages, splitter):
+    """Split pages one at a time.
+
+    Text splitters never merge text across documents, so this yields the same
+    chunks as `splitter.split_documents(list(pages))`.
+    """
+    for page in pages:
+        yield from splitter.split_documents([page])
+
+
+def iter_batches(items, batch_size):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def chunk_key(text):
+    """Content hash of a chunk, the same for a new chunk and a stored row.
+
+    The page is left out, like in the embedding cache key, so a chunk moved
+    to another page by an edit earlier in the document is still reused.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chunk_ids(texts, source, occurrences=None):
+    """Yield (chunk key, row id) of the chunks of a document, in document order.
+
+    The id derives from the source, the chunk key and the number of
+    identical chunks before it, so re-ingesting a document yields the same ids.
+    A document read in pieces passes the same `occurrences` dict for every piece.
+    """
+    occurrences = occurrences if occurrences is not None else {}
+    for text in texts:
+        key = chunk_key(text)
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        yield key, hashlib.sha256(f"{source}\0{key}\0{occurrence}".encode('utf-8')).hexdigest()[:32]
+
+
+def assign_chunk_ids(chunks, source):
+    """Set a chunk key and a deterministic row id on every chunk, see `chunk_ids`."""
+    chunks, texts = tee(chunks)
+    for doc, (key, row_id) in zip(chunks, chunk_ids((doc.page_content for doc in texts), source)):
+        doc.metadata['chunk_key'] = key
+        doc.metadata['id'] = row_id
+        yield doc
+
+
+def build_rows(docs, vectors):
+    """Build LanceDB rows from langchain documents and their embeddings."""
+    rows = []
+    for doc, vector in zip(docs, vectors):
+        rows.append({
+            'vector': vector,
+            'text': doc.page_content,
+            'id': doc.metadata.get('id') or str(uuid.uuid4()),
+            'source': doc.metadata.get('source'),
+            'page': str(doc.metadata.get('page'))
+        })
+    return rows
+
+
+class IngestStats:
+    """Counters of one streamed ingestion."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.batches = 0
+        # incremental re-ingestion: stored chunks kept as they are, and stored chunks deleted
+        self.reused = 0
+        self.removed = 0
+        self.embedding = EmbeddingStats()
+        self.cache = CacheStats()
+
+    def as_dict(self):
+        return {
+            'chunks': self.chunks,
+            'batches': self.batches,
+            'reused': self.reused,
+            'removed': self.removed,
+            'embedding': self.embedding.as_dict(),
+            'cache': self.cache.as_dict()
+        }
+
+
+def ingest_chunks(chunks, table, engine, cache=None, batch_size=INGEST_BATCH_SIZE, stats=None, on_batch=None,
+                  fulltext=None):
+    """Embed chunks batch by batch and append every batch to the LanceDB table.
+
+    Only one batch of chunks, vectors and rows is alive at any time, so peak
+    memory depends on `batch_size` and not on the size of the document.
+    Every batch is also indexed by `fulltext` (a FullTextIndex) when given.
+    `on_batch` is called with every batch once it has been written.
+    """
+    stats = stats if stats is not None else IngestStats()
+    # time spent pulling chunks is PDF parsing plus splitting
+    for batch in iter_batches(timed_iter(chunks, 'load_split'), batch_size):
+        with span('embed'):
+            vectors, _ = embed_with_cache(
+                engine, cache, [doc.page_content for doc in batch], stats.embedding, stats.cache
+            )
+        if fulltext is not None:
+            # both tables must agree on the row ids
+            for doc in batch:
+                doc.metadata['id'] = doc.metadata.get('id') or str(uuid.uuid4())
+        with span('lancedb_write'):
+            table.add(build_rows(batch, vectors))
+        if fulltext is not None:
+            try:
+                with span('fts_write'):
+                    fulltext.add_documents(batch)
+            except Exception:
+                # rows of the batch must not stay in the table without their postings
+                delete_rows(table, [doc.metadata['id'] for doc in batch], fulltext)
+                raise
+        stats.chunks += len(batch)
+        stats.batches += 1
+        if on_batch is not None:
+            on_batch(batch)
+    return stats
+
+
+def page_progress(file_path, progress):
+    """Batch callback reporting the fraction of the pages of a PDF ingested."""
+    if progress is None:
+        return None
+    page_count = count_pdf_pages(file_path) or 1
+
+    def on_batch(batch):
+        progress((batch[-1].metadata['page'] + 1) / page_count)
+
+    return on_batch
+
+
+def batch_callback(file_path, stats, progress=None, checkpoint=None):
+    """Batch callback reporting page progress, and checkpointing the number of chunks stored so far."""
+    report_progress = page_progress(file_path, progress)
+
+    def callback(batch):
+        if report_progress is not None:
+            report_progress(batch)
+        if checkpoint is not None:
+            checkpoint(stats.reused + stats.chunks)
+
+    return callback
+
+
+def ingest_pdf(file_path, splitter, table, engine, cache=None, batch_size=INGEST_BATCH_SIZE, progress=None,
+               fulltext=None, checkpoint=None):
+    """Stream a local PDF through page iterator -> splitter -> embedding batches -> LanceDB appends.
+
+    `progress` is called with the fraction of pages ingested after every
+    batch, and `checkpoint` with the number of chunks written so far.
+    """
+    stats = IngestStats()
+    chunks = assign_chunk_ids(iter_chunks(extract_pdf_pages(file_path), splitter), file_path)
+    return ingest_chunks(
+        chunks, table, engine, cache, batch_size, stats=stats,
+        on_batch=batch_callback(file_path, stats, progress, checkpoint), fulltext=fulltext
+    )
+
+
+def embed_pdf_pages(file_path, first_page, last_page, splitter, schema, engine, cache=None,
+                    batch_size=INGEST_BATCH_SIZE, stats=None, on_batch=None):
+    """Embed a page range of a PDF into an Arrow table of rows in `schema`, without writing them.
+
+    Used by the parts of a fan-out job, whose rows are staged and written to
+    the user table part by part once every part is done. Identical chunks
+    of different parts get the same id here, `fanout.commit_staged` gives
+    the rows their final ids over the whole document. `on_batch` is called
+    with every batch once it has been embedded.
+    """
+    import pyarrow as pa
+    stats = stats if stats is not None else IngestStats()
+    pages = iter_pdf_pages(file_path, first_page, last_page)
+    tables = []
+    for batch in iter_batches(timed_iter(assign_chunk_ids(iter_chunks(pages, splitter), file_path), 'load_split'),
+                              batch_size):
+        with span('embed'):
+            vectors, _ = embed_with_cache(
+                engine, cache, [doc.page_content for doc in batch], stats.embedding, stats.cache
+            )
+        tables.append(pa.Table.from_pylist(build_rows(batch, vectors), schema=schema))
+        stats.chunks += len(batch)
+        stats.batches += 1
+        if on_batch is not None:
+            on_batch(batch)
+    return (pa.concat_tables(tables) if tables else schema.empty_table()), stats
+
+
+def is_legacy_row_id(row_id):
+    """True for the uuid4 ids of rows not written with a deterministic id, see `chunk_ids`."""
+    return '-' in row_id
+
+
+def load_source_chunks(table, source):
+    """Row ids of the stored rows of a source, and the chunk keys of its legacy rows mapped to their ids."""
+    rows = table.to_lance().to_table(columns=['id', 'text'], filter=f"source = {sql_literal(source)}").to_pydict()
+    stored_ids = set()
+    legacy = {}
+    for row_id, text in zip(rows['id'], rows['text']):
+        if is_legacy_row_id(row_id):
+            legacy.setdefault(chunk_key(text), []).append(row_id)
+        else:
+            stored_ids.add(row_id)
+    return stored_ids, legacy
+
+
+def delete_rows(table, row_ids, fulltext=None):
+    if row_ids:
+        with span('lancedb_delete'):
+            table.delete(f"id IN ({', '.join(sql_literal(row_id) for row_id in row_ids)})")
+            if fulltext is not None:
+                fulltext.delete_ids(row_ids)
+
+
+def ingest_pdf_update(file_path, splitter, table, engine, cache=None, batch_size=INGEST_BATCH_SIZE, progress=None,
+                      fulltext=None, checkpoint=None):
+    """Re-ingest a new version of a PDF whose previous version is stored under the same source.
+
+    Chunks are diffed by row id against the stored rows: unchanged chunks
+    are kept, also when they moved to another page, new ones are embedded
+    and appended, and stored chunks missing from the new version are
+    deleted. Legacy rows with uuid ids are matched by chunk key (their text). Rows are appended before the stale ones
+    are deleted, so readers never miss content. A failure keeps what was
+    appended next to the previous version, for the retry to reuse.
+
+    The same diff resumes an interrupted ingestion: the rows written before
+    the interruption are the stored chunks kept.
+    """
+    stored_ids, legacy = load_source_chunks(table, file_path)
+    stats = IngestStats()
+
+    def new_chunks():
+        for doc in assign_chunk_ids(iter_chunks(extract_pdf_pages(file_path), splitter), file_path):
+            if doc.metadata['id'] in stored_ids:
+                stored_ids.remove(doc.metadata['id'])
+                stats.reused += 1
+                continue
+            legacy_ids = legacy.get(doc.metadata['chunk_key'])
+            if legacy_ids:
+                legacy_ids.pop()
+                stats.reused += 1
+                continue
+            yield doc
+
+    ingest_chunks(
+        new_chunks(), table, engine, cache, batch_size, stats=stats,
+        on_batch=batch_callback(file_path, stats, progress, checkpoint), fulltext=fulltext
+    )
+
+    removed_ids = sorted(stored_ids) + [row_id for row_ids in legacy.values() for row_id in row_ids]
+    delete_rows(table, removed_ids, fulltext)
+    stats.removed = len(removed_ids)
+    return stats
@@ -0,0 +1,398 @@
+import os
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from telemetry import span
+from transfer import is_same_object
+
+logger = logging.getLogger(__name__)
+
+# Parallel GSI queries when prefetching the registry rows of an SQS batch
+REGISTRY_PREFETCH_CONCURRENCY = int(os.environ.get('REGISTRY_PREFETCH_CONCURRENCY', '8'))
+
+# Statuses of the registry row of a document; rows written before statuses existed have none,
+# their documents were fully ingested and count as committed
+STATUS_PENDING = 'PENDING'
+STATUS_EMBEDDING = 'EMBEDDING'
+STATUS_COMMITTED = 'COMMITTED'
+# A delivery finding an ingestion that is not committed takes it over once its lease expired. The
+# handler leases it until the deadline of its invocation, so that the retry of its message always
+# finds it expired; this is the lease without a Lambda context
+INGEST_LEASE_SECONDS = int(os.environ.get('INGEST_LEASE_SECONDS', '300'))
+# Lease of a fan-out job, renewed by every part done; a job whose parts stopped coming (dead letter
+# queue) is taken over by the next delivery of its object once it expires. Keep it above the visibility
+# timeout times the maxReceiveCount of the queue, the longest a part may be retried
+FANOUT_LEASE_SECONDS = int(os.environ.get('FANOUT_LEASE_SECONDS', '1800'))
+
+_thread_local = threading.local()
+
+
+class IngestionInProgress(Exception):
+    """Raised when the registry row of a document is not committed and another delivery holds its lease."""
+
+
+def get_dynamodb_resource():
+    """boto3 resources are not thread safe, every thread gets its own."""
+    if not hasattr(_thread_local, 'dynamodb_resource'):
+        _thread_local.dynamodb_resource = boto3.session.Session().resource('dynamodb')
+    return _thread_local.dynamodb_resource
+
+
+def is_conditional_check_failure(error):
+    return (
+        isinstance(error, ClientError)
+        and error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+    )
+
+
+def is_committed(item):
+    return item.get('status', STATUS_COMMITTED) == STATUS_COMMITTED
+
+
+class DocumentRegistry:
+    """The document registry table (PK md5(user+bytes), SK s3_path, GSI on s3_path).
+
+    Lookups are memoized for the invocation: `prefetch_s3_paths` queries the
+    rows of every object of an SQS batch in parallel up front, and writes
+    keep the memo up to date. `start_invocation` forgets it, as other
+    containers write to the table between invocations.
+
+    A row goes PENDING (stored before the download is ingested) ->
+    EMBEDDING (batches written, `chunks_committed` checkpointed after each)
+    -> COMMITTED (every chunk written). Only committed documents count as
+    processed; the others are resumed by the next delivery of their object
+    once their lease expired, the deliveries before that are retried.
+    """
+
+    def __init__(self, table_name, s3_path_index, resource=get_dynamodb_resource,
+                 prefetch_concurrency=REGISTRY_PREFETCH_CONCURRENCY):
+        self.table_name = table_name
+        self.s3_path_index = s3_path_index
+        self._resource = resource
+        self.prefetch_concurrency = prefetch_concurrency
+        self._lock = threading.Lock()
+        self._by_s3_path = {}
+        self._md5_exists = {}
+        self._executor = None
+        self.queries = 0
+        self.memo_hits = 0
+
+    def table(self):
+        """Table object of the calling thread, built once."""
+        tables = _thread_local.__dict__.setdefault('registry_tables', {})
+        if self.table_name not in tables:
+            tables[self.table_name] = self._resource().Table(self.table_name)
+        return tables[self.table_name]
+
+    def start_invocation(self):
+        with self._lock:
+            self._by_s3_path.clear()
+            self._md5_exists.clear()
+
+    def _remember(self, s3_path, items):
+        with self._lock:
+            self._by_s3_path[s3_path] = list(items)
+            for item in items:
+                if is_committed(item):
+                    self._md5_exists[item['md5']] = True
+
+    def _query_s3_path(self, s3_path):
+        with span('registry'):
+            response = self.table().query(
+                IndexName=self.s3_path_index,
+                KeyConditionExpression=Key('s3_path').eq(s3_path)
+            )
+        self.queries += 1
+        return response.get('Items', [])
+
+    def prefetch_s3_paths(self, s3_paths):
+        """Load the rows of many S3 paths with parallel GSI queries.
+
+        batch_get_item needs the full (md5, s3_path) key, and the md5 of an
+        object is only known once it has been downloaded, so the GSI is
+        queried instead. Failed queries are left to the lazy lookup. The
+        pool is kept with the registry, so its threads build their DynamoDB
+        resource once per container rather than once per batch.
+        """
+        s3_paths = [path for path in dict.fromkeys(s3_paths) if path not in self._by_s3_path]
+        if not s3_paths:
+            return
+
+        def fetch(s3_path):
+            try:
+                self._remember(s3_path, self._query_s3_path(s3_path))
+            except Exception as e:
+                logger.warning(f"Error prefetching registry rows of {s3_path}: {e}")
+
+        if self.prefetch_concurrency > 1 and len(s3_paths) > 1:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.prefetch_concurrency, thread_name_prefix='registry-prefetch'
+                    )
+            list(self._executor.map(fetch, s3_paths))
+        else:
+            for s3_path in s3_paths:
+                fetch(s3_path)
+
+    def get_file_infos_by_s3_path(self, s3_path):
+        with self._lock:
+            items = self._by_s3_path.get(s3_path)
+        if items is not None:
+            self.memo_hits += 1
+            return list(items)
+        items = self._query_s3_path(s3_path)
+        self._remember(s3_path, items)
+        return items
+
+    def get_md5_by_s3_path(self, s3_path):
+        items = self.get_file_infos_by_s3_path(s3_path)
+        return items[0]['md5'] if items else None
+
+    def is_object_processed(self, s3_path, etag, size):
+        """Check, before downloading, if this exact object (same ETag and size) was already ingested."""
+        if not etag or size is None:
+            return False
+        return any(
+            is_committed(item) and is_same_object(item, etag, size) for item in self.get_file_infos_by_s3_path(s3_path)
+        )
+
+    def is_file_processed(self, md5_hash):
+        """Check if a committed document with this md5(user+bytes) exists, under any S3 path."""
+        with self._lock:
+            exists = self._md5_exists.get(md5_hash)
+        if exists is not None:
+            self.memo_hits += 1
+            return exists
+        with span('registry'):
+            response = self.table().query(
+                KeyConditionExpression=Key('md5').eq(md5_hash)
+            )
+        self.queries += 1
+        exists = any(is_committed(item) for item in response.get('Items', []))
+        with self._lock:
+            self._md5_exists[md5_hash] = exists
+        return exists
+
+    def store_file_info(self, md5_hash, cognito_sub, s3_path, etag=None, size=None,
+                        lease_seconds=INGEST_LEASE_SECONDS):
+        """Store a PENDING registry row unless it exists, returns False when it already did.
+
+        The conditional put closes the race of two deliveries of the same
+        object passing `is_file_processed` at the same time: only one of
+        them stores the row and ingests. The row is claimed by the caller
+        for `lease_seconds`.
+        """
+        item = {
+            'md5': md5_hash,
+            'user': cognito_sub,
+            's3_path': s3_path,
+            'status': STATUS_PENDING,
+            'lease_until': int(time.time()) + lease_seconds
+        }
+        if etag and size is not None:
+            item['etag'] = etag
+            item['size'] = size
+        try:
+            with span('registry'):
+                self.table().put_item(
+                    Item=item,
+                    ConditionExpression='attribute_not_exists(md5) AND attribute_not_exists(s3_path)'
+                )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                return False
+            raise
+        with self._lock:
+            self._by_s3_path.setdefault(s3_path, []).insert(0, item)
+        return True
+
+    def _update_status(self, md5_hash, s3_path, update_expression, condition, values, return_values='NONE'):
+        """Conditional update of a row, returns None when the condition failed."""
+        try:
+            with span('registry'):
+                return self.table().update_item(
+                    Key={'md5': md5_hash, 's3_path': s3_path},
+                    UpdateExpression=update_expression,
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues=values,
+                    ReturnValues=return_values
+                )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                return None
+            raise
+
+    def resume_ingestion(self, md5_hash, s3_path, lease_seconds=INGEST_LEASE_SECONDS):
+        """Claim the ingestion of a document that was stored but never committed.
+
+        An earlier delivery timed out or failed after `store_file_info`, or
+        the parts of its fan-out job stopped coming. Its row is taken over
+        once its lease expired, and a fan-out job it ran is dropped. Returns
+        the row, with the `chunks_committed` of its last checkpoint, or None
+        when the document is committed. Raises IngestionInProgress while the
+        row is leased, or gone, so that the message is retried.
+        """
+        now = int(time.time())
+        response = self._update_status(
+            md5_hash, s3_path,
+            'SET lease_until = :until ADD attempts :one REMOVE fanout_job, fanout_parts, fanout_done',
+            '#status <> :committed AND lease_until < :now',
+            {':until': now + lease_seconds, ':one': 1, ':committed': STATUS_COMMITTED, ':now': now},
+            'ALL_NEW'
+        )
+        if response is not None:
+            return response['Attributes']
+        with span('registry'):
+            item = self.table().get_item(Key={'md5': md5_hash, 's3_path': s3_path}, ConsistentRead=True).get('Item')
+        if item is not None and is_committed(item):
+            return None
+        state = f"leased until {item.get('lease_until')}" if item is not None else 'deleted'
+        raise IngestionInProgress(f"Ingestion of {s3_path} is not committed and {state}")
+
+    def checkpoint(self, md5_hash, s3_path, chunks):
+        """Record that the first `chunks` chunks of a document are written, returns False when its row is gone."""
+        return self._update_status(
+            md5_hash, s3_path,
+            'SET #status = :embedding, chunks_committed = :chunks',
+            'attribute_exists(md5)',
+            {':embedding': STATUS_EMBEDDING, ':chunks': chunks}
+        ) is not None
+
+    def release(self, md5_hash, s3_path):
+        """Give up the claim of a failed ingestion, so the next delivery resumes it right away.
+
+        A fan-out job it started is dropped too, the parts it managed to
+        enqueue are then discarded and the next delivery splits it again.
+        """
+        self._update_status(
+            md5_hash, s3_path,
+            'SET lease_until = :zero REMOVE fanout_job, fanout_parts, fanout_done',
+            'attribute_exists(md5)',
+            {':zero': 0}
+        )
+
+    def commit_file_info(self, md5_hash, s3_path, chunks):
+        """Mark a document COMMITTED once all its chunks are written, returns False when its row is gone."""
+        committed = self._update_status(
+            md5_hash, s3_path,
+            'SET #status = :committed, chunks_committed = :chunks REMOVE lease_until',
+            'attribute_exists(md5)',
+            {':committed': STATUS_COMMITTED, ':chunks': chunks}
+        ) is not None
+        if committed:
+            with self._lock:
+                for item in self._by_s3_path.get(s3_path, []):
+                    if item['md5'] == md5_hash:
+                        item['status'] = STATUS_COMMITTED
+                self._md5_exists[md5_hash] = True
+        return committed
+
+    def _forget(self, md5_hash, s3_path):
+        with self._lock:
+            items = self._by_s3_path.get(s3_path)
+            if items is not None:
+                self._by_s3_path[s3_path] = [item for item in items if item['md5'] != md5_hash]
+            # rows of the same md5 may remain under other S3 paths
+            self._md5_exists.pop(md5_hash, None)
+
+    def delete_file_info(self, md5_hash, s3_path):
+        with span('registry'):
+            response = self.table().delete_item(Key={'md5': md5_hash, 's3_path': s3_path})
+        self._forget(md5_hash, s3_path)
+        return response
+
+    def delete_file_infos(self, keys, max_attempts=5):
+        """Delete many (md5, s3_path) rows with batch_write_item.
+
+        Returns the keys that could not be deleted, after retrying unprocessed items.
+        Duplicate keys are sent once, as a batch repeating a key is rejected.
+        """
+        keys = list(dict.fromkeys(keys))
+        resource = self._resource()
+        failed = []
+        for start in range(0, len(keys), 25):
+            requests = [
+                {'DeleteRequest': {'Key': {'md5': md5_hash, 's3_path': s3_path}}}
+                for md5_hash, s3_path in keys[start:start + 25]
+            ]
+            for attempt in range(max_attempts):
+                try:
+                    with span('registry'):
+                        response = resource.batch_write_item(RequestItems={self.table_name: requests})
+                except Exception as e:
+                    logger.error(f"Error deleting file infos from DynamoDB: {e}")
+                    break
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if not requests:
+                    break
+                time.sleep(min(2, 0.05 * 2 ** attempt))
+            failed.extend(
+                (request['DeleteRequest']['Key']['md5'], request['DeleteRequest']['Key']['s3_path'])
+                for request in requests
+            )
+        failed_keys = set(failed)
+        for key in keys:
+            if key not in failed_keys:
+                self._forget(*key)
+        return failed
+
+    def start_fanout(self, md5_hash, s3_path, job_id, parts):
+        """Record a fan-out job on the registry row of a document, with no part done yet.
+
+        The row is leased for FANOUT_LEASE_SECONDS, renewed by every part done.
+        """
+        with span('registry'):
+            self.table().update_item(
+                Key={'md5': md5_hash, 's3_path': s3_path},
+                UpdateExpression='SET #status = :embedding, fanout_job = :job, fanout_parts = :parts, '
+                                 'lease_until = :until REMOVE fanout_done',
+                ConditionExpression='attribute_exists(md5)',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':embedding': STATUS_EMBEDDING, ':job': job_id, ':parts': parts,
+                    ':until': int(time.time()) + FANOUT_LEASE_SECONDS
+                }
+            )
+
+    def complete_fanout_part(self, md5_hash, s3_path, job_id, part):
+        """Count a part of a fan-out job as done and renew its lease, returns (parts done, parts).
+
+        The parts done are a string set, so a redelivered part is counted
+        once. Returns None when the row no longer runs this job (the
+        document was deleted, overwritten or already committed).
+        """
+        try:
+            with span('registry'):
+                response = self.table().update_item(
+                    Key={'md5': md5_hash, 's3_path': s3_path},
+                    UpdateExpression='SET lease_until = :until ADD fanout_done :part',
+                    ConditionExpression='fanout_job = :job',
+                    ExpressionAttributeValues={
+                        ':part': {str(part)}, ':job': job_id, ':until': int(time.time()) + FANOUT_LEASE_SECONDS
+                    },
+                    ReturnValues='ALL_NEW'
+                )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                return None
+            raise
+        item = response.get('Attributes', {})
+        return len(item.get('fanout_done', ())), int(item.get('fanout_parts', 0))
+
+    def finish_fanout(self, md5_hash, s3_path, job_id, chunks):
+        """Mark a row COMMITTED and clear its fan-out job, returns False when another commit did it first."""
+        return self._update_status(
+            md5_hash, s3_path,
+            'SET #status = :committed, chunks_committed = :chunks '
+            'REMOVE fanout_job, fanout_parts, fanout_done, lease_until',
+            'fanout_job = :job',
+            {':committed': STATUS_COMMITTED, ':chunks': chunks, ':job': job_id}
+        ) is not None
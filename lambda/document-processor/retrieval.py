@@ -0,0 +1,71 @@
+import os
+
+from vectorstore import sql_literal
+
+# Rows fetched from the vector and the full-text search before they are fused
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', '20'))
+# Reciprocal rank fusion constant, larger values flatten the weight of the top ranks
+RRF_K = int(os.environ.get('RRF_K', '60'))
+
+RESULT_COLUMNS = ['id', 'text', 'source', 'page']
+
+
+def _read(dataset, columns, where):
+    return dataset.to_table(columns=columns, filter=where) if where else dataset.to_table(columns=columns)
+
+
+def search(table, query_vector, k=4, where=None):
+    """Top-k rows of a user table closest to `query_vector`.
+
+    Returns dicts with id, text, source, page and `_distance` (squared L2),
+    nearest first.
+    """
+    query = table.search(query_vector).limit(k)
+    if where:
+        query = query.where(where)
+    rows = query.to_arrow().to_pylist()
+    return [{column: row.get(column) for column in RESULT_COLUMNS + ['_distance']} for row in rows]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked lists of ids: score(id) = sum of 1 / (k + rank) over the lists it is in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, row_id in enumerate(ranking, start=1):
+            scores[row_id] = scores.get(row_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def hybrid_search(table, fulltext, query_text, query_vector, k=4, where=None,
+                  candidates=HYBRID_CANDIDATES, rrf_k=RRF_K):
+    """Top-k rows by reciprocal rank fusion of a vector search and a BM25 search of the same table.
+
+    Both searches return `candidates` rows. Returns dicts with id, text,
+    source, page and `_score` (fused), plus `_distance` and `_bm25` of the
+    searches that found the row. Without a full-text index it is a vector
+    search.
+    """
+    vector_rows = search(table, query_vector, max(k, candidates), where)
+    keyword_hits = fulltext.search(query_text, max(k, candidates), where) if fulltext is not None else []
+
+    by_id = {row['id']: row for row in vector_rows}
+    bm25 = dict(keyword_hits)
+    fused = reciprocal_rank_fusion(
+        [[row['id'] for row in vector_rows], [row_id for row_id, _ in keyword_hits]], rrf_k
+    )[:k]
+
+    missing = [row_id for row_id, _ in fused if row_id not in by_id]
+    if missing:
+        rows = _read(table.to_lance(), RESULT_COLUMNS, f"id IN ({', '.join(sql_literal(row_id) for row_id in missing)})")
+        by_id.update({row['id']: row for row in rows.to_pylist()})
+
+    results = []
+    for row_id, score in fused:
+        if row_id not in by_id:
+            # postings of a row deleted since, until maintenance rebuilds the index
+            continue
+        row = dict(by_id[row_id], _score=score)
+        if row_id in bm25:
+            row['_bm25'] = bm25[row_id]
+        results.append(row)
+    return results
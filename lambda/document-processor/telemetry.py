@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# json: one structured line per record, emf: the same line in CloudWatch Embedded Metric Format
+METRICS_FORMAT = os.environ.get('METRICS_FORMAT', 'json')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ServerlessRag/DocumentProcessor')
+
+# the Lambda runtime installs its handler on the root logger
+logging.getLogger().setLevel(LOG_LEVEL)
+
+_current_trace = contextvars.ContextVar('record_trace', default=None)
+
+COUNTER_UNITS = {
+    'bytes': 'Bytes',
+    'pages': 'Count',
+    'chunks': 'Count',
+    'embedding_calls': 'Count',
+    'embedding_retries': 'Count',
+    'embedding_throttles': 'Count',
+    'cache_hits': 'Count',
+    'cache_misses': 'Count',
+}
+
+# backpressure metrics of an invocation (see throughput.ThroughputController.summary)
+INVOCATION_UNITS = {
+    'records': 'Count',
+    'records_started': 'Count',
+    'records_deferred': 'Count',
+    'deadline_stops': 'Count',
+    'elapsed_ms': 'Milliseconds',
+    'remaining_ms': 'Milliseconds',
+    'time_used': 'None',
+    'chunk_ms': 'Milliseconds',
+    'estimated_record_ms': 'Milliseconds',
+    'record_capacity': 'Count',
+    'embedding_rate': 'Count/Second',
+}
+
+
+class RecordTrace:
+    """Durations and counters of the processing of one S3 record.
+
+    Spans with the same name add up, e.g. every WebSocket notification of a
+    record is accounted under `notify`.
+    """
+
+    def __init__(self, operation, document):
+        self.operation = operation
+        self.document = document
+        self.spans = {}
+        self.counters = {}
+        self.status = None
+        self.start = time.monotonic()
+
+    @contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + (time.monotonic() - start)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self, status_code=None):
+        return {
+            'type': 'record_trace',
+            'operation': self.operation,
+            'document': self.document,
+            'status': status_code,
+            'duration_ms': round((time.monotonic() - self.start) * 1000, 1),
+            'spans_ms': {name: round(value * 1000, 1) for name, value in self.spans.items()},
+            **self.counters
+        }
+
+    def emit(self, status_code=None, metrics_format=METRICS_FORMAT):
+        line = self.as_dict(status_code)
+        if metrics_format == 'emf':
+            line = to_emf(line)
+        # printed rather than logged, EMF needs the bare JSON document on its own line
+        print(json.dumps(line, default=str))
+        return line
+
+
+def to_emf(line, namespace=METRICS_NAMESPACE):
+    """Wrap a trace line into the CloudWatch Embedded Metric Format."""
+    metrics = [{'Name': 'duration_ms', 'Unit': 'Milliseconds'}]
+    for name, value in line['spans_ms'].items():
+        line[f"{name}_ms"] = value
+        metrics.append({'Name': f"{name}_ms", 'Unit': 'Milliseconds'})
+    for name, unit in COUNTER_UNITS.items():
+        if name in line:
+            metrics.append({'Name': name, 'Unit': unit})
+    line['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': namespace,
+            'Dimensions': [['operation']],
+            'Metrics': metrics
+        }]
+    }
+    return line
+
+
+def emit_invocation(metrics, metrics_format=METRICS_FORMAT, namespace=METRICS_NAMESPACE):
+    """Print one line with the metrics of an invocation, under the `invocation` operation."""
+    line = {'type': 'invocation_trace', 'operation': 'invocation', **metrics}
+    if metrics_format == 'emf':
+        line['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['operation']],
+                'Metrics': [
+                    {'Name': name, 'Unit': unit} for name, unit in INVOCATION_UNITS.items()
+                    if line.get(name) is not None
+                ]
+            }]
+        }
+    print(json.dumps(line, default=str))
+    return line
+
+
+@contextmanager
+def record_trace(operation, document):
+    """Trace the processing of a record; the handler sets `trace.status` before leaving."""
+    trace = RecordTrace(operation, document)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.emit(trace.status)
+
+
+@contextmanager
+def span(name):
+    """Time a block under the trace of the record being processed, if any."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def count(name, value=1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def timed_iter(iterable, name):
+    """Account the time spent producing the items of a generator to span `name`."""
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
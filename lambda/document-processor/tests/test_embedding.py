@@ -0,0 +1,157 @@
+import pytest
+
+from embedding import AdaptiveRateLimiter, EmbeddingEngine, EmbeddingStats, is_retryable_error, is_throttling_error
+from fakes import FakeClientError, FakeThrottlingError
+
+
+class FakeClock:
+    """Clock whose time only moves when the code under test sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(clock, **kwargs):
+    return AdaptiveRateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_acquire_spends_the_burst_without_waiting():
+    clock = FakeClock()
+    limiter = make_limiter(clock, max_rate=10, burst=3)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+
+def test_acquire_waits_for_the_refill_once_the_burst_is_spent():
+    clock = FakeClock()
+    limiter = make_limiter(clock, max_rate=10, burst=1)
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(0.1)]
+
+
+def test_throttle_cuts_the_rate_down_to_the_minimum():
+    limiter = make_limiter(FakeClock(), max_rate=8, min_rate=1, decrease_factor=0.5)
+    limiter.on_throttle()
+    assert limiter.rate == 4
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.rate == 1
+    assert limiter.throttle_count == 6
+
+
+def test_throttle_empties_the_bucket():
+    clock = FakeClock()
+    limiter = make_limiter(clock, max_rate=10, burst=5)
+    limiter.on_throttle()
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(0.2)]
+
+
+def test_success_grows_the_rate_up_to_the_maximum():
+    limiter = make_limiter(FakeClock(), max_rate=4, initial_rate=2, increase_step=1)
+    limiter.on_success()
+    assert limiter.rate == 2.5
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.rate == 4
+
+
+@pytest.mark.parametrize('error', [
+    FakeThrottlingError(),
+    FakeClientError('TooManyRequestsException'),
+    ValueError("Error raised by bedrock service: An error occurred (ThrottlingException): Rate exceeded"),
+])
+def test_throttling_errors(error):
+    assert is_throttling_error(error)
+    assert is_retryable_error(error)
+
+
+def test_throttling_error_found_in_the_cause():
+    try:
+        try:
+            raise FakeThrottlingError()
+        except FakeThrottlingError as cause:
+            raise ValueError("Error raised by bedrock service") from cause
+    except ValueError as error:
+        assert is_throttling_error(error)
+
+
+@pytest.mark.parametrize('error', [
+    FakeClientError('ServiceUnavailableException'),
+    FakeClientError('ModelTimeoutException'),
+    ValueError("Error raised by bedrock service: InternalServerException"),
+])
+def test_transient_errors_are_retried_but_not_throttling(error):
+    assert not is_throttling_error(error)
+    assert is_retryable_error(error)
+
+
+@pytest.mark.parametrize('error', [
+    FakeClientError('ValidationException', 'Malformed input request'),
+    FakeClientError('AccessDeniedException'),
+    RuntimeError("Fake embedding failure"),
+])
+def test_other_errors_are_not_retried(error):
+    assert not is_throttling_error(error)
+    assert not is_retryable_error(error)
+
+
+class ScriptedEmbedder:
+    """Raises the queued errors first, then embeds every text as [len(text)]."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [[float(len(text))] for text in texts]
+
+
+def make_engine(embedder, **kwargs):
+    clock = FakeClock()
+    return EmbeddingEngine(
+        embedder, rate_limiter=make_limiter(clock, max_rate=100, burst=100), sleep=clock.sleep, **kwargs
+    )
+
+
+def test_engine_keeps_the_order_of_the_texts():
+    engine = make_engine(ScriptedEmbedder(), concurrency=4, batch_size=2)
+    assert engine.embed(['a', 'bbb', 'cc', 'dddd', 'e']) == [[1.0], [3.0], [2.0], [4.0], [1.0]]
+
+
+def test_engine_retries_throttling_and_slows_down():
+    embedder = ScriptedEmbedder([FakeThrottlingError(), FakeThrottlingError()])
+    engine = make_engine(embedder, concurrency=1)
+    stats = EmbeddingStats()
+    assert engine.embed(['abc'], stats) == [[3.0]]
+    assert (stats.calls, stats.retries, stats.throttles) == (3, 2, 2)
+    assert engine.rate_limiter.throttle_count == 2
+
+
+def test_engine_gives_up_after_max_retries():
+    embedder = ScriptedEmbedder([FakeClientError('ServiceUnavailableException')] * 3)
+    engine = make_engine(embedder, concurrency=1, max_retries=2)
+    with pytest.raises(FakeClientError):
+        engine.embed(['abc'])
+    assert embedder.calls == 3
+
+
+def test_engine_does_not_retry_other_errors():
+    embedder = ScriptedEmbedder([FakeClientError('ValidationException')])
+    engine = make_engine(embedder, concurrency=1)
+    with pytest.raises(FakeClientError):
+        engine.embed(['abc'])
+    assert embedder.calls == 1
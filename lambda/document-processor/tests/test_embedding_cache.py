@@ -0,0 +1,113 @@
+import pytest
+
+from embedding_cache import (
+    CacheStats,
+    EmbeddingCache,
+    LocalLRUCache,
+    S3CacheStore,
+    chunk_cache_key,
+    embed_with_cache,
+)
+from fakes import FakeClientError, FakeS3Client
+
+
+class RecordingEngine:
+    """EmbeddingEngine stand-in remembering the texts it was asked to embed."""
+
+    def __init__(self):
+        self.texts = []
+
+    def embed(self, texts, stats=None):
+        self.texts.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class BrokenStore:
+    def get_many(self, keys):
+        raise RuntimeError("unavailable")
+
+    def put_many(self, items):
+        raise RuntimeError("unavailable")
+
+
+def test_key_ignores_whitespace_and_unicode_form():
+    assert chunk_cache_key('model', 8, 'café  au\nlait') == chunk_cache_key('model', 8, 'café au lait')
+
+
+def test_key_depends_on_model_and_size():
+    keys = {chunk_cache_key('a', 8, 'text'), chunk_cache_key('b', 8, 'text'), chunk_cache_key('a', 16, 'text')}
+    assert len(keys) == 3
+
+
+def test_local_tier_evicts_the_least_recently_used(tmp_path):
+    cache = LocalLRUCache(str(tmp_path), max_entries=2)
+    cache.put_many({'aa1': [1.0], 'bb2': [2.0]})
+    assert cache.get_many(['aa1']) == {'aa1': [1.0]}
+    cache.put_many({'cc3': [3.0]})
+    assert cache.get_many(['aa1', 'bb2', 'cc3']) == {'aa1': [1.0], 'cc3': [3.0]}
+    assert len(cache) == 2
+
+
+def test_local_tier_index_is_rebuilt_from_the_directory(tmp_path):
+    LocalLRUCache(str(tmp_path)).put_many({'aa1': [0.5, -0.25]})
+    assert LocalLRUCache(str(tmp_path)).get_many(['aa1', 'bb2']) == {'aa1': [0.5, -0.25]}
+
+
+def test_s3_tier_round_trip_and_misses():
+    store = S3CacheStore(FakeS3Client(), 'bucket', concurrency=2)
+    store.put_many({'aa1': [1.0, 2.0]})
+    assert store.get_many(['aa1', 'bb2']) == {'aa1': [1.0, 2.0]}
+
+
+@pytest.mark.parametrize('code', ['NoSuchKey', 'AccessDenied'])
+def test_s3_tier_counts_missing_and_forbidden_keys_as_misses(code):
+    class Client(FakeS3Client):
+        def get_object(self, **kwargs):
+            raise FakeClientError(code, operation_name='GetObject')
+
+    assert S3CacheStore(Client(), 'bucket').get_many(['aa1']) == {}
+
+
+def test_s3_tier_raises_other_errors():
+    class Client(FakeS3Client):
+        def get_object(self, **kwargs):
+            raise FakeClientError('SlowDown', operation_name='GetObject')
+
+    with pytest.raises(FakeClientError):
+        S3CacheStore(Client(), 'bucket').get_many(['aa1'])
+
+
+def test_persistent_hits_are_promoted_to_the_local_tier(tmp_path):
+    persistent = S3CacheStore(FakeS3Client(), 'bucket')
+    persistent.put_many({'aa1': [1.0]})
+    local = LocalLRUCache(str(tmp_path))
+    cache = EmbeddingCache('model', 1, local=local, persistent=persistent)
+    stats = CacheStats()
+    assert cache.get_many(['aa1', 'bb2'], stats) == {'aa1': [1.0]}
+    assert (stats.local_hits, stats.persistent_hits, stats.misses) == (0, 1, 1)
+    assert local.get_many(['aa1']) == {'aa1': [1.0]}
+
+
+def test_broken_persistent_tier_counts_as_misses(tmp_path):
+    cache = EmbeddingCache('model', 2, local=LocalLRUCache(str(tmp_path)), persistent=BrokenStore())
+    engine = RecordingEngine()
+    vectors, stats = embed_with_cache(engine, cache, ['abc'])
+    assert vectors == [[3.0, 1.0]]
+    assert stats.misses == 1
+
+
+def test_embed_with_cache_only_embeds_new_unique_chunks(tmp_path):
+    cache = EmbeddingCache('model', 2, local=LocalLRUCache(str(tmp_path)))
+    engine = RecordingEngine()
+    embed_with_cache(engine, cache, ['one', 'two'])
+    vectors, stats = embed_with_cache(engine, cache, ['two', 'three', 'three', 'one '])
+    assert engine.texts == ['one', 'two', 'three']
+    assert vectors == [[3.0, 1.0], [5.0, 1.0], [5.0, 1.0], [3.0, 1.0]]
+    assert (stats.hits, stats.misses) == (2, 1)
+
+
+@pytest.mark.parametrize('texts', [[], ['a']])
+def test_embed_without_cache(texts):
+    engine = RecordingEngine()
+    vectors, _ = embed_with_cache(engine, None, texts)
+    assert len(vectors) == len(texts)
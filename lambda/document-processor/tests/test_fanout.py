@@ -0,0 +1,62 @@
+import pyarrow as pa
+
+from fanout import StagingStore, commit_staged, fanout_job_id
+from fakes import FakeS3Client
+from pipeline import chunk_ids
+
+MD5 = 'md5-of-user-and-bytes'
+
+
+def test_jobs_of_the_same_bytes_at_two_paths_do_not_share_staging():
+    first = fanout_job_id(MD5, 's3://documents/private/user/a.pdf')
+    second = fanout_job_id(MD5, 's3://documents/private/user/b.pdf')
+    staging = StagingStore(FakeS3Client(), 'bucket')
+    assert staging.key(first, 0) != staging.key(second, 0)
+
+
+def test_a_job_taking_over_gets_an_id_of_its_own():
+    s3_path = 's3://documents/private/user/a.pdf'
+    assert fanout_job_id(MD5, s3_path) == fanout_job_id(MD5, s3_path, 0)
+    assert fanout_job_id(MD5, s3_path, 1) != fanout_job_id(MD5, s3_path, 0)
+
+
+class ArrowTable:
+    """The LanceDB table calls of a fan-out commit, on one Arrow table per commit."""
+
+    def __init__(self):
+        self.commits = []
+
+    def add(self, rows):
+        self.commits.append(rows)
+
+    def delete(self, where):
+        self.commits.append(where)
+
+    def to_lance(self):
+        return self
+
+    def to_table(self, columns, filter):
+        return pa.concat_tables([rows for rows in self.commits if not isinstance(rows, str)] or
+                                [pa.table({'id': pa.array([], pa.string())})]).select(columns)
+
+
+def staged_part(texts):
+    return pa.table({'id': ['staged'] * len(texts), 'source': ['doc.pdf'] * len(texts), 'text': texts})
+
+
+def test_parts_are_committed_one_at_a_time_with_ids_over_the_whole_document():
+    table = ArrowTable()
+    parts = [['header', 'intro'], ['header', 'body']]
+    read = []
+
+    def staged():
+        for texts in parts:
+            # the previous part is written before the next one is read
+            assert len(table.commits) == len(read)
+            read.append(texts)
+            yield staged_part(texts)
+
+    assert commit_staged(table, staged(), 'doc.pdf') == (4, 4, 0)
+    ids = [row_id for rows in table.commits for row_id in rows.column('id').to_pylist()]
+    assert ids == [row_id for _, row_id in chunk_ids(['header', 'intro', 'header', 'body'], 'doc.pdf')]
+    assert commit_staged(table, iter([staged_part(texts) for texts in parts]), 'doc.pdf') == (4, 0, 0)
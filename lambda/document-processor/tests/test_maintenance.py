@@ -0,0 +1,25 @@
+from fakes import FakeClientError, FakeS3Client
+from maintenance import read_cursor, rotate_tables, write_cursor
+
+
+def test_tables_start_after_the_cursor():
+    assert rotate_tables(['c', 'a', 'b'], None) == ['a', 'b', 'c']
+    assert rotate_tables(['a', 'b', 'c'], 'a') == ['b', 'c', 'a']
+    assert rotate_tables(['a', 'b', 'c'], 'c') == ['a', 'b', 'c']
+    # the cursor table itself was deleted since
+    assert rotate_tables(['a', 'c'], 'b') == ['c', 'a']
+
+
+def test_cursor_round_trip():
+    s3_client = FakeS3Client()
+    assert read_cursor(s3_client, 'bucket') is None
+    write_cursor(s3_client, 'bucket', 'user-b')
+    assert read_cursor(s3_client, 'bucket') == 'user-b'
+
+
+def test_unreadable_cursor_starts_from_the_first_table():
+    class Client(FakeS3Client):
+        def get_object(self, **kwargs):
+            raise FakeClientError('SlowDown', operation_name='GetObject')
+
+    assert read_cursor(Client(), 'bucket') is None
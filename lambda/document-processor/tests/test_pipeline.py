@@ -0,0 +1,77 @@
+import re
+import uuid
+
+import pyarrow as pa
+from langchain.schema import Document
+
+import pipeline
+from embedding import EmbeddingEngine
+from fakes import FakeEmbedder
+from pipeline import chunk_ids
+
+
+def test_ids_do_not_depend_on_the_position_of_a_chunk():
+    before = dict(chunk_ids(['intro', 'body'], 'source'))
+    after = dict(chunk_ids(['new page', 'intro', 'body'], 'source'))
+    assert before.items() <= after.items()
+
+
+def test_identical_chunks_get_ids_of_their_own():
+    ids = [row_id for _, row_id in chunk_ids(['header', 'text', 'header'], 'source')]
+    assert len(set(ids)) == 3
+    assert ids != [row_id for _, row_id in chunk_ids(['header', 'text', 'header'], 'other')]
+
+
+class MemoryTable:
+    """The LanceDB table calls of an incremental update, on rows kept in a list."""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, rows):
+        self.rows.extend(rows)
+
+    def delete(self, where):
+        removed = set(re.findall(r"'([^']*)'", where))
+        self.rows = [row for row in self.rows if row['id'] not in removed]
+
+    def to_lance(self):
+        return self
+
+    def to_table(self, columns, filter):
+        source = re.search(r"'([^']*)'", filter).group(1)
+        rows = [row for row in self.rows if row['source'] == source]
+        return pa.table({column: [row[column] for row in rows] for column in columns})
+
+
+class LineSplitter:
+    def split_documents(self, pages):
+        return [
+            Document(page_content=line, metadata=dict(page.metadata))
+            for page in pages for line in page.page_content.splitlines()
+        ]
+
+
+def update(monkeypatch, table, lines):
+    pages = [Document(page_content='\n'.join(lines), metadata={'source': 'doc.pdf', 'page': 0})]
+    monkeypatch.setattr(pipeline, 'extract_pdf_pages', lambda file_path: iter(pages))
+    engine = EmbeddingEngine(FakeEmbedder(size=4, latency=0, jitter=0))
+    return pipeline.ingest_pdf_update('doc.pdf', LineSplitter(), table, engine)
+
+
+def test_updates_of_a_document_with_identical_chunks_keep_row_ids_unique(monkeypatch):
+    table = MemoryTable()
+    update(monkeypatch, table, ['header', 'header'])
+    stats = update(monkeypatch, table, ['header'])
+    assert (stats.reused, stats.removed) == (1, 1)
+    update(monkeypatch, table, ['header', 'header'])
+    ids = [row['id'] for row in table.rows]
+    assert sorted(ids) == sorted(row_id for _, row_id in chunk_ids(['header', 'header'], 'doc.pdf'))
+
+
+def test_legacy_rows_are_reused_by_their_text(monkeypatch):
+    table = MemoryTable()
+    table.add([{'id': str(uuid.uuid4()), 'source': 'doc.pdf', 'text': text} for text in ['intro', 'old']])
+    stats = update(monkeypatch, table, ['intro', 'body'])
+    assert (stats.reused, stats.chunks, stats.removed) == (1, 1, 1)
+    assert sorted(row['text'] for row in table.rows) == ['body', 'intro']
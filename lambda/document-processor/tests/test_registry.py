@@ -0,0 +1,219 @@
+import time
+import uuid
+
+import pytest
+
+from fakes import FakeDynamoDB, FakeDynamoTable
+from registry import STATUS_COMMITTED, STATUS_EMBEDDING, STATUS_PENDING, DocumentRegistry, IngestionInProgress
+
+INDEX = 's3_path_index'
+MD5 = 'md5-of-user-and-bytes'
+S3_PATH = 's3://documents/private/user/document.pdf'
+
+
+@pytest.fixture
+def table():
+    return FakeDynamoTable('md5', 's3_path', {INDEX: 's3_path'})
+
+
+@pytest.fixture
+def registry(table):
+    # tables are memoized per thread and name, every test gets a name of its own
+    name = f"registry-{uuid.uuid4()}"
+    return DocumentRegistry(name, INDEX, resource=lambda: FakeDynamoDB({name: table}))
+
+
+def row(table, md5_hash=MD5, s3_path=S3_PATH):
+    return table.items.get((md5_hash, s3_path))
+
+
+def expire_lease(table):
+    table.items[(MD5, S3_PATH)]['lease_until'] = int(time.time()) - 1
+
+
+def test_store_claims_a_pending_row_once(registry, table):
+    assert registry.store_file_info(MD5, 'user', S3_PATH, etag='"e"', size=10)
+    assert not registry.store_file_info(MD5, 'user', S3_PATH)
+    item = row(table)
+    assert item['status'] == STATUS_PENDING
+    assert item['lease_until'] > time.time()
+
+
+def test_only_committed_rows_count_as_processed(registry):
+    registry.store_file_info(MD5, 'user', S3_PATH, etag='"e"', size=10)
+    assert not registry.is_file_processed(MD5)
+    assert not registry.is_object_processed(S3_PATH, 'e', 10)
+    registry.checkpoint(MD5, S3_PATH, 40)
+    assert not registry.is_file_processed(MD5)
+
+    assert registry.commit_file_info(MD5, S3_PATH, 80)
+    registry.start_invocation()
+    assert registry.is_file_processed(MD5)
+    assert registry.is_object_processed(S3_PATH, 'e', 10)
+    assert not registry.is_object_processed(S3_PATH, 'other', 10)
+
+
+def test_rows_without_status_count_as_committed(registry, table):
+    table.put_item(Item={'md5': MD5, 's3_path': S3_PATH, 'user': 'user'})
+    assert registry.is_file_processed(MD5)
+
+
+def test_checkpoint_moves_the_row_to_embedding(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    assert registry.checkpoint(MD5, S3_PATH, 64)
+    assert (row(table)['status'], row(table)['chunks_committed']) == (STATUS_EMBEDDING, 64)
+
+
+def test_checkpoint_and_commit_of_a_deleted_row_fail(registry):
+    assert not registry.checkpoint(MD5, S3_PATH, 64)
+    assert not registry.commit_file_info(MD5, S3_PATH, 64)
+
+
+def test_commit_clears_the_lease(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.commit_file_info(MD5, S3_PATH, 80)
+    assert row(table)['status'] == STATUS_COMMITTED
+    assert 'lease_until' not in row(table)
+
+
+def test_store_leases_the_row_for_the_given_time(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH, lease_seconds=30)
+    assert row(table)['lease_until'] <= time.time() + 30
+
+
+def test_resume_takes_over_an_expired_lease(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.checkpoint(MD5, S3_PATH, 64)
+    expire_lease(table)
+    item = registry.resume_ingestion(MD5, S3_PATH, lease_seconds=120)
+    assert item['chunks_committed'] == 64
+    assert item['attempts'] == 1
+    assert time.time() < item['lease_until'] <= time.time() + 120
+
+
+@pytest.mark.parametrize('checkpointed', [False, True])
+def test_resume_of_a_leased_row_is_retried(registry, table, checkpointed):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    if checkpointed:
+        registry.checkpoint(MD5, S3_PATH, 64)
+    before = dict(row(table))
+    with pytest.raises(IngestionInProgress):
+        registry.resume_ingestion(MD5, S3_PATH)
+    assert row(table) == before
+
+
+def test_resume_of_a_committed_row_returns_none(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.commit_file_info(MD5, S3_PATH, 80)
+    assert registry.resume_ingestion(MD5, S3_PATH) is None
+    table.put_item(Item={'md5': MD5, 's3_path': S3_PATH, 'user': 'user'})
+    assert registry.resume_ingestion(MD5, S3_PATH) is None
+
+
+def test_resume_of_a_deleted_row_is_retried(registry):
+    with pytest.raises(IngestionInProgress):
+        registry.resume_ingestion(MD5, S3_PATH)
+
+
+def test_release_lets_the_next_delivery_resume_right_away(registry):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.release(MD5, S3_PATH)
+    assert registry.resume_ingestion(MD5, S3_PATH) is not None
+
+
+def test_memo_serves_the_lookups_of_an_invocation(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_invocation()
+    registry.prefetch_s3_paths([S3_PATH, S3_PATH])
+    requests = table.requests
+    assert registry.get_md5_by_s3_path(S3_PATH) == MD5
+    assert table.requests == requests
+    registry.start_invocation()
+    registry.get_md5_by_s3_path(S3_PATH)
+    assert table.requests == requests + 1
+
+
+def test_prefetch_threads_keep_their_resource_across_invocations(table):
+    name = f"registry-{uuid.uuid4()}"
+    resources = []
+
+    def resource():
+        resources.append(FakeDynamoDB({name: table}))
+        return resources[-1]
+
+    registry = DocumentRegistry(name, INDEX, resource=resource, prefetch_concurrency=2)
+    paths = [f"s3://documents/private/user/{index}.pdf" for index in range(8)]
+    for _ in range(3):
+        registry.start_invocation()
+        registry.prefetch_s3_paths(paths)
+    assert len(resources) <= 2
+
+
+def test_delete_file_infos_forgets_the_rows(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.commit_file_info(MD5, S3_PATH, 1)
+    assert registry.delete_file_infos([(MD5, S3_PATH)]) == []
+    assert row(table) is None
+    assert registry.get_file_infos_by_s3_path(S3_PATH) == []
+
+
+def test_delete_file_infos_sends_a_repeated_key_once(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.store_file_info('other-md5', 'user', S3_PATH)
+    keys = [(MD5, S3_PATH), ('other-md5', S3_PATH), (MD5, S3_PATH)]
+    assert registry.delete_file_infos(keys) == []
+    assert row(table) is None and row(table, 'other-md5') is None
+
+
+def test_fanout_parts_are_counted_once(registry):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_fanout(MD5, S3_PATH, 'job', 2)
+    assert registry.complete_fanout_part(MD5, S3_PATH, 'job', 0) == (1, 2)
+    assert registry.complete_fanout_part(MD5, S3_PATH, 'job', 0) == (1, 2)
+    assert registry.complete_fanout_part(MD5, S3_PATH, 'other-job', 1) is None
+    assert registry.complete_fanout_part(MD5, S3_PATH, 'job', 1) == (2, 2)
+
+
+def test_fanout_commits_once(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_fanout(MD5, S3_PATH, 'job', 1)
+    assert registry.finish_fanout(MD5, S3_PATH, 'job', 300)
+    assert not registry.finish_fanout(MD5, S3_PATH, 'job', 300)
+    item = row(table)
+    assert item['status'] == STATUS_COMMITTED
+    assert 'fanout_job' not in item
+
+
+def test_release_drops_the_fanout_job(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_fanout(MD5, S3_PATH, 'job', 3)
+    registry.release(MD5, S3_PATH)
+    assert 'fanout_job' not in row(table)
+    assert registry.complete_fanout_part(MD5, S3_PATH, 'job', 0) is None
+
+
+def test_running_fanout_job_is_not_taken_over(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_fanout(MD5, S3_PATH, 'job', 3)
+    assert row(table)['lease_until'] > time.time() + 300
+    with pytest.raises(IngestionInProgress):
+        registry.resume_ingestion(MD5, S3_PATH)
+
+
+def test_fanout_part_renews_the_lease(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_fanout(MD5, S3_PATH, 'job', 3)
+    expire_lease(table)
+    registry.complete_fanout_part(MD5, S3_PATH, 'job', 0)
+    assert row(table)['lease_until'] > time.time()
+
+
+def test_stale_fanout_job_is_taken_over(registry, table):
+    registry.store_file_info(MD5, 'user', S3_PATH)
+    registry.start_fanout(MD5, S3_PATH, 'job', 3)
+    registry.complete_fanout_part(MD5, S3_PATH, 'job', 0)
+    expire_lease(table)
+    item = registry.resume_ingestion(MD5, S3_PATH)
+    assert not {'fanout_job', 'fanout_parts', 'fanout_done'} & set(item)
+    # parts of the stale job still in the queue are dropped
+    assert registry.complete_fanout_part(MD5, S3_PATH, 'job', 1) is None
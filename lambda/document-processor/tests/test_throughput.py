@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+
+from fakes import FakeLambdaContext
+from fanout import part_record
+from throughput import DEFERRED_STATUS_CODE, DeadlineExceeded, ThroughputController, deferred_response
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_record(key='private/user/document.pdf', size=2**20):
+    return {'eventName': 'ObjectCreated:Put', 's3': {'bucket': {'name': 'b'}, 'object': {'key': key, 'size': size}}}
+
+
+def delete_record(key='private/user/document.pdf'):
+    return {'eventName': 'ObjectRemoved:Delete', 's3': {'bucket': {'name': 'b'}, 'object': {'key': key}}}
+
+
+def make_controller(clock, timeout_ms, records=0, overdue=(), **kwargs):
+    controller = ThroughputController(clock=clock, **kwargs)
+    controller.start_invocation(FakeLambdaContext(timeout_ms, clock=clock), records, overdue)
+    return controller
+
+
+def trace(operation, start, spans=None, **counters):
+    return SimpleNamespace(operation=operation, start=start, spans=spans or {}, counters=counters)
+
+
+def test_without_context_every_record_is_admitted():
+    controller = ThroughputController()
+    assert all(controller.admit(create_record(size=2**30)) for _ in range(10))
+    controller.check_deadline()
+
+
+def test_first_record_is_admitted_whatever_its_cost():
+    controller = make_controller(FakeClock(), timeout_ms=25000, safety_ms=20000)
+    assert controller.admit(create_record(size=2**30))
+
+
+def test_record_that_does_not_fit_is_deferred():
+    controller = make_controller(FakeClock(), timeout_ms=60000, safety_ms=20000)
+    assert controller.admit(create_record(size=2**20))
+    # 1 MiB is about 150 chunks at 100 ms, plus the fixed cost: 16.5 s, 40 s left
+    assert controller.admit(create_record(size=2**20))
+    assert not controller.admit(create_record(size=2**20 * 4))
+    assert controller.admit(delete_record())
+    summary = controller.summary()
+    assert (summary['records_started'], summary['records_deferred']) == (3, 1)
+
+
+def test_known_objects_cost_no_embedding():
+    controller = make_controller(FakeClock(), timeout_ms=30000, safety_ms=20000)
+    controller.admit(delete_record())
+    assert not controller.admit(create_record(size=2**20))
+    assert controller.admit(create_record(size=2**20), known=True)
+
+
+def test_overdue_records_are_always_admitted():
+    overdue = create_record(size=2**30)
+    controller = make_controller(FakeClock(), timeout_ms=30000, overdue=[overdue], safety_ms=20000)
+    controller.admit(delete_record())
+    assert not controller.admit(create_record(size=2**30))
+    assert controller.admit(overdue)
+
+
+def test_fanout_part_is_estimated_from_its_pages():
+    controller = ThroughputController()
+    job = {'bucket': 'b', 'key': 'private/user/big.pdf', 'md5': 'm', 's3_path': 's3://b/private/user/big.pdf'}
+    assert controller.estimate_chunks(part_record(job, 0, 100, 150)) == 150
+
+
+def test_check_deadline_raises_within_the_safety_margin():
+    clock = FakeClock()
+    controller = make_controller(clock, timeout_ms=60000, safety_ms=20000)
+    controller.check_deadline()
+    clock.now = 41
+    with pytest.raises(DeadlineExceeded):
+        controller.check_deadline()
+    assert controller.summary()['deadline_stops'] == 1
+
+
+def test_observe_learns_the_chunk_latency_and_fixed_cost():
+    clock = FakeClock()
+    controller = make_controller(clock, timeout_ms=300000, alpha=1.0)
+    clock.now = 3.0
+    controller.observe(trace('create', 0.0, {'embed': 2.0, 'lancedb_write': 0.5}, chunks=50, pages=10, bytes=2**19))
+    assert controller.chunk_ms == pytest.approx(50.0)
+    assert controller.record_ms['create'] == pytest.approx(500.0)
+    assert controller.chunks_per_page == pytest.approx(5.0)
+    assert controller.chunks_per_mib == pytest.approx(100.0)
+    assert controller.estimate_ms(create_record(size=2**20)) == pytest.approx(500.0 + 100 * 50.0)
+
+
+def test_summary_reports_capacity_and_time_used():
+    clock = FakeClock()
+    controller = make_controller(clock, timeout_ms=60000, records=2, safety_ms=20000)
+    controller.admit(delete_record())
+    clock.now = 10
+    summary = controller.summary()
+    assert summary['records'] == 2
+    assert summary['time_used'] == 0.25
+    assert summary['record_capacity'] == int(40000 // 300)
+
+
+def test_deferred_response_is_a_retryable_failure():
+    response = deferred_response(create_record(key='private/user/a+b.pdf'))
+    assert response['statusCode'] == DEFERRED_STATUS_CODE
+    assert response['document'] == 'private/user/a b.pdf'
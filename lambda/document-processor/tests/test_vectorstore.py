@@ -0,0 +1,39 @@
+from vectorstore import TableCache
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.opened = 0
+
+    def table_names(self):
+        return ['user']
+
+    def open_table(self, name):
+        self.opened += 1
+        return (name, self.opened)
+
+
+def make_cache(latest):
+    databases = []
+
+    def connect(db_path):
+        databases.append(FakeDatabase())
+        return databases[-1]
+
+    return TableCache(connect=connect, clock=lambda: 0.0, is_latest=lambda table: latest[0]), databases
+
+
+def test_a_current_table_is_reused():
+    cache, databases = make_cache([True])
+    table = cache.get('s3://bucket/embeddings/user', 'user')
+    assert cache.get('s3://bucket/embeddings/user', 'user') is table
+    assert (cache.hits, cache.misses, databases[0].opened) == (1, 1, 1)
+
+
+def test_a_table_committed_to_by_another_writer_is_reopened_on_the_cached_connection():
+    latest = [True]
+    cache, databases = make_cache(latest)
+    table = cache.get('s3://bucket/embeddings/user', 'user')
+    latest[0] = False
+    assert cache.get('s3://bucket/embeddings/user', 'user') != table
+    assert (len(databases), databases[0].opened, cache.hits) == (1, 2, 0)
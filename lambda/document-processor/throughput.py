@@ -0,0 +1,186 @@
+import os
+import time
+import threading
+import urllib.parse
+
+from fanout import FANOUT_MIN_PAGES, is_fanout_record
+
+# Time kept free at the end of an invocation, to stop between batches, flush notifications and answer SQS
+DEADLINE_SAFETY_MS = int(os.environ.get('DEADLINE_SAFETY_MS', '20000'))
+# Messages received this many times are started even when they may not fit, so that
+# deferrals alone never send them to the dead letter queue (maxReceiveCount is 5)
+DEFER_MAX_RECEIVES = int(os.environ.get('DEFER_MAX_RECEIVES', '3'))
+# Weight of the latest record in the moving averages of the processing costs
+THROUGHPUT_EWMA_ALPHA = float(os.environ.get('THROUGHPUT_EWMA_ALPHA', '0.3'))
+
+# spans that grow with the number of chunks of a document, the rest of a record is fixed cost
+CHUNK_SPANS = ['load_split', 'embed', 'lancedb_write', 'fts_write', 'staging_write']
+# starting points of the estimates, until the container has seen records of its own
+INITIAL_CHUNK_MS = 100.0
+INITIAL_CHUNKS_PER_MIB = 150.0
+INITIAL_CHUNKS_PER_PAGE = 3.0
+INITIAL_RECORD_MS = {'create': 1500.0, 'fanout_part': 1500.0, 'delete': 300.0}
+
+DEFERRED_STATUS_CODE = 503
+
+
+class DeadlineExceeded(Exception):
+    """Raised between batches of an ingestion when the invocation is about to time out."""
+
+
+def ewma(previous, value, alpha=THROUGHPUT_EWMA_ALPHA):
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+def record_operation(s3_record):
+    if is_fanout_record(s3_record):
+        return 'fanout_part'
+    return 'delete' if s3_record.get('eventName', '').startswith('ObjectRemoved') else 'create'
+
+
+def deferred_response(s3_record):
+    """Response of a record that was not started, its message is returned to the queue."""
+    return {
+        'statusCode': DEFERRED_STATUS_CODE,
+        'body': 'Not started, not enough time left in the invocation',
+        'document': urllib.parse.unquote_plus(s3_record['s3']['object']['key']),
+        'type': 'deferred'
+    }
+
+
+class ThroughputController:
+    """Decide which records an invocation takes on, from its remaining time and observed costs.
+
+    The cost of a record is estimated as a fixed cost per operation plus its
+    expected chunks times the latency per chunk, all moving averages of the
+    record traces of the container, so they follow Bedrock throttling and
+    survive warm invocations. A record is started only when its estimate
+    fits in the remaining time minus `safety_ms`. The first record of an
+    invocation always is, and so are the records of messages received
+    `max_receives` times, so a costly record cannot be deferred forever.
+    Ingestions check the deadline between batches and stop cleanly, to be
+    resumed by the retry. Thread safe, records of several tables may be
+    processed in parallel.
+    """
+
+    def __init__(self, safety_ms=DEADLINE_SAFETY_MS, max_receives=DEFER_MAX_RECEIVES, alpha=THROUGHPUT_EWMA_ALPHA,
+                 clock=time.monotonic):
+        self.safety_ms = safety_ms
+        self.max_receives = max_receives
+        self.alpha = alpha
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.chunk_ms = None
+        self.chunks_per_mib = None
+        self.chunks_per_page = None
+        self.record_ms = {}
+        self.start_invocation(None)
+
+    def start_invocation(self, context, records=0, overdue=()):
+        """Start the accounting of an invocation; `overdue` are the records to start whatever their cost."""
+        with self._lock:
+            self._context = context
+            self._overdue = {id(s3_record) for s3_record in overdue}
+            self._started_at = self._clock()
+            self._start_remaining_ms = self.remaining_ms()
+            self.received = records
+            self.started = 0
+            self.deferred = 0
+            self.deadline_stops = 0
+            self._estimated_ms = 0.0
+
+    def remaining_ms(self):
+        """Time left in the invocation, None without a Lambda context (no deadline)."""
+        if self._context is None:
+            return None
+        return self._context.get_remaining_time_in_millis()
+
+    def estimate_chunks(self, s3_record):
+        chunks_per_page = self.chunks_per_page or INITIAL_CHUNKS_PER_PAGE
+        if is_fanout_record(s3_record):
+            part = s3_record['fanout']
+            return (part['last_page'] - part['first_page']) * chunks_per_page
+        size = s3_record['s3']['object'].get('size') or 0
+        chunks = size / 2**20 * (self.chunks_per_mib or INITIAL_CHUNKS_PER_MIB)
+        # documents from FANOUT_MIN_PAGES pages are split into parts, the create does not embed them
+        return min(chunks, FANOUT_MIN_PAGES * chunks_per_page)
+
+    def estimate_ms(self, s3_record, known=False):
+        """Expected processing time of a record, in milliseconds. `known` objects were ingested
+        already, their create costs no embedding."""
+        operation = record_operation(s3_record)
+        fixed = self.record_ms.get(operation, INITIAL_RECORD_MS[operation])
+        if operation == 'delete' or known:
+            return fixed
+        return fixed + self.estimate_chunks(s3_record) * (self.chunk_ms or INITIAL_CHUNK_MS)
+
+    def admit(self, s3_record, known=False):
+        """True when the record should be started, False to leave it to a later invocation."""
+        estimate = self.estimate_ms(s3_record, known)
+        remaining = self.remaining_ms()
+        with self._lock:
+            if (
+                remaining is not None and self.started > 0 and id(s3_record) not in self._overdue
+                and remaining - self.safety_ms < estimate
+            ):
+                self.deferred += 1
+                return False
+            self.started += 1
+            self._estimated_ms += estimate
+            return True
+
+    def defer(self, count=1):
+        """Count records not started because a record before them in their group was deferred."""
+        with self._lock:
+            self.deferred += count
+
+    def check_deadline(self):
+        """Raise DeadlineExceeded when the invocation is within `safety_ms` of its timeout."""
+        remaining = self.remaining_ms()
+        if remaining is not None and remaining < self.safety_ms:
+            with self._lock:
+                self.deadline_stops += 1
+            raise DeadlineExceeded(f"{remaining} ms left in the invocation")
+
+    def observe(self, trace):
+        """Update the cost estimates with the trace of a processed record."""
+        chunk_seconds = sum(trace.spans.get(name, 0.0) for name in CHUNK_SPANS)
+        chunks = trace.counters.get('chunks', 0)
+        stored = chunks + trace.counters.get('chunks_reused', 0)
+        duration_ms = (self._clock() - trace.start) * 1000
+        with self._lock:
+            if trace.operation in INITIAL_RECORD_MS:
+                self.record_ms[trace.operation] = ewma(
+                    self.record_ms.get(trace.operation), max(0.0, duration_ms - chunk_seconds * 1000), self.alpha
+                )
+            if chunks:
+                self.chunk_ms = ewma(self.chunk_ms, chunk_seconds * 1000 / chunks, self.alpha)
+            if stored and trace.counters.get('pages'):
+                self.chunks_per_page = ewma(self.chunks_per_page, stored / trace.counters['pages'], self.alpha)
+            if stored and trace.operation == 'create' and trace.counters.get('bytes'):
+                self.chunks_per_mib = ewma(
+                    self.chunks_per_mib, stored / (trace.counters['bytes'] / 2**20), self.alpha
+                )
+
+    def summary(self, embedding_rate=None):
+        """Backpressure metrics of the invocation, for tuning the batch size and concurrency."""
+        with self._lock:
+            elapsed_ms = (self._clock() - self._started_at) * 1000
+            record_ms = self._estimated_ms / self.started if self.started else None
+            line = {
+                'records': self.received,
+                'records_started': self.started,
+                'records_deferred': self.deferred,
+                'deadline_stops': self.deadline_stops,
+                'elapsed_ms': round(elapsed_ms, 1),
+                'chunk_ms': round(self.chunk_ms, 1) if self.chunk_ms is not None else None,
+                'estimated_record_ms': round(record_ms, 1) if record_ms is not None else None,
+                'embedding_rate': round(embedding_rate, 2) if embedding_rate is not None else None,
+            }
+            if self._start_remaining_ms is not None:
+                budget_ms = max(0, self._start_remaining_ms - self.safety_ms)
+                line['remaining_ms'] = self.remaining_ms()
+                line['time_used'] = round(elapsed_ms / budget_ms, 3) if budget_ms else None
+                # records of this kind one invocation can take on; a batch size above it gets deferrals
+                line['record_capacity'] = int(budget_ms // record_ms) if record_ms else None
+            return line
@@ -0,0 +1,104 @@
+import os
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the reads from the S3 response stream, and of the writes to /tmp
+DOWNLOAD_BUFFER_SIZE = int(os.environ.get('DOWNLOAD_BUFFER_SIZE', str(1024 * 1024)))
+# Objects from this size on are fetched with parallel ranged GETs
+DOWNLOAD_MULTIPART_THRESHOLD = int(os.environ.get('DOWNLOAD_MULTIPART_THRESHOLD', str(16 * 1024 * 1024)))
+DOWNLOAD_PART_SIZE = int(os.environ.get('DOWNLOAD_PART_SIZE', str(8 * 1024 * 1024)))
+DOWNLOAD_CONCURRENCY = int(os.environ.get('DOWNLOAD_CONCURRENCY', '4'))
+
+
+class DownloadResult:
+    """Digest, size and ETag of a downloaded object."""
+
+    def __init__(self, md5, size, etag):
+        self.md5 = md5
+        self.size = size
+        self.etag = etag
+
+
+def normalize_etag(etag):
+    """S3 returns ETags quoted, S3 event notifications do not."""
+    return etag.strip('"') if etag else etag
+
+
+def _stream_body(body, buffer_size):
+    for chunk in iter(lambda: body.read(buffer_size), b''):
+        yield chunk
+
+
+def _get_range(s3_client, bucket, key, start, end, etag, buffer_size):
+    params = {'Bucket': bucket, 'Key': key, 'Range': f"bytes={start}-{end}"}
+    if etag:
+        # fail instead of stitching together parts of two versions of the object
+        params['IfMatch'] = f'"{normalize_etag(etag)}"'
+    response = s3_client.get_object(**params)
+    return b''.join(_stream_body(response['Body'], buffer_size))
+
+
+def _iter_parts(s3_client, bucket, key, size, etag, part_size, concurrency, buffer_size):
+    """Yield the parts of an object in order, fetching up to `concurrency` parts ahead.
+
+    Parts arrive out of order but MD5 is sequential, so only a window of
+    `concurrency` parts is kept in memory while the oldest one is awaited.
+    """
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_get_range, s3_client, bucket, key, start, end, etag, buffer_size))
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def download_and_hash(s3_client, bucket, key, download_path, prefix=b'', size=None,
+                      buffer_size=DOWNLOAD_BUFFER_SIZE,
+                      multipart_threshold=DOWNLOAD_MULTIPART_THRESHOLD,
+                      part_size=DOWNLOAD_PART_SIZE,
+                      concurrency=DOWNLOAD_CONCURRENCY):
+    """Download an S3 object to `download_path` and hash it in the same pass.
+
+    The digest is md5(prefix + bytes), so the file is never read back from
+    disk. `size` comes from the event record when known; objects of at least
+    `multipart_threshold` bytes are fetched with parallel ranged GETs of the
+    same version. The returned size and ETag are those of the downloaded
+    version.
+    """
+    hash_md5 = hashlib.md5()
+    hash_md5.update(prefix)
+    written = 0
+    with open(download_path, 'wb') as f:
+        if size is None or (size >= multipart_threshold and concurrency > 1):
+            # the event may be older than the object, ranges are planned on its current version
+            head = s3_client.head_object(Bucket=bucket, Key=key)
+            size, etag = head['ContentLength'], head.get('ETag')
+        if size >= multipart_threshold and concurrency > 1:
+            chunks = _iter_parts(s3_client, bucket, key, size, etag, part_size, concurrency, buffer_size)
+        else:
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+            size, etag = response['ContentLength'], response.get('ETag')
+            chunks = _stream_body(response['Body'], buffer_size)
+        for chunk in chunks:
+            hash_md5.update(chunk)
+            f.write(chunk)
+            written += len(chunk)
+
+    if written != size:
+        raise IOError(f"Downloaded {written} bytes of s3://{bucket}/{key}, expected {size}")
+    return DownloadResult(hash_md5.hexdigest(), written, normalize_etag(etag))
+
+
+def is_same_object(item, etag, size):
+    """True when a registry item was ingested from an object with this ETag and size."""
+    if not item or not etag or size is None:
+        return False
+    stored_etag = item.get('etag')
+    stored_size = item.get('size')
+    if stored_etag is None or stored_size is None:
+        return False
+    return normalize_etag(stored_etag) == normalize_etag(etag) and int(stored_size) == int(size)
@@ -0,0 +1,161 @@
+import os
+import logging
+import time
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Open LanceDB tables kept per container, and how long before they are reopened
+LANCEDB_TABLE_CACHE_SIZE = int(os.environ.get('LANCEDB_TABLE_CACHE_SIZE', '32'))
+LANCEDB_TABLE_TTL_SECONDS = float(os.environ.get('LANCEDB_TABLE_TTL_SECONDS', '300'))
+
+_schemas = {}
+
+
+def get_schema(embedding_size):
+    """Schema of a user table, built once per embedding size."""
+    if embedding_size not in _schemas:
+        import pyarrow as pa
+        _schemas[embedding_size] = pa.schema(
+            [
+                pa.field("vector", pa.list_(pa.float32(), embedding_size)),
+                pa.field("text", pa.string()),
+                pa.field("id", pa.string()),
+                pa.field("source", pa.string()),
+                pa.field("page", pa.string())
+            ]
+        )
+    return _schemas[embedding_size]
+
+
+def connect_lancedb(db_path):
+    """lancedb (and pyarrow) are imported on the first connection, not at cold start."""
+    import lancedb
+    return lancedb.connect(db_path)
+
+
+def get_db_path(bucket, lance_table):
+    """Every user has their own LanceDB database under embeddings/<cognito_sub>."""
+    return f"s3://{bucket}/embeddings/{lance_table}"
+
+
+def sql_literal(value):
+    """Quote a string for a LanceDB filter predicate."""
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def is_latest_version(table):
+    """True when no other writer committed to the table since its handle was opened."""
+    dataset = table.to_lance()
+    return dataset.version == dataset.latest_version
+
+
+class _CachedTable:
+    def __init__(self, db, table, opened_at):
+        self.db = db
+        self.table = table
+        self.opened_at = opened_at
+
+
+class TableCache:
+    """LRU cache of open LanceDB connections and tables, kept across warm invocations.
+
+    A cached table is reopened on its cached connection when another writer
+    (another container, compaction) committed a newer version, since
+    incremental updates and fan-out commits diff against the rows they read.
+    Entries are dropped after `ttl` seconds, and with `invalidate` whenever a
+    write fails.
+    """
+
+    def __init__(self, max_size=LANCEDB_TABLE_CACHE_SIZE, ttl=LANCEDB_TABLE_TTL_SECONDS,
+                 connect=connect_lancedb, clock=time.monotonic, is_latest=is_latest_version):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._connect = connect
+        self._clock = clock
+        self._is_latest = is_latest
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._clock() - entry.opened_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, db_path, name, schema=None):
+        """Return the open table `name` of the database at `db_path`.
+
+        If the table does not exist it is created with `schema`, or None is
+        returned when no schema is given.
+        """
+        key = (db_path, name)
+        entry = self._lookup(key)
+        # one listing of the table versions, outside the lock
+        if entry is not None and self._is_latest(entry.table):
+            with self._lock:
+                self.hits += 1
+            return entry.table
+
+        db = entry.db if entry is not None else self._connect(db_path)
+        if name in db.table_names():
+            table = db.open_table(name)
+        elif schema is not None:
+            logger.info(f"Creating LanceDB table {name} in {db_path}")
+            table = db.create_table(name, schema=schema)
+        else:
+            return None
+
+        self._store(key, _CachedTable(db, table, self._clock()))
+        return table
+
+    def invalidate(self, db_path, name=None):
+        """Drop a cached table, or every table of the database when `name` is None."""
+        with self._lock:
+            if name is not None:
+                self._entries.pop((db_path, name), None)
+                return
+            for key in [key for key in self._entries if key[0] == db_path]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+table_cache = TableCache()
+
+
+def open_user_table(bucket, lance_table, embedding_size=None, cache=None):
+    """Open (and create, when `embedding_size` is given) the LanceDB table of a user."""
+    cache = cache or table_cache
+    schema = get_schema(embedding_size) if embedding_size else None
+    return cache.get(get_db_path(bucket, lance_table), lance_table, schema)
+
+
+def invalidate_user_table(bucket, lance_table, cache=None):
+    """Drop the cached handles of a user table and of its sidecar tables (e.g. the full-text index)."""
+    cache = cache or table_cache
+    cache.invalidate(get_db_path(bucket, lance_table))
+
+
+def reopen_user_table(bucket, lance_table, cache=None):
+    """Drop the cached handle of a user table and open its latest version."""
+    invalidate_user_table(bucket, lance_table, cache)
+    return open_user_table(bucket, lance_table, cache=cache)
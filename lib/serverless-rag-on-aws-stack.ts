@@ -21,6 +21,8 @@ import {
   aws_lambda_nodejs as node,
   DockerImage,
   aws_ssm as ssm,
+  aws_events as events,
+  aws_events_targets as targets,
 } from 'aws-cdk-lib';
 
 import * as path from "path";
@@ -71,6 +73,19 @@ export class ServerlessRagOnAws extends Stack {
       encryption: s3.BucketEncryption.S3_MANAGED,
       removalPolicy: RemovalPolicy.DESTROY,
       autoDeleteObjects: true,
+      lifecycleRules: [
+        {
+          // rows staged by the parts of a large document that never committed
+          prefix: "staging/",
+          expiration: Duration.days(7),
+        },
+        {
+          // embeddings cached by the document processor, rewritten on the next miss
+          prefix: "embedding-cache/",
+          expiration: Duration.days(30),
+          noncurrentVersionExpiration: Duration.days(1),
+        },
+      ],
     });
 
     // create a s3 bucket for documents to be ingested into the vector store
@@ -341,7 +356,8 @@ export class ServerlessRagOnAws extends Stack {
         file: 'Dockerfile',
       }),
       architecture: lambda.Architecture.X86_64,
-      memorySize: 2048,
+      // two full vCPUs (1769 MB each), so large PDFs are parsed by two processes (PDF_EXTRACT_PROCESSES)
+      memorySize: 3584,
       // we want to limit the maximum number of concurrent executions to one until LanceDB supports concurrent writers
       // As of now, LanceDB provides a solution for concurrents write but in experimental mode:
       // https://lancedb.github.io/lance/read_and_write.html#concurrent-writer-on-s3-using-dynamodb
@@ -356,19 +372,35 @@ export class ServerlessRagOnAws extends Stack {
         LANCEDB_BUCKET: lanceDbVectorBucket.bucketName,
         EMBEDDING_MODEL: embedding.model,
         EMBEDDING_SIZE: `${embedding.size}`,
+        // failed messages are reported back through batchItemFailures
+        SQS_BATCH_RESPONSE: 'partial',
       },
     });
 
     // event source mapping for SQS queue
     const sqsEventSource = new lambdaEventSources.SqsEventSource(queue, {
-      batchSize: 5
+      batchSize: 5,
+      reportBatchItemFailures: true,
     });
 
     lambdaDocumentProcessorFunction_Docker.addEventSource(sqsEventSource);
 
+    // periodic compaction, version cleanup and vector indexing of the LanceDB tables
+    // runs on the processor itself so it never overlaps with ingestion
+    new events.Rule(this, 'LanceDbMaintenanceSchedule', {
+      schedule: events.Schedule.rate(Duration.hours(6)),
+      targets: [
+        new targets.LambdaFunction(lambdaDocumentProcessorFunction_Docker, {
+          event: events.RuleTargetInput.fromObject({ maintenance: {} }),
+        }),
+      ],
+    });
+
     documentRegistryTable.grantReadWriteData(lambdaDocumentProcessorFunction_Docker);
     websocketStateTable.grantReadWriteData(lambdaDocumentProcessorFunction_Docker);
     queue.grantConsumeMessages(lambdaDocumentProcessorFunction_Docker);
+    // the parts of large documents are sent back to the queue
+    queue.grantSendMessages(lambdaDocumentProcessorFunction_Docker);
     lanceDbVectorBucket.grantReadWrite(lambdaDocumentProcessorFunction_Docker);
     lanceDbVectorBucket.grantDelete(lambdaDocumentProcessorFunction_Docker);
     documentsBucket.grantReadWrite(lambdaDocumentProcessorFunction_Docker);
@@ -102,6 +102,19 @@ function WebSocketManager({ user, websocketURL, websocketStateTable, region, toa
         const {message, level } = data;
         const messageLevel = level || "info";
         toast[messageLevel](message);
+        return;
+      }
+
+      // one toast per document, its progress bar updated in place
+      if (type === "progress") {
+        const {document, percent, message} = data;
+        const toastId = `progress-${document}`;
+        const progress = Math.min(Math.max(percent, 0), 100) / 100;
+        if (toast.isActive(toastId)) {
+          toast.update(toastId, { render: message, progress });
+        } else {
+          toast.info(message, { toastId, progress });
+        }
       }
     }
   }, [lastMessage, toast]);